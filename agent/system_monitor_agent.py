@@ -1,13 +1,21 @@
 import psutil
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import socket
 import sys
 import os
 import platform
+import gzip
+import hashlib
+import heapq
+import math
+import queue
+import threading
+from collections import deque, namedtuple
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import logging
 
 logging.basicConfig(
@@ -46,6 +54,817 @@ def get_cpu_brand():
         logger.warning(f"Could not get CPU brand: {e}")
     return platform.processor() or f"{system} CPU"
 
+# Static host description, sent only when its fingerprint changes
+INVENTORY_FIELDS = ('operating_system', 'processor', 'processor_cores', 'processor_threads')
+
+def inventory_fingerprint(inventory: Dict[str, Any]) -> str:
+    # Same hash as the backend computes from the inventory it stores
+    canonical = json.dumps({field: inventory[field] for field in INVENTORY_FIELDS}, sort_keys=True)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+PAYLOAD_ENCODINGS = ('json', 'gzip', 'columnar')
+COLUMNAR_MEDIA_TYPE = 'application/vnd.process-monitor.columnar+json'
+COLUMNAR_KEYS = ('processes', 'added', 'changed')
+# Statuses meaning the backend has the report: written (200) or queued for writing (202)
+DELIVERED_STATUSES = (200, 202)
+
+def encode_columns(processes: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    # One array per field so field names are sent once instead of once per process
+    fields = []
+    for proc in processes:
+        for key in proc:
+            if key not in fields:
+                fields.append(key)
+    return {field: [proc.get(field) for proc in processes] for field in fields}
+
+def encode_report_columns(report: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **report,
+        **{key: encode_columns(report[key]) for key in COLUMNAR_KEYS if key in report}
+    }
+
+def encode_payload(payload: Dict[str, Any], encoding: str) -> tuple:
+    # Returns (body, headers) for the given payload encoding
+    if encoding == 'columnar':
+        if 'reports' in payload:
+            payload = {**payload, 'reports': [encode_report_columns(report) for report in payload['reports']]}
+        else:
+            payload = encode_report_columns(payload)
+        content_type = COLUMNAR_MEDIA_TYPE
+    else:
+        content_type = 'application/json'
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    headers = {'Content-Type': content_type}
+    if encoding in ('gzip', 'columnar'):
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+# kthreadd, the parent of every Linux kernel thread, and pid 0, the idle task. Only
+# Linux has kthreadd; elsewhere pid 2 is an ordinary process and pid 0 is the idle
+# task (Windows) or the kernel itself (macOS), so nothing counts as a kernel thread.
+KERNEL_THREAD_PARENT = 2
+KERNEL_PIDS = (0, KERNEL_THREAD_PARENT)
+HAS_KERNEL_THREADS = sys.platform.startswith('linux')
+
+def is_kernel_thread(proc: Dict[str, Any]) -> bool:
+    if not HAS_KERNEL_THREADS:
+        return False
+    return proc['pid'] in KERNEL_PIDS or proc.get('parent_pid') == KERNEL_THREAD_PARENT
+
+def select_processes(processes: List[Dict[str, Any]], max_processes: Optional[int] = None,
+                     include_system_processes: bool = True) -> tuple:
+    # Returns (processes to send, totals of the others or None). Idle kernel threads are
+    # dropped unless include_system_processes. Beyond max_processes, the busiest processes
+    # are taken alternately from the top-N by CPU and by memory (heaps, not a full sort).
+    # Every kept process brings the ancestors it needs, so the tree stays connected; when
+    # the rest of the budget cannot hold the whole chain, the process keeps its nearest
+    # ancestors and the topmost of them is re-parented to its nearest kept ancestor (or
+    # made a root), so a deep chain never crowds out everything.
+    candidates = processes
+    if not include_system_processes:
+        candidates = [proc for proc in processes if not (is_kernel_thread(proc) and not proc['cpu_percent'])]
+    limit = max_processes or len(processes)
+    if len(candidates) == len(processes) and len(processes) <= limit:
+        return processes, None
+    if len(candidates) > limit:
+        ranked = (
+            proc
+            for pair in zip(
+                heapq.nlargest(limit, candidates, key=lambda proc: proc['cpu_percent']),
+                heapq.nlargest(limit, candidates, key=lambda proc: proc['memory_mb'])
+            )
+            for proc in pair
+        )
+    else:
+        ranked = candidates
+    # Dropped kernel threads are not pulled back in as ancestors
+    by_pid = {proc['pid']: proc for proc in candidates}
+    selected = set()
+    for proc in ranked:
+        # The process plus its ancestors not selected yet
+        chain = []
+        pid = proc['pid']
+        while pid in by_pid and pid not in selected and pid not in chain:
+            chain.append(pid)
+            pid = by_pid[pid].get('parent_pid')
+        selected.update(chain[:limit - len(selected)])
+        if len(selected) >= limit:
+            break
+    # Collection order, as without a limit
+    kept = [reparent(proc, by_pid, selected) for proc in processes if proc['pid'] in selected]
+    omitted = [proc for proc in processes if proc['pid'] not in selected]
+    return kept, {
+        'count': len(omitted),
+        'cpu_percent': round(sum(proc['cpu_percent'] for proc in omitted), 2),
+        'memory_mb': round(sum(proc['memory_mb'] for proc in omitted), 2)
+    }
+
+def reparent(proc: Dict[str, Any], by_pid: Dict[int, Dict[str, Any]], selected: set) -> Dict[str, Any]:
+    # `proc` with parent_pid moved to its nearest ancestor in `selected`, or None, when
+    # its parent was collected but left out. A parent that was never collected stays.
+    parent_pid = proc.get('parent_pid')
+    if parent_pid not in by_pid or parent_pid in selected:
+        return proc
+    seen = {proc['pid']}
+    while parent_pid in by_pid and parent_pid not in selected and parent_pid not in seen:
+        seen.add(parent_pid)
+        parent_pid = by_pid[parent_pid].get('parent_pid')
+    return {**proc, 'parent_pid': parent_pid if parent_pid in selected else None}
+
+class DeltaEncoder:
+    # Tracks the process list the backend last stored and encodes each report as
+    # the processes added, removed or materially changed since then.
+    # Processes are keyed by (pid, created_time) so a reused pid is a new process.
+    IDENTITY_FIELDS = ('parent_pid', 'name', 'status', 'username', 'command_line')
+
+    def __init__(self, full_resync_interval: int = 10, cpu_threshold: float = 1.0,
+                 memory_threshold_mb: float = 5.0):
+        self.full_resync_interval = max(1, int(full_resync_interval))
+        self.cpu_threshold = cpu_threshold
+        self.memory_threshold_mb = memory_threshold_mb
+        self.sequence = 0
+        self.acked_sequence = None
+        self.baseline = {}
+        self.reports_since_full = 0
+
+    @staticmethod
+    def key(proc: Dict[str, Any]) -> tuple:
+        return (proc['pid'], proc.get('created_time'))
+
+    def reset(self):
+        # Next report is a full snapshot
+        self.acked_sequence = None
+        self.baseline = {}
+
+    def needs_full(self) -> bool:
+        return self.acked_sequence is None or self.reports_since_full >= self.full_resync_interval
+
+    def has_changed(self, old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+        if abs(new.get('cpu_percent', 0.0) - old.get('cpu_percent', 0.0)) >= self.cpu_threshold:
+            return True
+        if abs(new.get('memory_mb', 0.0) - old.get('memory_mb', 0.0)) >= self.memory_threshold_mb:
+            return True
+        return any(old.get(field) != new.get(field) for field in self.IDENTITY_FIELDS)
+
+    def encode_full(self, process_data: List[Dict[str, Any]]) -> tuple:
+        self.sequence += 1
+        current = {self.key(proc): proc for proc in process_data}
+        fields = {'mode': 'full', 'sequence': self.sequence, 'processes': process_data}
+        return fields, (self.sequence, current, True)
+
+    def encode(self, process_data: List[Dict[str, Any]]) -> tuple:
+        # Returns (payload fields, pending state to pass to acknowledge() once accepted)
+        if self.needs_full():
+            return self.encode_full(process_data)
+        self.sequence += 1
+        current = {self.key(proc): proc for proc in process_data}
+        added, changed, removed = [], [], []
+        baseline = {}
+        for key, proc in current.items():
+            old = self.baseline.get(key)
+            if old is None:
+                added.append(proc)
+                baseline[key] = proc
+            elif self.has_changed(old, proc):
+                changed.append(proc)
+                baseline[key] = proc
+            else:
+                # Unchanged processes keep the values the backend already has
+                baseline[key] = old
+        for key in self.baseline:
+            if key not in current:
+                removed.append({'pid': key[0], 'created_time': key[1]})
+        fields = {
+            'mode': 'delta',
+            'sequence': self.sequence,
+            'baseline_sequence': self.acked_sequence,
+            'added': added,
+            'changed': changed,
+            'removed': removed
+        }
+        return fields, (self.sequence, baseline, False)
+
+    def acknowledge(self, pending: tuple):
+        sequence, baseline, is_full = pending
+        self.acked_sequence = sequence
+        self.baseline = baseline
+        self.reports_since_full = 0 if is_full else self.reports_since_full + 1
+
+class ProcessSampler:
+    # Keeps psutil.Process objects and CPU counters across collection cycles so each
+    # cycle is one sweep and CPU% is averaged over the whole interval since the last one.
+    # Thread counts and context-switch rates are read in the same sweep when
+    # `extended` names them, instead of on a second pass over every process.
+    ATTRS = ['name', 'ppid', 'status', 'username', 'cmdline', 'create_time',
+             'cpu_times', 'memory_info', 'memory_percent']
+    EXTENDED_ATTRS = {'num_threads': ['num_threads'], 'ctx_switches': ['num_ctx_switches']}
+    EXTENDED_FIELDS = ('num_threads', 'voluntary_ctx_switches_per_sec', 'involuntary_ctx_switches_per_sec')
+
+    def __init__(self, extended=()):
+        self.extended = set(extended)
+        self.attrs = self.ATTRS + [attr for metric in sorted(self.extended) for attr in self.EXTENDED_ATTRS[metric]]
+        self._processes = {}
+        self._cpu_state = {}
+        self._ctx_state = {}
+
+    def _get_process(self, pid: int):
+        proc = self._processes.get(pid)
+        if proc is not None and not proc.is_running():
+            # pid was reused by a different process (create_time changed)
+            proc = None
+            self._cpu_state.pop(pid, None)
+            self._ctx_state.pop(pid, None)
+        if proc is None:
+            proc = psutil.Process(pid)
+            self._processes[pid] = proc
+        return proc
+
+    def cpu_percent(self, pid: int, create_time: float, cpu_total: float, now: float) -> float:
+        previous = self._cpu_state.get(pid)
+        self._cpu_state[pid] = (create_time, cpu_total, now)
+        if previous and previous[0] == create_time and now > previous[2]:
+            elapsed = now - previous[2]
+            used = cpu_total - previous[1]
+        else:
+            # First sighting: average over the process lifetime so far
+            elapsed = time.time() - create_time if create_time else 0.0
+            used = cpu_total
+        if elapsed <= 0:
+            return 0.0
+        return max(0.0, min(100.0, used / elapsed * 100))
+
+    def ctx_switch_rates(self, pid: int, create_time: float, voluntary: int, involuntary: int,
+                         now: float) -> Dict[str, Optional[float]]:
+        previous = self._ctx_state.get(pid)
+        self._ctx_state[pid] = (create_time, voluntary, involuntary, now)
+        if previous is None or previous[0] != create_time or now <= previous[3]:
+            # First reading of this process
+            return {'voluntary_ctx_switches_per_sec': None, 'involuntary_ctx_switches_per_sec': None}
+        elapsed = now - previous[3]
+        return {
+            'voluntary_ctx_switches_per_sec': round(max(0, voluntary - previous[1]) / elapsed, 2),
+            'involuntary_ctx_switches_per_sec': round(max(0, involuntary - previous[2]) / elapsed, 2),
+        }
+
+    def _evict(self, seen: set):
+        for pid in list(self._cpu_state):
+            if pid not in seen:
+                del self._cpu_state[pid]
+        for pid in list(self._ctx_state):
+            if pid not in seen:
+                del self._ctx_state[pid]
+
+    def sample(self) -> List[Dict[str, Any]]:
+        samples = []
+        seen = set()
+        now = time.monotonic()
+        for pid in psutil.pids():
+            try:
+                proc = self._get_process(pid)
+                info = proc.as_dict(attrs=self.attrs)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            seen.add(pid)
+            info['pid'] = pid
+            cpu_times = info.pop('cpu_times', None)
+            create_time = info.get('create_time') or 0.0
+            if cpu_times is not None:
+                info['cpu_percent'] = self.cpu_percent(pid, create_time, cpu_times.user + cpu_times.system, now)
+            else:
+                info['cpu_percent'] = 0.0
+            switches = info.pop('num_ctx_switches', None)
+            if switches is not None:
+                info.update(self.ctx_switch_rates(pid, create_time, switches.voluntary, switches.involuntary, now))
+            samples.append(info)
+        for pid in list(self._processes):
+            if pid not in seen:
+                # Evict processes that exited since the previous sweep
+                del self._processes[pid]
+        self._evict(seen)
+        return samples
+
+ProcfsMemory = namedtuple('ProcfsMemory', ['rss', 'vms'])
+
+class ProcfsSampler(ProcessSampler):
+    # Linux-only sampler that reads /proc/<pid>/{stat,statm,status,cmdline} directly
+    # into a reused buffer instead of going through psutil. Produces the same
+    # sample dicts as ProcessSampler.
+    # psutil's status strings, spelled out since some constants only exist on Linux
+    STATUS_CODES = {
+        'R': 'running', 'S': 'sleeping', 'D': 'disk-sleep', 'Z': 'zombie',
+        'T': 'stopped', 't': 'tracing-stop', 'X': 'dead', 'x': 'dead',
+        'K': 'wake-kill', 'W': 'waking', 'P': 'parked', 'I': 'idle',
+    }
+
+    def __init__(self, proc_root: str = '/proc', extended=()):
+        super().__init__(extended)
+        self.proc_root = proc_root
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self._buffer = bytearray(64 * 1024)
+        self._usernames = {}
+        self.boot_time = self._read_boot_time()
+        self.total_memory = self._read_total_memory()
+
+    @staticmethod
+    def available(proc_root: str = '/proc') -> bool:
+        return sys.platform.startswith('linux') and os.path.isdir(proc_root)
+
+    def _read(self, path: str) -> bytes:
+        with open(path, 'rb', buffering=0) as f:
+            size = f.readinto(self._buffer)
+            if size < len(self._buffer):
+                return bytes(memoryview(self._buffer)[:size])
+            # Rare oversized file (long cmdline): grow the buffer and read the rest
+            data = bytes(self._buffer) + f.read()
+            self._buffer = bytearray(max(len(self._buffer) * 2, len(data) + 1))
+            return data
+
+    def _read_boot_time(self) -> float:
+        for line in self._read(f'{self.proc_root}/stat').splitlines():
+            if line.startswith(b'btime'):
+                return float(line.split()[1])
+        return psutil.boot_time()
+
+    def _read_total_memory(self) -> int:
+        for line in self._read(f'{self.proc_root}/meminfo').splitlines():
+            if line.startswith(b'MemTotal:'):
+                return int(line.split()[1]) * 1024
+        return psutil.virtual_memory().total
+
+    def _username(self, uid: int):
+        if uid not in self._usernames:
+            try:
+                import pwd
+                self._usernames[uid] = pwd.getpwuid(uid).pw_name
+            except (ImportError, KeyError):
+                self._usernames[uid] = str(uid)
+        return self._usernames[uid]
+
+    def _pids(self) -> List[int]:
+        return [int(entry) for entry in os.listdir(self.proc_root) if entry.isdigit()]
+
+    @staticmethod
+    def _parse_cmdline(raw: bytes) -> List[str]:
+        # Same rules as psutil: NUL-separated, or space-separated when a process rewrote its argv
+        if not raw:
+            return []
+        separator = b'\x00' if raw.endswith(b'\x00') else b' '
+        if raw.endswith(separator):
+            raw = raw[:-1]
+        args = raw.split(separator)
+        if separator == b'\x00' and len(args) == 1 and b' ' in raw:
+            args = raw.split(b' ')
+        return [arg.decode('utf-8', 'replace') for arg in args]
+
+    @staticmethod
+    def _status_field(status: bytes, label: bytes) -> Optional[int]:
+        # First number after `label` in /proc/<pid>/status, found without splitting every line
+        start = status.find(label)
+        if start < 0:
+            return None
+        return int(status[start + len(label):status.find(b'\n', start + 1)].split()[0])
+
+    def read_process(self, pid: int, now: float) -> Dict[str, Any]:
+        base = f'{self.proc_root}/{pid}'
+        stat = self._read(f'{base}/stat')
+        # comm may contain spaces and parentheses, so split around the last ')'
+        comm_end = stat.rfind(b')')
+        name = stat[stat.find(b'(') + 1:comm_end].decode('utf-8', 'replace')
+        fields = stat[comm_end + 2:].split()
+        create_time = self.boot_time + int(fields[19]) / self.clock_ticks
+        cpu_total = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        statm = self._read(f'{base}/statm').split()
+        vms = int(statm[0]) * self.page_size
+        rss = int(statm[1]) * self.page_size
+        status = self._read(f'{base}/status')
+        uid = self._status_field(status, b'\nUid:')
+        voluntary = involuntary = None
+        if 'ctx_switches' in self.extended:
+            voluntary = self._status_field(status, b'\nvoluntary_ctxt_switches:')
+            involuntary = self._status_field(status, b'\nnonvoluntary_ctxt_switches:')
+        cmdline = self._parse_cmdline(self._read(f'{base}/cmdline'))
+        if len(name) >= 15 and cmdline:
+            # Kernel truncates comm to 15 chars; recover the full name like psutil does
+            exe_name = os.path.basename(cmdline[0])
+            if exe_name.startswith(name):
+                name = exe_name
+        info = {
+            'pid': pid,
+            'name': name,
+            'ppid': int(fields[1]),
+            'status': self.STATUS_CODES.get(fields[0].decode(), '?'),
+            'username': self._username(uid) if uid is not None else None,
+            'cmdline': cmdline,
+            'create_time': create_time,
+            'memory_info': ProcfsMemory(rss, vms),
+            'memory_percent': rss / self.total_memory * 100 if self.total_memory else 0.0,
+            'cpu_percent': self.cpu_percent(pid, create_time, cpu_total, now),
+        }
+        if 'num_threads' in self.extended:
+            info['num_threads'] = int(fields[17])
+        if voluntary is not None and involuntary is not None:
+            info.update(self.ctx_switch_rates(pid, create_time, voluntary, involuntary, now))
+        return info
+
+    def sample(self) -> List[Dict[str, Any]]:
+        samples = []
+        now = time.monotonic()
+        for pid in self._pids():
+            try:
+                samples.append(self.read_process(pid, now))
+            except (OSError, IndexError, ValueError):
+                # Process exited mid-read or the file is unreadable
+                continue
+        self._evict({info['pid'] for info in samples})
+        return samples
+
+class ExtendedMetricsCollector:
+    # Threads, open fds, I/O and context-switch rates for the processes being reported.
+    # Each metric has its own tier: read every `every` cycles, and only for the `top_k`
+    # processes by CPU when set, since reading fds or I/O counters of every process on
+    # a busy host costs more than the sweep itself. Rates are per second, from the
+    # counters read for the same process on an earlier cycle.
+    DEFAULT_TIERS = {
+        'num_threads': {'every': 1},
+        'ctx_switches': {'every': 1},
+        'io_counters': {'every': 1, 'top_k': 50},
+        'num_fds': {'every': 5, 'top_k': 50},
+    }
+    # Metrics the samplers read in their own sweep; only tiers with `every` or
+    # `top_k` set take a second pass through psutil here
+    SWEEP_METRICS = ('num_threads', 'ctx_switches')
+
+    def __init__(self, tiers: Dict[str, Dict[str, Any]]):
+        self.tiers = {}
+        self.sweep = set()
+        for metric, tier in tiers.items():
+            if metric not in self.DEFAULT_TIERS:
+                logger.warning(f"Unknown extended metric '{metric}', ignoring it")
+            elif not tier:
+                continue
+            elif metric in self.SWEEP_METRICS and int(tier.get('every', 1)) <= 1 and not tier.get('top_k'):
+                self.sweep.add(metric)
+            else:
+                self.tiers[metric] = {'every': max(1, int(tier.get('every', 1))), 'top_k': tier.get('top_k')}
+        self.cycle = 0
+        # pid -> (created_time, psutil.Process)
+        self._processes = {}
+        # (pid, metric) -> (created_time, counter values, monotonic time)
+        self._counters = {}
+
+    def due(self) -> Dict[str, Optional[int]]:
+        # Metric -> top_k (None for every process) for the metrics due this cycle
+        return {metric: tier['top_k'] for metric, tier in self.tiers.items() if self.cycle % tier['every'] == 0}
+
+    def _get_process(self, pid: int, created_time: Optional[str]):
+        cached = self._processes.get(pid)
+        if cached is None or cached[0] != created_time:
+            cached = (created_time, psutil.Process(pid))
+            self._processes[pid] = cached
+        return cached[1]
+
+    def _rates(self, pid: int, metric: str, created_time: Optional[str], values: tuple, now: float) -> list:
+        previous = self._counters.get((pid, metric))
+        self._counters[(pid, metric)] = (created_time, values, now)
+        if previous is None or previous[0] != created_time or now <= previous[2]:
+            # First reading of this process
+            return [None] * len(values)
+        elapsed = now - previous[2]
+        return [round(max(0, value - old) / elapsed, 2) for value, old in zip(values, previous[1])]
+
+    def _read(self, process, metric: str, pid: int, created_time: Optional[str], now: float) -> Dict[str, Any]:
+        if metric == 'num_threads':
+            return {'num_threads': process.num_threads()}
+        if metric == 'num_fds':
+            return {'num_fds': process.num_fds()}
+        if metric == 'io_counters':
+            io = process.io_counters()
+            read_rate, write_rate = self._rates(pid, metric, created_time, (io.read_bytes, io.write_bytes), now)
+            return {'io_read_bytes_per_sec': read_rate, 'io_write_bytes_per_sec': write_rate}
+        switches = process.num_ctx_switches()
+        voluntary, involuntary = self._rates(pid, metric, created_time, (switches.voluntary, switches.involuntary), now)
+        return {'voluntary_ctx_switches_per_sec': voluntary, 'involuntary_ctx_switches_per_sec': involuntary}
+
+    def collect(self, processes: List[Dict[str, Any]]):
+        # Adds the metrics due this cycle to the process dicts in place
+        due = self.due()
+        self.cycle += 1
+        wanted = {}
+        for metric, top_k in due.items():
+            targets = processes
+            if top_k and top_k < len(processes):
+                targets = heapq.nlargest(top_k, processes, key=lambda proc: proc['cpu_percent'])
+            for proc in targets:
+                wanted.setdefault(proc['pid'], []).append(metric)
+        by_pid = {proc['pid']: proc for proc in processes}
+        now = time.monotonic()
+        for pid, metrics in wanted.items():
+            proc_data = by_pid[pid]
+            created_time = proc_data.get('created_time')
+            try:
+                process = self._get_process(pid, created_time)
+                with process.oneshot():
+                    for metric in metrics:
+                        try:
+                            proc_data.update(self._read(process, metric, pid, created_time, now))
+                        except psutil.AccessDenied:
+                            continue
+                        except (AttributeError, NotImplementedError):
+                            logger.warning(f"Extended metric '{metric}' is not available on this platform")
+                            self.tiers.pop(metric, None)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                continue
+        for pid in list(self._processes):
+            if pid not in by_pid:
+                del self._processes[pid]
+        for key in list(self._counters):
+            if key[0] not in by_pid:
+                del self._counters[key]
+
+class ReportSpool:
+    # Append-only JSON-lines file holding reports that could not be sent yet.
+    # The read offset is kept in a sidecar file so a restart does not resend drained reports.
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.offset = self._load_offset()
+        self._repair_tail()
+
+    def _repair_tail(self):
+        # A crash mid-append leaves a line without its newline. Cut it off so it is not
+        # read forever as "partial" and the next append does not run into it.
+        size = self.size()
+        if size < self.offset:
+            # The spool was replaced behind our back; the saved offset means nothing now
+            self.offset = 0
+        if size <= self.offset:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # Rare (only after a crash), so a plain scan from the read offset is fine
+            f.seek(self.offset)
+            keep = self.offset
+            for line in f:
+                if line.endswith(b'\n'):
+                    keep += len(line)
+            logger.warning(f"Dropping {size - keep} bytes of a partially written report from {self.path}")
+            f.truncate(keep)
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_offset(self):
+        with open(self.offset_path, 'w') as f:
+            f.write(str(self.offset))
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def pending(self) -> bool:
+        with self.lock:
+            return self.size() > self.offset
+
+    def append(self, report: Dict[str, Any]) -> bool:
+        line = (json.dumps(report, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.size() + len(line) > self.max_bytes:
+                logger.error(f"Spool file {self.path} is full, dropping report from {report.get('timestamp')}")
+                return False
+            size = self.size()
+            try:
+                with open(self.path, 'ab') as f:
+                    f.write(line)
+            except OSError as e:
+                # Do not leave half a line behind for the next append to run into
+                logger.error(f"Could not spool report: {e}")
+                with open(self.path, 'rb+') as f:
+                    f.truncate(size)
+                return False
+            return True
+
+    def read_batch(self, limit: int) -> List[tuple]:
+        # Returns up to `limit` (end_offset, report) pairs from the current read offset
+        batch = []
+        with self.lock, open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while len(batch) < limit:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b'\n'):
+                    # Partially written line; leave it for the next read
+                    break
+                try:
+                    report = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping corrupt spool entry")
+                    report = None
+                batch.append((f.tell(), report))
+        return batch
+
+    def consume(self, end_offset: int):
+        with self.lock:
+            self.offset = end_offset
+            if self.offset >= self.size():
+                # Fully drained: start a fresh file
+                for path in (self.path, self.offset_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.offset = 0
+            else:
+                self._save_offset()
+
+class ReportSender:
+    # Background thread that ships reports so collection never waits on the backend.
+    # Reports wait in a bounded in-memory queue; while the backend is unreachable, or
+    # the queue is full, they overflow to the spool and are drained in order later.
+    def __init__(self, deliver, queue_size: int = 10, spool: Optional[ReportSpool] = None,
+                 drain_batch: int = 20, backoff_initial: float = 1, backoff_max: float = 300,
+                 deliver_batch=None):
+        self.deliver = deliver
+        self.deliver_batch = deliver_batch
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.spool = spool or ReportSpool('agent_spool.jsonl', 50 * 1024 * 1024)
+        self.drain_batch = max(1, drain_batch)
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff = 0.0
+        self.stopping = threading.Event()
+        self.submit_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='report-sender', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 5):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+        self._spool_queued()
+
+    def submit(self, report: Dict[str, Any]):
+        with self.submit_lock:
+            # Once anything is spooled, new reports queue behind it to keep send order
+            if self.spool.pending():
+                self.spool.append(report)
+                return
+            try:
+                self.queue.put_nowait(report)
+            except queue.Full:
+                logger.warning("Send queue full, spooling report to disk")
+                self._spool_queued()
+                self.spool.append(report)
+
+    def _spool_queued(self):
+        while True:
+            try:
+                self.spool.append(self.queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _deliver_one(self, report: Dict[str, Any]) -> Optional[int]:
+        try:
+            return self.deliver(report)
+        except Exception as e:
+            logger.error(f"Error sending data: {e}")
+            return None
+
+    def _batch_statuses(self, reports: List[Dict[str, Any]]) -> Optional[List[int]]:
+        if not self.deliver_batch or len(reports) < 2:
+            return None
+        try:
+            return self.deliver_batch(reports)
+        except Exception as e:
+            logger.error(f"Error sending batch: {e}")
+            return []
+
+    def _is_done(self, report: Dict[str, Any], status_code: Optional[int]) -> bool:
+        # True when the report is done with (sent, or rejected for good)
+        if status_code is None:
+            return False
+        if status_code in DELIVERED_STATUSES:
+            return True
+        if status_code >= 500 or status_code in (408, 429):
+            logger.error(f"Backend returned {status_code}, will retry")
+            return False
+        logger.error(f"Backend rejected report from {report.get('timestamp')} with {status_code}, dropping it")
+        return True
+
+    def _send_many(self, reports: List[Optional[Dict[str, Any]]]) -> int:
+        # Number of leading reports that are done with; stops at the first one to retry.
+        # None entries are unreadable spool lines and count as done.
+        statuses = self._batch_statuses([report for report in reports if report is not None])
+        done = 0
+        position = 0
+        for report in reports:
+            if report is not None:
+                if statuses is None:
+                    status_code = self._deliver_one(report)
+                else:
+                    status_code = statuses[position] if position < len(statuses) else None
+                position += 1
+                if not self._is_done(report, status_code):
+                    break
+            done += 1
+        return done
+
+    def _take_queued(self, limit: int) -> List[Dict[str, Any]]:
+        reports = []
+        while len(reports) < limit:
+            try:
+                reports.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return reports
+
+    def _wait_backoff(self):
+        self.backoff = min(self.backoff_max, self.backoff * 2 if self.backoff else self.backoff_initial)
+        logger.info(f"Retrying in {self.backoff} seconds")
+        self.stopping.wait(self.backoff)
+
+    def _run(self):
+        while not self.stopping.is_set():
+            if self.spool.pending():
+                entries = self.spool.read_batch(self.drain_batch)
+                done = self._send_many([report for _, report in entries])
+                if done:
+                    self.spool.consume(entries[done - 1][0])
+                if not entries or done < len(entries):
+                    # Backend failed, or nothing was readable: do not spin on the spool
+                    self._wait_backoff()
+                else:
+                    self.backoff = 0.0
+                continue
+            try:
+                report = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            reports = [report]
+            if self.deliver_batch:
+                reports += self._take_queued(self.drain_batch - 1)
+            done = self._send_many(reports)
+            if done == len(reports):
+                self.backoff = 0.0
+                continue
+            with self.submit_lock:
+                # Keep the failed reports ahead of everything queued after them
+                for report in reports[done:]:
+                    self.spool.append(report)
+                self._spool_queued()
+            self._wait_backoff()
+
+class CollectionScheduler:
+    # Runs collectors at their own intervals on one thread. Run n of a collector is
+    # due at first_run + n * interval, so the time collecting takes never pushes later
+    # runs back; runs missed while another collector was busy are skipped, not queued.
+    # Collectors due at the same moment run in the order they were added.
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.tasks = []
+        self.stopping = threading.Event()
+
+    def add(self, name: str, interval: float, collect, delay: float = 0.0):
+        self.tasks.append((name, interval, collect, delay))
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        started = self.clock()
+        # (due time, task index, run number)
+        pending = [(started + delay, index, 0) for index, (_, _, _, delay) in enumerate(self.tasks)]
+        heapq.heapify(pending)
+        while pending and not self.stopping.is_set():
+            due, index, run = pending[0]
+            wait = due - self.clock()
+            if wait > 0 and self.stopping.wait(wait):
+                break
+            heapq.heappop(pending)
+            name, interval, collect, delay = self.tasks[index]
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Collector '{name}' failed: {e}")
+            first_run = started + delay
+            next_run = max(run + 1, math.floor((self.clock() - first_run) / interval) + 1)
+            if next_run > run + 1:
+                logger.warning(f"Collector '{name}' skipped {next_run - run - 1} runs")
+            heapq.heappush(pending, (first_run + next_run * interval, index, next_run))
+
 class SystemMonitorAgent:
     def __init__(self, config_file: str = 'config.json'):
         self.config = self.load_config(config_file)
@@ -53,14 +872,86 @@ class SystemMonitorAgent:
         self.api_key = self.config.get('api_key', 'your-secret-api-key-here')
         self.hostname = socket.gethostname()
         self.collection_interval = self.config.get('collection_interval', 60)
+        self.payload_encoding = self.config.get('payload_encoding', 'json')
+        if self.payload_encoding not in PAYLOAD_ENCODINGS:
+            logger.warning(f"Unknown payload_encoding '{self.payload_encoding}', using json")
+            self.payload_encoding = 'json'
+        self.batch_send = self.config.get('batch_send', False)
+        # Full reports go to the queued endpoint, which answers 202 before writing them
+        self.queued_send = self.config.get('queued_send', False)
+        self.session = self.create_session()
+        # Computed once: reading the CPU brand can spawn sysctl/wmic
+        self.inventory = self.collect_inventory()
+        self.inventory_fingerprint = inventory_fingerprint(self.inventory)
+        self.inventory_sent = False
+        # Host readings taken between reports, sent with the next one
+        self.system_samples = deque(maxlen=self.config.get('max_system_samples', 720))
+        # psutil measures host CPU since the previous call; the first call only primes it
+        psutil.cpu_percent(interval=None)
+        extended_tiers = self.config.get('extended_metrics')
+        self.extended_metrics = ExtendedMetricsCollector(extended_tiers) if extended_tiers else None
+        self.sampler = self.create_sampler(
+            self.config.get('collector', 'psutil'),
+            self.extended_metrics.sweep if self.extended_metrics else ()
+        )
+        self.delta_encoder = None
+        if self.config.get('delta_encoding', False):
+            self.delta_encoder = DeltaEncoder(
+                full_resync_interval=self.config.get('full_resync_interval', 10),
+                cpu_threshold=self.config.get('delta_cpu_threshold', 1.0),
+                memory_threshold_mb=self.config.get('delta_memory_threshold_mb', 5.0)
+            )
         
+    def create_session(self) -> requests.Session:
+        # One pooled keep-alive session for all reports instead of a new connection per post
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.config.get('http_pool_size', 2),
+            max_retries=0
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'X-API-Key': self.api_key, 'Connection': 'keep-alive'})
+        return session
+
+    def create_sampler(self, collector: str, extended=()) -> ProcessSampler:
+        if collector == 'procfs':
+            if ProcfsSampler.available():
+                return ProcfsSampler(extended=extended)
+            logger.warning("procfs collector is only available on Linux, using psutil")
+        elif collector != 'psutil':
+            logger.warning(f"Unknown collector '{collector}', using psutil")
+        return ProcessSampler(extended)
+
     def load_config(self, config_file: str) -> Dict[str, Any]:
         default_config = {
             'api_url': 'http://localhost:8000/api',
             'api_key': 'your-secret-api-key-here',
             'collection_interval': 60,
+            'system_interval': 5,
+            'inventory_interval': 3600,
+            'max_system_samples': 720,
             'include_system_processes': True,
-            'max_processes': 1000
+            'max_processes': 1000,
+            'payload_encoding': 'json',
+            'collector': 'psutil',
+            'send_timeout': 30,
+            'http_pool_size': 2,
+            'batch_send': False,
+            'queued_send': False,
+            'async_send': True,
+            'send_queue_size': 10,
+            'spool_file': 'agent_spool.jsonl',
+            'spool_max_bytes': 50 * 1024 * 1024,
+            'spool_drain_batch': 20,
+            'retry_backoff_initial': 1,
+            'retry_backoff_max': 300,
+            'delta_encoding': False,
+            'full_resync_interval': 10,
+            'delta_cpu_threshold': 1.0,
+            'delta_memory_threshold_mb': 5.0,
+            'extended_metrics': ExtendedMetricsCollector.DEFAULT_TIERS
         }
         if os.path.exists(config_file):
             with open(config_file, 'r') as f:
@@ -71,9 +962,15 @@ class SystemMonitorAgent:
                 json.dump(default_config, f, indent=2)
         return default_config
     
+    def collect_inventory(self) -> Dict[str, Any]:
+        return {
+            'operating_system': f"{platform.system()}-{platform.release()}-{platform.version()}",
+            'processor': get_cpu_brand(),
+            'processor_cores': psutil.cpu_count(),
+            'processor_threads': psutil.cpu_count(logical=True)
+        }
+
     def collect_system_data(self) -> Dict[str, Any]:
-        cpu_count = psutil.cpu_count()
-        cpu_count_logical = psutil.cpu_count(logical=True)
         memory = psutil.virtual_memory()
         memory_total_gb = memory.total / (1024**3)
         memory_used_gb = memory.used / (1024**3)
@@ -85,15 +982,8 @@ class SystemMonitorAgent:
             disk_free_gb = disk.free / (1024**3)
         except Exception:
             disk_total_gb = disk_used_gb = disk_free_gb = 0
-        platform_system = platform.system()
-        platform_release = platform.release()
-        platform_version = platform.version()
-        cpu_brand = get_cpu_brand()
         return {
-            'operating_system': f"{platform_system}-{platform_release}-{platform_version}",
-            'processor': cpu_brand,
-            'processor_cores': cpu_count,
-            'processor_threads': cpu_count_logical,
+            'cpu_percent': psutil.cpu_percent(interval=None),
             'ram_total_gb': round(memory_total_gb, 2),
             'ram_used_gb': round(memory_used_gb, 2),
             'ram_available_gb': round(memory_available_gb, 2),
@@ -102,23 +992,38 @@ class SystemMonitorAgent:
             'storage_free_gb': round(disk_free_gb, 2)
         }
 
+    def refresh_inventory(self):
+        inventory = self.collect_inventory()
+        fingerprint = inventory_fingerprint(inventory)
+        if fingerprint != self.inventory_fingerprint:
+            logger.info("Host inventory changed, sending it with the next report")
+            self.inventory = inventory
+            self.inventory_fingerprint = fingerprint
+            self.inventory_sent = False
+
+    def sample_system(self):
+        reading = self.collect_system_data()
+        reading['timestamp'] = datetime.now().isoformat()
+        self.system_samples.append(reading)
+
+    def take_system_readings(self) -> tuple:
+        # (system_info, system_samples) for the next report: the readings taken since the
+        # previous report, each with its own timestamp, or else one reading taken now
+        if not self.system_samples:
+            return self.collect_system_data(), []
+        samples = list(self.system_samples)
+        self.system_samples.clear()
+        return None, samples
+
     def collect_process_data(self) -> List[Dict[str, Any]]:
         processes = []
-        process_list = list(psutil.process_iter(['pid', 'name', 'ppid', 'status', 'username', 'cmdline', 'create_time']))
-        cpu_usage = self._get_cpu_usage(process_list)
-        for proc in process_list:
+        for proc_info in self.sampler.sample():
             try:
-                proc_info = proc.info
                 if not all(key in proc_info for key in ['pid', 'name']):
                     continue
-                cpu_percent = cpu_usage.get(proc_info['pid'], 0.0)
-                try:
-                    proc_obj = psutil.Process(proc_info['pid'])
-                    memory_info = proc_obj.memory_info()
-                    memory_percent = proc_obj.memory_percent()
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    memory_info = None
-                    memory_percent = 0.0
+                cpu_percent = proc_info.get('cpu_percent', 0.0)
+                memory_info = proc_info.get('memory_info')
+                memory_percent = proc_info.get('memory_percent') or 0.0
                 memory_mb = memory_info.rss / (1024 * 1024) if memory_info else 0.0
                 cmdline = proc_info.get('cmdline', [])
                 command_line = ' '.join(cmdline) if cmdline else proc_info['name']
@@ -139,86 +1044,237 @@ class SystemMonitorAgent:
                     'command_line': command_line,
                     'created_time': datetime.fromtimestamp(proc_info.get('create_time', 0)).isoformat() if proc_info.get('create_time') and isinstance(proc_info['create_time'], (int, float)) else None
                 }
+                for field in ProcessSampler.EXTENDED_FIELDS:
+                    if field in proc_info:
+                        process_data[field] = proc_info[field]
                 processes.append(process_data)
             except Exception as e:
-                logger.warning(f"Error processing process {getattr(proc, 'pid', '?')}: {e}")
+                logger.warning(f"Error processing process {proc_info.get('pid', '?')}: {e}")
                 continue
         logger.info(f"Collected data for {len(processes)} processes")
         return processes
 
-    def _get_cpu_usage(self, process_list: List[psutil.Process]) -> Dict[int, float]:
-        cpu_usage = {}
-        try:
-            initial_times = {}
-            for proc in process_list:
-                try:
-                    cpu_times = proc.cpu_times()
-                    initial_times[proc.pid] = cpu_times.user + cpu_times.system
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    initial_times[proc.pid] = 0.0
-            time.sleep(0.1)
-            for proc in process_list:
-                try:
-                    cpu_times = proc.cpu_times()
-                    current_time = cpu_times.user + cpu_times.system
-                    initial_time = initial_times.get(proc.pid, 0.0)
-                    time_diff = current_time - initial_time
-                    cpu_percent = (time_diff / 0.1) * 100
-                    cpu_percent = max(0.0, min(100.0, cpu_percent))
-                    cpu_usage[proc.pid] = cpu_percent
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    cpu_usage[proc.pid] = 0.0
-        except Exception as e:
-            logger.warning(f"Error getting CPU usage: {e}")
-        return cpu_usage
-
-    def send_data_to_backend(self, system_data: Dict[str, Any], process_data: List[Dict[str, Any]]) -> bool:
-        payload = {
+    def build_report(self, system_data: Optional[Dict[str, Any]], process_data: List[Dict[str, Any]],
+                     system_samples: Optional[List[Dict[str, Any]]] = None,
+                     omitted: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        report = {
             'hostname': self.hostname,
             'timestamp': datetime.now().isoformat(),
-            'system_info': system_data,
+            'inventory_fingerprint': self.inventory_fingerprint,
             'processes': process_data
         }
-        headers = {
-            'Content-Type': 'application/json',
-            'X-API-Key': self.api_key
-        }
+        if system_data is not None:
+            report['system_info'] = system_data
+        if system_samples:
+            report['system_samples'] = system_samples
+        if omitted:
+            report['omitted_processes'] = omitted
+        if not self.inventory_sent:
+            report['inventory'] = self.inventory
+        return report
+
+    def send_data_to_backend(self, system_data: Dict[str, Any], process_data: List[Dict[str, Any]]) -> bool:
         try:
-            response = requests.post(
-                f"{self.api_url}/submit/",
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-            return response.status_code == 200
+            return self.deliver_report(self.build_report(system_data, process_data)) in DELIVERED_STATUSES
         except Exception as e:
             logger.error(f"Error sending data: {e}")
             return False
 
-    def run_once(self) -> bool:
+    def deliver_report(self, report: Dict[str, Any]) -> int:
+        # Sends one report and returns the HTTP status; raises when the backend is unreachable
+        if self.delta_encoder:
+            return self._send_delta(report)
+        if self.queued_send:
+            response = self._submit(report, 'submit/queued/')
+            if response.status_code != 404:
+                return response.status_code
+            logger.warning("Backend has no queued endpoint, waiting for each report to be written")
+            self.queued_send = False
+        return self._submit(report).status_code
+
+    def _send_delta(self, report: Dict[str, Any]) -> int:
+        payload = {key: value for key, value in report.items() if key != 'processes'}
+        process_data = report['processes']
+        fields, pending = self.delta_encoder.encode(process_data)
+        response = self._submit({**payload, **fields})
+        if response.status_code == 409 and self._resend_requested(response):
+            # Backend lost track of our baseline; resync with a full snapshot now
+            logger.warning("Backend requested a full baseline, resending full snapshot")
+            self.delta_encoder.reset()
+            fields, pending = self.delta_encoder.encode(process_data)
+            response = self._submit({**payload, **fields})
+        if response.status_code == 200:
+            self.delta_encoder.acknowledge(pending)
+        return response.status_code
+
+    @staticmethod
+    def _resend_requested(response: requests.Response) -> bool:
+        try:
+            return bool(response.json().get('resend_baseline'))
+        except ValueError:
+            return False
+
+    def deliver_batch(self, reports: List[Dict[str, Any]]) -> List[int]:
+        # Sends several reports in one request to the batch endpoint; returns a status per report.
+        # Delta encoding is bypassed: every report goes as a full snapshot with its own sequence.
+        if not self.batch_send:
+            return self._deliver_each(reports)
+        payloads, pendings = [], []
+        for report in reports:
+            if self.delta_encoder:
+                fields, pending = self.delta_encoder.encode_full(report['processes'])
+                payloads.append({**report, **fields})
+                pendings.append(pending)
+            else:
+                payloads.append(report)
+                pendings.append(None)
+        response = self._submit({'reports': payloads}, 'submit/batch/')
+        if response.status_code == 404:
+            logger.warning("Backend has no batch endpoint, sending reports one by one")
+            self.batch_send = False
+            return self._deliver_each(reports)
+        if response.status_code != 200:
+            return [response.status_code] * len(reports)
+        statuses = [item.get('status', 500) for item in response.json().get('results', [])]
+        if self.delta_encoder:
+            accepted = [pending for pending, status_code in zip(pendings, statuses) if status_code == 200]
+            if accepted:
+                self.delta_encoder.acknowledge(accepted[-1])
+        return statuses
+
+    def _deliver_each(self, reports: List[Dict[str, Any]]) -> List[int]:
+        # Stops at the first unreachable send; missing statuses are retried by the sender
+        statuses = []
+        for report in reports:
+            try:
+                statuses.append(self.deliver_report(report))
+            except Exception as e:
+                logger.error(f"Error sending data: {e}")
+                break
+        return statuses
+
+    def _submit(self, payload: Dict[str, Any], path: str = 'submit/') -> requests.Response:
+        response = self._post_payload(payload, self.payload_encoding, path)
+        if response.status_code == 415 and self.payload_encoding != 'json':
+            # Backend does not understand the compact format; fall back for good
+            logger.warning(f"Backend rejected '{self.payload_encoding}' payloads, falling back to json")
+            self.payload_encoding = 'json'
+            response = self._post_payload(payload, self.payload_encoding, path)
+        self._track_inventory(payload, response)
+        return response
+
+    def _track_inventory(self, payload: Dict[str, Any], response: requests.Response):
+        # The inventory stops being sent once a report carrying it is delivered, and is
+        # sent again when the backend answers that it does not hold our fingerprint
+        if response.status_code not in DELIVERED_STATUSES:
+            return
+        reports = payload.get('reports', [payload])
+        if any('inventory' in report for report in reports):
+            self.inventory_sent = True
+        try:
+            body = response.json()
+        except ValueError:
+            return
+        results = body.get('results', [body]) if isinstance(body, dict) else []
+        if any(isinstance(result, dict) and result.get('inventory_required') for result in results):
+            logger.info("Backend requested the host inventory, sending it with the next report")
+            self.inventory_sent = False
+
+    def _post_payload(self, payload: Dict[str, Any], encoding: str, path: str = 'submit/') -> requests.Response:
+        body, headers = encode_payload(payload, encoding)
+        return self.session.post(
+            f"{self.api_url}/{path}",
+            data=body,
+            headers=headers,
+            timeout=self.config.get('send_timeout', 30)
+        )
+
+    def collect_report(self) -> Optional[Dict[str, Any]]:
         logger.info("Starting data collection...")
-        system_data = self.collect_system_data()
         process_data = self.collect_process_data()
         if not process_data:
             logger.warning("No process data collected")
+            return None
+        total = len(process_data)
+        process_data, omitted = select_processes(
+            process_data,
+            self.config.get('max_processes'),
+            self.config.get('include_system_processes', True)
+        )
+        if omitted:
+            logger.info(f"Sending {len(process_data)} of {total} processes, the rest as totals")
+        if self.extended_metrics:
+            self.extended_metrics.collect(process_data)
+        system_data, system_samples = self.take_system_readings()
+        return self.build_report(system_data, process_data, system_samples, omitted)
+
+    def run_once(self) -> bool:
+        report = self.collect_report()
+        if report is None:
             return False
-        success = self.send_data_to_backend(system_data, process_data)
+        return self.send_report(report)
+
+    def send_report(self, report: Dict[str, Any]) -> bool:
+        try:
+            success = self.deliver_report(report) in DELIVERED_STATUSES
+        except Exception as e:
+            logger.error(f"Error sending data: {e}")
+            success = False
         if success:
             logger.info("Data collection and sending completed successfully")
         else:
             logger.error("Failed to send data to backend")
         return success
 
+    def create_sender(self) -> 'ReportSender':
+        return ReportSender(
+            self.deliver_report,
+            queue_size=self.config.get('send_queue_size', 10),
+            spool=ReportSpool(self.config.get('spool_file', 'agent_spool.jsonl'),
+                              self.config.get('spool_max_bytes', 50 * 1024 * 1024)),
+            drain_batch=self.config.get('spool_drain_batch', 20),
+            backoff_initial=self.config.get('retry_backoff_initial', 1),
+            backoff_max=self.config.get('retry_backoff_max', 300),
+            deliver_batch=self.deliver_batch if self.batch_send else None
+        )
+
+    def report_processes(self, sender: Optional['ReportSender'] = None):
+        report = self.collect_report()
+        if report is None:
+            return
+        if sender:
+            sender.submit(report)
+        else:
+            self.send_report(report)
+
+    def create_scheduler(self, sender: Optional['ReportSender'] = None) -> CollectionScheduler:
+        # Host readings first, so a reading due with the process scan rides in its report
+        scheduler = CollectionScheduler()
+        system_interval = self.config.get('system_interval')
+        if system_interval:
+            scheduler.add('system', system_interval, self.sample_system)
+        scheduler.add('processes', self.collection_interval, lambda: self.report_processes(sender))
+        inventory_interval = self.config.get('inventory_interval')
+        if inventory_interval:
+            # The inventory was read at startup
+            scheduler.add('inventory', inventory_interval, self.refresh_inventory, delay=inventory_interval)
+        return scheduler
+
     def run_continuous(self):
         logger.info(f"Starting System Monitor Agent for {self.hostname}")
         logger.info(f"API endpoint: {self.api_url}")
         logger.info(f"Collection interval: {self.collection_interval} seconds")
+        logger.info(f"System reading interval: {self.config.get('system_interval') or self.collection_interval} seconds")
+        sender = self.create_sender() if self.config.get('async_send', True) else None
+        if sender:
+            sender.start()
         try:
-            while True:
-                self.run_once()
-                time.sleep(self.collection_interval)
+            self.create_scheduler(sender).run()
         except KeyboardInterrupt:
             logger.info("Agent stopped by user")
+        finally:
+            if sender:
+                sender.stop()
 
 def main():
     agent = SystemMonitorAgent()
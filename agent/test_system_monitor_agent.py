@@ -0,0 +1,793 @@
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import psutil
+import system_monitor_agent as agent_module
+from system_monitor_agent import (
+    CollectionScheduler, DeltaEncoder, ExtendedMetricsCollector, ProcessSampler, ProcfsSampler, ReportSender, ReportSpool, SystemMonitorAgent,
+    select_processes
+)
+
+CpuTimes = namedtuple('CpuTimes', 'user system')
+MemoryInfo = namedtuple('MemoryInfo', 'rss vms')
+IoCounters = namedtuple('IoCounters', 'read_bytes write_bytes')
+CtxSwitches = namedtuple('CtxSwitches', 'voluntary involuntary')
+
+
+def make_process(pid, **fields):
+    return {
+        'pid': pid,
+        'name': f'proc{pid}',
+        'parent_pid': 1,
+        'cpu_percent': 1.0,
+        'memory_mb': 10.0,
+        'status': 'running',
+        'username': 'root',
+        'command_line': f'/usr/bin/proc{pid}',
+        'created_time': '2025-01-01T00:00:00',
+        **fields
+    }
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeClock:
+    # Stands in for the time module: wall and monotonic clocks advance together
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeSystem:
+    # A process table behind a stubbed psutil.pids() / psutil.Process
+    def __init__(self):
+        self.processes = {}
+        self.created = []
+
+    def start(self, pid, create_time, cpu=0.0, **info):
+        self.processes[pid] = {
+            'name': f'proc{pid}', 'ppid': 1, 'status': 'running', 'username': 'root',
+            'cmdline': [f'/usr/bin/proc{pid}'], 'create_time': create_time,
+            'cpu_times': CpuTimes(cpu, 0.0), 'memory_info': MemoryInfo(10 * 1024 * 1024, 0),
+            'memory_percent': 0.5, **info
+        }
+
+    def run(self, pid, seconds):
+        info = self.processes[pid]
+        info['cpu_times'] = CpuTimes(info['cpu_times'].user + seconds, info['cpu_times'].system)
+
+    def pids(self):
+        return sorted(self.processes)
+
+    def Process(self, pid):
+        if pid not in self.processes:
+            raise psutil.NoSuchProcess(pid)
+        self.created.append(pid)
+        return FakeProcess(self, pid)
+
+    def patch(self):
+        return mock.patch.multiple(agent_module.psutil, pids=self.pids, Process=self.Process)
+
+
+class FakeProcess:
+    def __init__(self, system, pid):
+        self.system = system
+        self.pid = pid
+        self.create_time = system.processes[pid]['create_time']
+
+    def is_running(self):
+        info = self.system.processes.get(self.pid)
+        return info is not None and info['create_time'] == self.create_time
+
+    def as_dict(self, attrs):
+        if not self.is_running():
+            raise psutil.NoSuchProcess(self.pid)
+        info = self.system.processes[self.pid]
+        return {attr: info.get(attr) for attr in attrs}
+
+    def oneshot(self):
+        return contextlib.nullcontext()
+
+    def _read(self, attr):
+        # An exception stored as the value is raised, e.g. AccessDenied or the
+        # AttributeError of a method the platform lacks
+        if not self.is_running():
+            raise psutil.NoSuchProcess(self.pid)
+        value = self.system.processes[self.pid][attr]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def num_threads(self):
+        return self._read('num_threads')
+
+    def num_fds(self):
+        return self._read('num_fds')
+
+    def io_counters(self):
+        return self._read('io_counters')
+
+    def num_ctx_switches(self):
+        return self._read('num_ctx_switches')
+
+
+class ProcessSamplerTests(unittest.TestCase):
+    def setUp(self):
+        self.system = FakeSystem()
+        self.clock = FakeClock()
+        patcher = self.system.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(agent_module, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sampler = ProcessSampler()
+
+    def sample(self):
+        return {proc['pid']: proc for proc in self.sampler.sample()}
+
+    def test_cpu_percent_from_deltas_across_cycles(self):
+        # First sighting averages over the process lifetime, later ones over the interval
+        self.system.start(10, create_time=self.clock.now - 100, cpu=20.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 20.0)
+        self.clock.sleep(10)
+        self.system.run(10, 5.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 50.0)
+        self.clock.sleep(10)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 0.0)
+
+    def test_process_objects_are_reused(self):
+        self.system.start(10, create_time=self.clock.now - 100)
+        self.sample()
+        self.clock.sleep(10)
+        self.sample()
+        self.assertEqual(self.system.created, [10])
+
+    def test_exited_pids_are_evicted(self):
+        self.system.start(10, create_time=self.clock.now - 100)
+        self.system.start(11, create_time=self.clock.now - 100)
+        self.sample()
+        del self.system.processes[11]
+        self.clock.sleep(10)
+        self.assertEqual(sorted(self.sample()), [10])
+        self.assertEqual(sorted(self.sampler._processes), [10])
+        self.assertEqual(sorted(self.sampler._cpu_state), [10])
+
+    def test_reused_pid_starts_a_new_cpu_history(self):
+        self.system.start(10, create_time=self.clock.now - 100, cpu=90.0)
+        self.sample()
+        self.clock.sleep(10)
+        # pid 10 exited and was reused by a process started 4s ago that used 1s of CPU
+        self.system.start(10, create_time=self.clock.now - 4, cpu=1.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 25.0)
+        self.assertEqual(self.system.created, [10, 10])
+
+
+class FakeProcTree:
+    # A minimal /proc layout with the files ProcfsSampler and psutil read
+    BOOT_TIME = 1700000000
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp()
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.write('stat', f'cpu  1 1 1 1 1 1 1 0 0 0\nbtime {self.BOOT_TIME}\n')
+        self.write('meminfo', ''.join(f'{field}: {kb} kB\n' for field, kb in (
+            ('MemTotal', 16000000), ('MemFree', 8000000), ('MemAvailable', 10000000), ('Buffers', 100000),
+            ('Cached', 2000000), ('Shmem', 10000), ('Active', 4000000), ('Inactive', 2000000),
+        )))
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(path, mode) as f:
+            f.write(content)
+
+    def add(self, pid, comm, started=100.0, cpu=0.0, ppid=1, state='S', rss_pages=256, cmdline=None):
+        # started and cpu are seconds since boot and seconds of CPU time
+        ticks = self.clock_ticks
+        fields = [state, ppid, pid, pid, 0, -1, 4194560, 100, 0, 0, 0, round(cpu * ticks), 0, 0, 0, 20, 0, 1, 0,
+                  round(started * ticks), rss_pages * 4 * self.page_size, rss_pages] + [0] * 30
+        self.write(f'{pid}/stat', f"{pid} ({comm}) {' '.join(str(field) for field in fields)}\n")
+        self.write(f'{pid}/statm', f'{rss_pages * 4} {rss_pages} 100 10 0 200 0\n')
+        uid = os.getuid()
+        self.write(f'{pid}/status', f'Name:\t{comm}\nState:\t{state}\nPPid:\t{ppid}\nUid:\t{uid}\t{uid}\t{uid}\t{uid}\n')
+        args = cmdline if cmdline is not None else [f'/usr/bin/{comm}']
+        self.write(f'{pid}/cmdline', b''.join(arg.encode() + b'\x00' for arg in args))
+
+    def remove(self, pid):
+        shutil.rmtree(os.path.join(self.root, str(pid)))
+
+    def cleanup(self):
+        shutil.rmtree(self.root)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'procfs collector is Linux-only')
+class ProcfsSamplerTests(unittest.TestCase):
+    def setUp(self):
+        self.tree = FakeProcTree()
+        self.addCleanup(self.tree.cleanup)
+        self.clock = FakeClock(FakeProcTree.BOOT_TIME + 1000)
+        patcher = mock.patch.object(agent_module, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sampler = ProcfsSampler(proc_root=self.tree.root)
+
+    def sample(self):
+        return {proc['pid']: proc for proc in self.sampler.sample()}
+
+    def test_reads_stat_statm_status_and_cmdline(self):
+        self.tree.add(10, 'nginx', started=100.0, ppid=4, state='R', rss_pages=256,
+                      cmdline=['/usr/sbin/nginx', '-g', 'daemon off;'])
+        proc = self.sample()[10]
+        self.assertEqual(proc['name'], 'nginx')
+        self.assertEqual(proc['ppid'], 4)
+        self.assertEqual(proc['status'], 'running')
+        self.assertEqual(proc['cmdline'], ['/usr/sbin/nginx', '-g', 'daemon off;'])
+        self.assertEqual(proc['memory_info'].rss, 256 * self.tree.page_size)
+        self.assertAlmostEqual(proc['create_time'], FakeProcTree.BOOT_TIME + 100.0)
+
+    def test_comm_with_spaces_and_parentheses(self):
+        self.tree.add(10, 'my (odd) proc', ppid=7)
+        proc = self.sample()[10]
+        self.assertEqual(proc['name'], 'my (odd) proc')
+        self.assertEqual(proc['ppid'], 7)
+
+    def test_truncated_comm_is_recovered_from_cmdline(self):
+        self.tree.add(10, 'containerd-shim', cmdline=['/usr/bin/containerd-shim-runc-v2', '-namespace', 'moby'])
+        self.assertEqual(self.sample()[10]['name'], 'containerd-shim-runc-v2')
+
+    def test_cpu_percent_from_deltas_across_cycles(self):
+        # Started 100s ago and used 20s of CPU so far
+        self.tree.add(10, 'worker', started=900.0, cpu=20.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 20.0)
+        self.clock.sleep(10)
+        self.tree.add(10, 'worker', started=900.0, cpu=25.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 50.0)
+
+    def test_exited_pids_are_evicted(self):
+        self.tree.add(10, 'worker')
+        self.tree.add(11, 'worker')
+        self.sample()
+        self.tree.remove(11)
+        self.clock.sleep(10)
+        self.assertEqual(sorted(self.sample()), [10])
+        self.assertEqual(sorted(self.sampler._cpu_state), [10])
+
+    def test_reused_pid_starts_a_new_cpu_history(self):
+        self.tree.add(10, 'worker', started=900.0, cpu=90.0)
+        self.sample()
+        self.clock.sleep(10)
+        # pid 10 exited and was reused by a process started 4s ago that used 1s of CPU
+        self.tree.add(10, 'other', started=1006.0, cpu=1.0)
+        self.assertAlmostEqual(self.sample()[10]['cpu_percent'], 25.0)
+
+    def test_matches_psutil_on_the_same_tree(self):
+        self.tree.add(1, 'init', ppid=0, cmdline=['/sbin/init'])
+        self.tree.add(10, 'nginx', started=50.0, ppid=1, state='R', cmdline=['/usr/sbin/nginx', '-g', 'daemon off;'])
+        self.tree.add(11, 'containerd-shim', started=60.0, ppid=1, state='I',
+                      cmdline=['/usr/bin/containerd-shim-runc-v2', '-id', 'abc'])
+        self.tree.add(12, 'my (odd) proc', started=70.0, ppid=10, state='D', rss_pages=1024)
+        with mock.patch.object(psutil, 'PROCFS_PATH', self.tree.root):
+            expected = {proc['pid']: proc for proc in ProcessSampler().sample()}
+        actual = self.sample()
+        self.assertEqual(sorted(actual), sorted(expected))
+        for pid, proc in actual.items():
+            for field in ('name', 'ppid', 'status', 'username', 'cmdline'):
+                self.assertEqual(proc[field], expected[pid][field], (pid, field))
+            self.assertEqual(proc['memory_info'].rss, expected[pid]['memory_info'].rss)
+            self.assertAlmostEqual(proc['create_time'], expected[pid]['create_time'], places=2)
+
+
+class SelectProcessesTests(unittest.TestCase):
+    def tree(self, *chains, cpu=None):
+        # Processes under init (pid 1) along each chain of pids, parent first; pids in
+        # `cpu` get that CPU share, the others 1%
+        processes = {1: make_process(1, parent_pid=0)}
+        for chain in chains:
+            parent = 1
+            for pid in chain:
+                processes[pid] = make_process(pid, parent_pid=parent, cpu_percent=(cpu or {}).get(pid, 1.0))
+                parent = pid
+        return list(processes.values())
+
+    def parents(self, kept):
+        return {proc['pid']: proc['parent_pid'] for proc in kept}
+
+    def test_everything_is_sent_within_the_limit(self):
+        processes = self.tree([10], [20])
+        self.assertEqual(select_processes(processes, max_processes=3), (processes, None))
+        self.assertEqual(select_processes(processes), (processes, None))
+
+    def test_limit_keeps_the_busiest_and_totals_the_rest(self):
+        processes = self.tree([10], [20], [30], [40], cpu={10: 50.0, 30: 20.0})
+        processes[4]['memory_mb'] = 500.0
+        kept, omitted = select_processes(processes, max_processes=4)
+        # pid 1 is the ancestor of every pick and counts towards the limit
+        self.assertEqual(sorted(self.parents(kept)), [1, 10, 30, 40])
+        self.assertEqual(omitted, {'count': 1, 'cpu_percent': 1.0, 'memory_mb': 10.0})
+
+    def test_kept_processes_bring_their_ancestors(self):
+        processes = self.tree([10, 11, 12], [20], cpu={12: 90.0})
+        kept, omitted = select_processes(processes, max_processes=4)
+        self.assertEqual(self.parents(kept), {1: 0, 10: 1, 11: 10, 12: 11})
+        self.assertEqual(omitted['count'], 1)
+
+    def test_chain_deeper_than_the_limit_is_cut_short(self):
+        processes = self.tree(range(10, 20), cpu={19: 90.0})
+        kept, omitted = select_processes(processes, max_processes=3)
+        # The nearest ancestors are kept and the topmost becomes a root
+        self.assertEqual(self.parents(kept), {17: None, 18: 17, 19: 18})
+        self.assertEqual(omitted['count'], 8)
+        # The caller's dicts are left as they were
+        self.assertEqual(processes[8]['parent_pid'], 16)
+
+    def test_cut_chain_attaches_to_the_nearest_kept_ancestor(self):
+        processes = self.tree([10], [20, 21, 22, 23], cpu={10: 90.0, 23: 80.0})
+        kept, _ = select_processes(processes, max_processes=4)
+        self.assertEqual(self.parents(kept), {1: 0, 10: 1, 22: 1, 23: 22})
+
+    def test_limit_of_one_still_sends_a_process(self):
+        processes = self.tree([10, 11], cpu={11: 90.0})
+        kept, omitted = select_processes(processes, max_processes=1)
+        self.assertEqual(self.parents(kept), {11: None})
+        self.assertEqual(omitted['count'], 2)
+
+    def test_idle_kernel_threads_are_dropped_on_linux(self):
+        processes = self.tree([10]) + [
+            make_process(0, parent_pid=None, cpu_percent=0.0),
+            make_process(2, parent_pid=0, cpu_percent=0.0),
+            make_process(3, parent_pid=2, cpu_percent=0.0),
+            make_process(4, parent_pid=2, cpu_percent=5.0),
+        ]
+        with mock.patch.object(agent_module, 'HAS_KERNEL_THREADS', True):
+            kept, omitted = select_processes(processes, include_system_processes=False)
+        # The busy kernel thread is kept; dropped ones are not pulled back in as ancestors
+        self.assertEqual(self.parents(kept), {1: 0, 10: 1, 4: 2})
+        self.assertEqual(omitted['count'], 3)
+        with mock.patch.object(agent_module, 'HAS_KERNEL_THREADS', False):
+            self.assertEqual(select_processes(processes, include_system_processes=False), (processes, None))
+
+
+class ExtendedMetricsCollectorTests(unittest.TestCase):
+    def setUp(self):
+        self.system = FakeSystem()
+        self.clock = FakeClock()
+        patcher = self.system.patch()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(agent_module, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self, pid, cpu=1.0, create_time=None, **counters):
+        create_time = create_time or self.clock.now - 100
+        counters = {
+            'num_threads': 4, 'num_fds': 8, 'io_counters': IoCounters(0, 0),
+            'num_ctx_switches': CtxSwitches(0, 0), **counters
+        }
+        self.system.start(pid, create_time, **counters)
+        self.system.processes[pid]['cpu'] = cpu
+
+    def collect(self, collector):
+        # One scan: the collector fills in the process dicts the sampler produced
+        processes = [
+            make_process(pid, cpu_percent=info['cpu'], created_time=str(info['create_time']))
+            for pid, info in self.system.processes.items()
+        ]
+        collector.collect(processes)
+        return {proc['pid']: proc for proc in processes}
+
+    def test_sweep_metrics_are_left_to_the_sampler(self):
+        collector = ExtendedMetricsCollector(ExtendedMetricsCollector.DEFAULT_TIERS)
+        self.assertEqual(collector.sweep, {'num_threads', 'ctx_switches'})
+        self.assertEqual(sorted(collector.tiers), ['io_counters', 'num_fds'])
+        collector = ExtendedMetricsCollector({'num_threads': {'every': 2}, 'ctx_switches': {}})
+        self.assertEqual((collector.sweep, sorted(collector.tiers)), (set(), ['num_threads']))
+
+    def test_metrics_are_read_on_their_tier_cadence(self):
+        self.start(10)
+        collector = ExtendedMetricsCollector({'num_fds': {'every': 3}, 'num_threads': {'every': 2}})
+        scans = [self.collect(collector)[10] for _ in range(7)]
+        self.assertEqual([scan.get('num_fds') for scan in scans], [8, None, None, 8, None, None, 8])
+        self.assertEqual([scan.get('num_threads') for scan in scans], [4, None, 4, None, 4, None, 4])
+
+    def test_top_k_reads_only_the_busiest_processes(self):
+        for pid, cpu in ((10, 5.0), (11, 50.0), (12, 1.0), (13, 20.0)):
+            self.start(pid, cpu=cpu)
+        collector = ExtendedMetricsCollector({'num_fds': {'every': 1, 'top_k': 2}})
+        scan = self.collect(collector)
+        self.assertEqual(sorted(pid for pid, proc in scan.items() if 'num_fds' in proc), [11, 13])
+        # Only the processes read were opened
+        self.assertEqual(sorted(self.system.created), [11, 13])
+
+    def test_rates_come_from_the_previous_scan(self):
+        self.start(10)
+        collector = ExtendedMetricsCollector({'io_counters': {'every': 1}, 'ctx_switches': {'every': 1, 'top_k': 5}})
+        first = self.collect(collector)[10]
+        self.assertIsNone(first['io_read_bytes_per_sec'])
+        self.assertIsNone(first['voluntary_ctx_switches_per_sec'])
+        self.clock.sleep(10)
+        self.system.processes[10].update(io_counters=IoCounters(1000, 500), num_ctx_switches=CtxSwitches(200, 30))
+        second = self.collect(collector)[10]
+        self.assertEqual((second['io_read_bytes_per_sec'], second['io_write_bytes_per_sec']), (100.0, 50.0))
+        self.assertEqual(
+            (second['voluntary_ctx_switches_per_sec'], second['involuntary_ctx_switches_per_sec']), (20.0, 3.0)
+        )
+        # A counter that went backwards reads as no activity, not a negative rate
+        self.clock.sleep(10)
+        self.system.processes[10]['io_counters'] = IoCounters(0, 700)
+        third = self.collect(collector)[10]
+        self.assertEqual((third['io_read_bytes_per_sec'], third['io_write_bytes_per_sec']), (0.0, 20.0))
+
+    def test_reused_pid_starts_over_and_exited_processes_are_evicted(self):
+        self.start(10, io_counters=IoCounters(5000, 0))
+        self.start(11)
+        collector = ExtendedMetricsCollector({'io_counters': {'every': 1}})
+        self.collect(collector)
+        self.clock.sleep(10)
+        # pid 10 exited and was reused by a new process; pid 11 exited
+        del self.system.processes[11]
+        self.start(10, create_time=self.clock.now, io_counters=IoCounters(100, 0))
+        scan = self.collect(collector)
+        self.assertIsNone(scan[10]['io_read_bytes_per_sec'])
+        self.assertEqual(self.system.created.count(10), 2)
+        self.assertEqual(list(collector._processes), [10])
+        self.assertEqual(list(collector._counters), [(10, 'io_counters')])
+        self.clock.sleep(10)
+        self.system.processes[10]['io_counters'] = IoCounters(600, 0)
+        self.assertEqual(self.collect(collector)[10]['io_read_bytes_per_sec'], 50.0)
+
+    def test_unsupported_metric_is_turned_off(self):
+        self.start(10, num_fds=AttributeError('num_fds'))
+        self.start(11, num_threads=psutil.AccessDenied(11))
+        collector = ExtendedMetricsCollector({'num_fds': {'every': 1}, 'num_threads': {'every': 2}})
+        with self.assertLogs(agent_module.logger, 'WARNING'):
+            scan = self.collect(collector)
+        self.assertNotIn('num_fds', scan[10])
+        self.assertEqual(sorted(collector.tiers), ['num_threads'])
+        # A denied read skips that process only
+        self.assertEqual((scan[10]['num_threads'], scan[11].get('num_threads')), (4, None))
+        self.assertNotIn('num_fds', self.collect(collector)[11])
+
+
+class DeltaEncoderTests(unittest.TestCase):
+    def encode_acked(self, encoder, processes):
+        fields, pending = encoder.encode(processes)
+        encoder.acknowledge(pending)
+        return fields
+
+    def test_first_report_is_full(self):
+        encoder = DeltaEncoder()
+        fields = self.encode_acked(encoder, [make_process(1)])
+        self.assertEqual(fields['mode'], 'full')
+        self.assertEqual(fields['sequence'], 1)
+        self.assertEqual(fields['processes'], [make_process(1)])
+
+    def test_added_removed_and_changed(self):
+        encoder = DeltaEncoder(cpu_threshold=1.0, memory_threshold_mb=5.0)
+        self.encode_acked(encoder, [make_process(1), make_process(2), make_process(3)])
+        fields = self.encode_acked(encoder, [
+            make_process(1, cpu_percent=1.5),
+            make_process(2, cpu_percent=5.0),
+            make_process(4),
+        ])
+        self.assertEqual(fields['mode'], 'delta')
+        self.assertEqual((fields['sequence'], fields['baseline_sequence']), (2, 1))
+        self.assertEqual([proc['pid'] for proc in fields['added']], [4])
+        self.assertEqual([proc['pid'] for proc in fields['changed']], [2])
+        self.assertEqual(fields['removed'], [{'pid': 3, 'created_time': '2025-01-01T00:00:00'}])
+
+    def test_small_changes_accumulate_against_the_stored_values(self):
+        # pid 1 drifts 0.6% per report: it is not sent until it is 1% away from what
+        # the backend stored, not from the previous (unsent) reading
+        encoder = DeltaEncoder(cpu_threshold=1.0)
+        self.encode_acked(encoder, [make_process(1, cpu_percent=1.0)])
+        self.assertEqual(self.encode_acked(encoder, [make_process(1, cpu_percent=1.6)])['changed'], [])
+        changed = self.encode_acked(encoder, [make_process(1, cpu_percent=2.2)])['changed']
+        self.assertEqual([proc['cpu_percent'] for proc in changed], [2.2])
+
+    def test_identity_field_change(self):
+        encoder = DeltaEncoder()
+        self.encode_acked(encoder, [make_process(1)])
+        fields = self.encode_acked(encoder, [make_process(1, status='sleeping')])
+        self.assertEqual([proc['status'] for proc in fields['changed']], ['sleeping'])
+
+    def test_reused_pid_is_removed_and_added(self):
+        encoder = DeltaEncoder()
+        self.encode_acked(encoder, [make_process(7)])
+        fields = self.encode_acked(encoder, [make_process(7, created_time='2025-01-02T00:00:00')])
+        self.assertEqual(fields['removed'], [{'pid': 7, 'created_time': '2025-01-01T00:00:00'}])
+        self.assertEqual([proc['created_time'] for proc in fields['added']], ['2025-01-02T00:00:00'])
+
+    def test_full_resync_interval(self):
+        encoder = DeltaEncoder(full_resync_interval=3)
+        modes = [self.encode_acked(encoder, [make_process(1)])['mode'] for _ in range(8)]
+        self.assertEqual(modes, ['full', 'delta', 'delta', 'delta', 'full', 'delta', 'delta', 'delta'])
+
+    def test_unacknowledged_report_is_not_the_baseline(self):
+        encoder = DeltaEncoder()
+        self.encode_acked(encoder, [make_process(1)])
+        encoder.encode([make_process(1), make_process(2)])
+        fields = self.encode_acked(encoder, [make_process(1), make_process(2)])
+        self.assertEqual((fields['sequence'], fields['baseline_sequence']), (3, 1))
+        self.assertEqual([proc['pid'] for proc in fields['added']], [2])
+
+    def test_reset_sends_full(self):
+        encoder = DeltaEncoder()
+        self.encode_acked(encoder, [make_process(1)])
+        encoder.reset()
+        self.assertEqual(self.encode_acked(encoder, [make_process(1)])['mode'], 'full')
+
+
+class SendDeltaTests(unittest.TestCase):
+    def make_agent(self, responses):
+        agent = SystemMonitorAgent.__new__(SystemMonitorAgent)
+        agent.delta_encoder = DeltaEncoder()
+        agent.sent = []
+
+        def submit(payload):
+            agent.sent.append(payload)
+            return responses.pop(0)
+
+        agent._submit = submit
+        return agent
+
+    def test_resend_baseline_resets_and_sends_full(self):
+        agent = self.make_agent([
+            FakeResponse(200),
+            FakeResponse(409, {'resend_baseline': True, 'last_sequence': None}),
+            FakeResponse(200),
+            FakeResponse(200),
+        ])
+        report = {'hostname': 'host1', 'processes': [make_process(1), make_process(2)]}
+        self.assertEqual(agent.deliver_report(report), 200)
+        self.assertEqual(agent.deliver_report(report), 200)
+        self.assertEqual([payload['mode'] for payload in agent.sent], ['full', 'delta', 'full'])
+        self.assertEqual(agent.sent[2]['processes'], report['processes'])
+        # The resent full snapshot is the new baseline
+        self.assertEqual(agent.deliver_report(report), 200)
+        self.assertEqual(agent.sent[3]['mode'], 'delta')
+        self.assertEqual(agent.sent[3]['baseline_sequence'], agent.sent[2]['sequence'])
+
+    def test_rejected_report_is_not_acknowledged(self):
+        agent = self.make_agent([FakeResponse(200), FakeResponse(500), FakeResponse(200)])
+        self.assertEqual(agent.deliver_report({'processes': [make_process(1)]}), 200)
+        report = {'processes': [make_process(1), make_process(2)]}
+        self.assertEqual(agent.deliver_report(report), 500)
+        self.assertEqual(agent.deliver_report(report), 200)
+        self.assertEqual(agent.sent[2]['baseline_sequence'], agent.sent[0]['sequence'])
+        self.assertEqual([proc['pid'] for proc in agent.sent[2]['added']], [2])
+
+
+class ReportSpoolTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'spool.jsonl')
+
+    def spool(self, max_bytes=1024 * 1024):
+        return ReportSpool(self.path, max_bytes)
+
+    def read_all(self, spool):
+        return [report for _, report in spool.read_batch(100)]
+
+    def test_reports_are_read_in_order(self):
+        spool = self.spool()
+        for sequence in range(3):
+            spool.append({'sequence': sequence})
+        self.assertTrue(spool.pending())
+        self.assertEqual(self.read_all(spool), [{'sequence': 0}, {'sequence': 1}, {'sequence': 2}])
+
+    def test_offset_survives_a_restart(self):
+        spool = self.spool()
+        for sequence in range(3):
+            spool.append({'sequence': sequence})
+        end_offset, _ = spool.read_batch(1)[0]
+        spool.consume(end_offset)
+        self.assertEqual(self.read_all(self.spool()), [{'sequence': 1}, {'sequence': 2}])
+
+    def test_drained_spool_starts_a_fresh_file(self):
+        spool = self.spool()
+        spool.append({'sequence': 0})
+        end_offset, _ = spool.read_batch(1)[0]
+        spool.consume(end_offset)
+        self.assertFalse(spool.pending())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(spool.offset, 0)
+
+    def test_partial_line_is_dropped_on_open(self):
+        # The agent crashed halfway through appending the third report
+        with open(self.path, 'wb') as f:
+            f.write(b'{"sequence":0}\n{"sequence":1}\n{"seque')
+        spool = self.spool()
+        spool.append({'sequence': 2})
+        self.assertEqual(self.read_all(spool), [{'sequence': 0}, {'sequence': 1}, {'sequence': 2}])
+
+    def test_partial_line_after_the_offset_only(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'{"sequence":0}\n{"seque')
+        with open(f'{self.path}.offset', 'w') as f:
+            f.write('15')
+        spool = self.spool()
+        self.assertFalse(spool.pending())
+        spool.append({'sequence': 1})
+        self.assertEqual(self.read_all(spool), [{'sequence': 1}])
+
+    def test_full_spool_drops_reports(self):
+        spool = self.spool(max_bytes=40)
+        self.assertTrue(spool.append({'sequence': 0}))
+        self.assertTrue(spool.append({'sequence': 1}))
+        self.assertFalse(spool.append({'sequence': 2}))
+        self.assertEqual(self.read_all(spool), [{'sequence': 0}, {'sequence': 1}])
+
+    def test_corrupt_line_is_skipped(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'{"sequence":0}\nnot json\n{"sequence":1}\n')
+        self.assertEqual(self.read_all(self.spool()), [{'sequence': 0}, None, {'sequence': 1}])
+
+
+class ReportSenderTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.spool = ReportSpool(os.path.join(directory, 'spool.jsonl'), 1024 * 1024)
+        self.delivered = []
+        self.statuses = []
+        self.done = threading.Event()
+
+    def deliver(self, report):
+        status_code = self.statuses.pop(0) if self.statuses else 200
+        self.delivered.append((report['sequence'], status_code))
+        if report.get('last'):
+            self.done.set()
+        return status_code
+
+    def sender(self, **options):
+        sender = ReportSender(self.deliver, spool=self.spool, backoff_initial=0.01, backoff_max=0.05, **options)
+        self.addCleanup(sender.stop)
+        return sender
+
+    def test_spool_drains_in_order_before_the_queue(self):
+        for sequence in range(3):
+            self.spool.append({'sequence': sequence})
+        sender = self.sender(drain_batch=2)
+        sender.submit({'sequence': 3, 'last': True})
+        sender.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual([sequence for sequence, _ in self.delivered], [0, 1, 2, 3])
+        self.assertFalse(self.spool.pending())
+
+    def test_failed_report_stays_ahead_of_later_ones(self):
+        self.statuses = [503, 503]
+        sender = self.sender()
+        sender.submit({'sequence': 0})
+        sender.submit({'sequence': 1, 'last': True})
+        sender.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.delivered, [(0, 503), (0, 503), (0, 200), (1, 200)])
+
+    def test_rejected_report_is_dropped(self):
+        self.statuses = [400]
+        sender = self.sender()
+        sender.submit({'sequence': 0})
+        sender.submit({'sequence': 1, 'last': True})
+        sender.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.delivered, [(0, 400), (1, 200)])
+
+    def test_unreadable_spool_backs_off(self):
+        # Pending bytes that never form a line must not spin the sender thread
+        sender = self.sender()
+        with open(self.spool.path, 'wb') as f:
+            f.write(b'{"seque')
+        with mock.patch.object(sender, '_wait_backoff', wraps=sender._wait_backoff) as wait_backoff:
+            sender.start()
+            time.sleep(0.2)
+            sender.stop()
+        self.assertLess(wait_backoff.call_count, 50)
+        self.assertGreater(sender.backoff, 0)
+
+
+class ClockEvent(threading.Event):
+    # Stop event whose waits advance a FakeClock instead of sleeping
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def wait(self, timeout=None):
+        self.clock.sleep(timeout)
+        return self.is_set()
+
+
+class CollectionSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = CollectionScheduler(clock=self.clock.monotonic)
+        self.scheduler.stopping = ClockEvent(self.clock)
+        self.runs = []
+
+    def collector(self, name, duration=0.0, runs=None):
+        # Records its start time, takes `duration` seconds and stops the scheduler
+        # after `runs` runs
+        def collect():
+            self.runs.append((name, self.clock.now))
+            self.clock.sleep(duration)
+            if runs is not None and sum(1 for run in self.runs if run[0] == name) >= runs:
+                self.scheduler.stop()
+        return collect
+
+    def test_runs_are_due_at_start_plus_n_intervals(self):
+        self.scheduler.add('processes', 10, self.collector('processes', duration=3, runs=4))
+        self.scheduler.run()
+        self.assertEqual(self.runs, [('processes', 1000), ('processes', 1010), ('processes', 1020), ('processes', 1030)])
+
+    def test_collectors_keep_their_own_intervals(self):
+        self.scheduler.add('processes', 10, self.collector('processes', runs=4))
+        self.scheduler.add('system', 15, self.collector('system'), delay=5)
+        self.scheduler.run()
+        # At 1020 both are due: they run in the order they were added
+        self.assertEqual(self.runs, [
+            ('processes', 1000), ('system', 1005), ('processes', 1010),
+            ('processes', 1020), ('system', 1020), ('processes', 1030),
+        ])
+
+    def test_overruns_skip_runs_instead_of_queueing_them(self):
+        self.scheduler.add('processes', 10, self.collector('processes', duration=25, runs=3))
+        with self.assertLogs(agent_module.logger, 'WARNING') as logs:
+            self.scheduler.run()
+        self.assertEqual(self.runs, [('processes', 1000), ('processes', 1030), ('processes', 1060)])
+        self.assertIn("Collector 'processes' skipped 2 runs", logs.output[0])
+
+    def test_slow_collector_delays_but_does_not_pile_up_others(self):
+        self.scheduler.add('processes', 10, self.collector('processes', duration=35))
+        self.scheduler.add('system', 5, self.collector('system', runs=3))
+        with self.assertLogs(agent_module.logger, 'WARNING'):
+            self.scheduler.run()
+        # system runs once for the six slots it missed while processes ran, then
+        # continues on its own grid
+        self.assertEqual(self.runs, [
+            ('processes', 1000), ('system', 1035), ('processes', 1040),
+            ('system', 1075), ('processes', 1080), ('system', 1115),
+        ])
+
+    def test_failing_collector_keeps_its_schedule(self):
+        def fail():
+            self.runs.append(('failing', self.clock.now))
+            raise OSError('unreadable')
+        self.scheduler.add('failing', 10, fail)
+        self.scheduler.add('processes', 10, self.collector('processes', runs=2))
+        with self.assertLogs(agent_module.logger, 'ERROR'):
+            self.scheduler.run()
+        self.assertEqual(self.runs, [('failing', 1000), ('processes', 1000), ('failing', 1010), ('processes', 1010)])
+
+
+if __name__ == '__main__':
+    unittest.main()
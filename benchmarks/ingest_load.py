@@ -0,0 +1,152 @@
+"""
+Measures sustained /api/submit/ throughput for each database configuration.
+Concurrent writer processes submit reports from their own hosts to a fresh test
+database for a fixed time; each configuration runs in its own interpreter, since
+the database settings are read from the environment at startup.
+
+Configurations:
+  sqlite      Django's stock SQLite setup (rollback journal, reconnect per request)
+  sqlite-wal  the default settings (WAL, tuned pragmas, BEGIN IMMEDIATE, persistent connections)
+  postgresql  PostgreSQL from the PROCESS_MONITOR_DB_* variables (a test_ database is created)
+
+Usage: python benchmarks/ingest_load.py [writers] [seconds] [processes] [configs]
+  e.g. python benchmarks/ingest_load.py 8 20 300 sqlite,sqlite-wal,postgresql
+"""
+import json
+import logging
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'cyethack'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cyethack.settings')
+
+CONFIGS = {
+    'sqlite': {'PROCESS_MONITOR_DB_ENGINE': 'sqlite', 'PROCESS_MONITOR_SQLITE_WAL': '0'},
+    'sqlite-wal': {'PROCESS_MONITOR_DB_ENGINE': 'sqlite', 'PROCESS_MONITOR_SQLITE_WAL': '1'},
+    'postgresql': {'PROCESS_MONITOR_DB_ENGINE': 'postgresql'},
+}
+HOSTS_PER_WRITER = 4
+NAMES = ['python3', 'nginx', 'postgres', 'java', 'bash', 'sshd', 'node']
+
+
+def make_payload(rng, hostname, timestamp, processes):
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+    return {
+        'hostname': hostname,
+        'timestamp': timestamp.isoformat(),
+        'processes': [
+            {
+                'pid': pid,
+                'name': NAMES[pid % len(NAMES)],
+                'parent_pid': pid // 4,
+                'username': 'root',
+                'command_line': f'/usr/bin/{NAMES[pid % len(NAMES)]} --worker {pid}',
+                'created_time': started,
+                'cpu_percent': round(rng.random() * 5, 2),
+                'memory_percent': round(rng.random(), 3),
+                'memory_mb': round(rng.random() * 500, 2),
+                'status': 'sleeping',
+            }
+            for pid in range(1, processes + 1)
+        ],
+    }
+
+
+def submit_loop(writer, start_at, seconds, processes):
+    # One agent-like writer: submits back to back from its hosts until the window closes
+    import django
+    django.setup()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    logging.disable(logging.CRITICAL)
+    client = Client(raise_request_exception=False)
+    rng = random.Random(writer)
+    timestamp = datetime.now(timezone.utc)
+    latencies, errors = [], 0
+    time.sleep(max(0.0, start_at - time.time()))
+    index = 0
+    while time.time() < start_at + seconds:
+        timestamp += timedelta(seconds=1)
+        body = json.dumps(make_payload(rng, f'load-{writer}-{index % HOSTS_PER_WRITER}', timestamp, processes))
+        started = time.perf_counter()
+        response = client.post('/api/submit/', body, content_type='application/json')
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors += 1
+        index += 1
+    return latencies, errors
+
+
+def run_config(writers, seconds, processes):
+    # Runs inside the configuration's interpreter and prints one JSON result line
+    import django
+    from django.conf import settings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+            # A file, not the in-memory test database, so writer processes share it
+            settings.DATABASES['default']['TEST'] = {'NAME': os.path.join(tmp, 'load.sqlite3')}
+        django.setup()
+        from django.db import connection
+
+        old_name = settings.DATABASES['default']['NAME']
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        connection.close()
+        os.environ['PROCESS_MONITOR_DB_NAME'] = str(test_name)
+        try:
+            context = multiprocessing.get_context('spawn')
+            start_at = time.time() + 3
+            with context.Pool(writers) as pool:
+                results = pool.starmap(submit_loop, [(writer, start_at, seconds, processes) for writer in range(writers)])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    latencies = sorted(latency for result in results for latency in result[0])
+    count = len(latencies)
+    print(json.dumps({
+        'submits_per_sec': count / seconds,
+        'rows_per_sec': count * processes / seconds,
+        'p50_ms': latencies[count // 2] * 1000 if count else None,
+        'p95_ms': latencies[int(count * 0.95)] * 1000 if count else None,
+        'max_ms': latencies[-1] * 1000 if count else None,
+        'errors': sum(result[1] for result in results),
+    }))
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    configs = (sys.argv[4] if len(sys.argv) > 4 else 'sqlite,sqlite-wal').split(',')
+    print(f'{writers} writers x {seconds:g} s, {processes} processes per report')
+    for name in configs:
+        env = dict(os.environ, **CONFIGS[name], PROCESS_MONITOR_LOAD_RUN='1')
+        completed = subprocess.run(
+            [sys.executable, __file__, str(writers), str(seconds), str(processes)],
+            env=env, capture_output=True, text=True
+        )
+        if completed.returncode:
+            print(f'  {name:<11} failed: {completed.stderr.strip().splitlines()[-1]}')
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        latency = (f"{result['p50_ms']:.0f} ms median, {result['p95_ms']:.0f} ms p95, {result['max_ms']:.0f} ms max"
+                   if result['p50_ms'] is not None else 'no successful submits')
+        print(f"  {name:<11} {result['submits_per_sec']:7.1f} submits/s  {result['rows_per_sec']:9.0f} rows/s  "
+              f"{latency}, {result['errors']} errors")
+
+
+if __name__ == '__main__':
+    if os.environ.get('PROCESS_MONITOR_LOAD_RUN'):
+        run_config(int(sys.argv[1]), float(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
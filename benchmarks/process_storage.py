@@ -0,0 +1,95 @@
+"""
+Measures database size and ingest time of the backend's process storage by
+ingesting synthetic snapshots of long-lived processes into a fresh SQLite DB.
+
+Usage: python benchmarks/process_storage.py [snapshots] [processes] [churn]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'cyethack'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cyethack.settings')
+
+import django
+from django.conf import settings
+
+NAMES = ['python3', 'nginx', 'postgres', 'java', 'containerd-shim-runc-v2', 'bash', 'sshd', 'node']
+USERS = ['root', 'www-data', 'postgres', 'app']
+
+
+def make_process(rng, pid, started):
+    name = rng.choice(NAMES)
+    args = [f'/usr/bin/{name}'] + [f'--option-{i}=/srv/app/{rng.randrange(10**6)}' for i in range(rng.randrange(2, 10))]
+    return {
+        'pid': pid,
+        'name': name,
+        'parent_pid': rng.randrange(1, pid) if pid > 1 else 0,
+        'username': rng.choice(USERS),
+        'command_line': ' '.join(args),
+        'created_time': started.isoformat(),
+    }
+
+
+def make_snapshots(snapshots, processes, churn, seed=7):
+    # Mostly long-lived processes: each snapshot replaces `churn` of them and varies the metrics
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    current = {pid: make_process(rng, pid, started) for pid in range(1, processes + 1)}
+    next_pid = processes + 1
+    for index in range(snapshots):
+        timestamp = started + timedelta(minutes=index)
+        for pid in rng.sample(sorted(current), int(processes * churn)):
+            del current[pid]
+            current[next_pid] = make_process(rng, next_pid, timestamp)
+            next_pid += 1
+        yield {
+            'hostname': 'bench-host',
+            'timestamp': timestamp.isoformat(),
+            'processes': [
+                dict(proc, cpu_percent=round(rng.random() * 5, 2), memory_percent=round(rng.random(), 3),
+                     memory_mb=round(rng.random() * 500, 2), status='sleeping')
+                for proc in current.values()
+            ],
+        }
+
+
+def main():
+    snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    churn = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.sqlite3')
+        settings.DATABASES['default']['NAME'] = db_path
+        django.setup()
+        from django.core.management import call_command
+        from django.db import connection
+        from process_monitor.ingest import ingest_payload
+        from process_monitor.models import Process
+
+        call_command('migrate', verbosity=0)
+        connection.cursor().execute('VACUUM')
+        empty_size = os.path.getsize(db_path)
+        timings = []
+        for payload in make_snapshots(snapshots, processes, churn):
+            started = time.perf_counter()
+            ingest_payload(payload)
+            timings.append(time.perf_counter() - started)
+        connection.cursor().execute('VACUUM')
+        data_size = os.path.getsize(db_path) - empty_size
+        rows = Process.objects.count()
+        timings.sort()
+        print(f'{snapshots} snapshots x {processes} processes, churn {churn:.0%}')
+        print(f'  process rows      {rows}')
+        print(f'  database growth   {data_size / 1024 / 1024:.2f} MiB ({data_size / rows:.0f} bytes/row)')
+        print(f'  ingest per report {sum(timings) / len(timings) * 1000:.1f} ms avg, '
+              f'{timings[len(timings) // 2] * 1000:.1f} ms median')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Compares the agent's psutil sampler with the direct /proc reader on a
+synthetic /proc-like fixture tree, so both read identical data.
+
+Usage: python benchmarks/procfs_collector.py [process_count ...]   (Linux only)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'agent'))
+
+import psutil
+from system_monitor_agent import ProcessSampler, ProcfsSampler
+
+NAMES = ['python3', 'nginx', 'postgres', 'java', 'containerd-shim-runc-v2', 'bash', 'sshd', 'node']
+STATES = ['S', 'S', 'S', 'R', 'I', 'D']
+REPEATS = 3
+# Fixed across fixtures because psutil caches the boot time after its first read
+BOOT_TIME = 1700000000
+COMPARED_FIELDS = ('name', 'ppid', 'status', 'username', 'cmdline')
+
+
+def write_fixture(root, count, seed=42):
+    rng = random.Random(seed)
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    uid = os.getuid()
+    if os.path.exists('/proc/meminfo'):
+        meminfo = Path('/proc/meminfo').read_text()
+    else:
+        meminfo = 'MemTotal:       16000000 kB\nMemFree:         8000000 kB\n'
+    (root / 'meminfo').write_text(meminfo)
+    (root / 'stat').write_text(f'cpu  1 1 1 1 1 1 1 0 0 0\nbtime {BOOT_TIME}\n')
+    for pid in range(1, count + 1):
+        name = rng.choice(NAMES)
+        state = rng.choice(STATES)
+        ppid = rng.randrange(0, pid)
+        utime, stime = rng.randrange(10**6), rng.randrange(10**5)
+        starttime = rng.randrange(1, 80000 * clock_ticks)
+        fields = [state, ppid, pid, pid, 0, -1, 4194560, 100, 0, 0, 0, utime, stime, 0, 0, 20, 0, 1, 0,
+                  starttime, 1 << 30, 5000] + [0] * 30
+        pdir = root / str(pid)
+        pdir.mkdir()
+        (pdir / 'stat').write_text(f"{pid} ({name[:15]}) {' '.join(str(f) for f in fields)}\n")
+        (pdir / 'statm').write_text(f'{rng.randrange(10**5, 10**6)} {rng.randrange(100, 10**5)} 500 10 0 2000 0\n')
+        (pdir / 'status').write_text(
+            f'Name:\t{name[:15]}\nState:\t{state}\nPPid:\t{ppid}\n'
+            f'Uid:\t{uid}\t{uid}\t{uid}\t{uid}\nGid:\t0\t0\t0\t0\n'
+        )
+        args = [f'/usr/bin/{name}'] + [f'--flag{i}=/srv/{rng.randrange(10**6)}' for i in range(rng.randrange(0, 8))]
+        (pdir / 'cmdline').write_bytes(b'\x00'.join(arg.encode() for arg in args) + b'\x00')
+
+
+def timed(sampler):
+    timings = []
+    samples = None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        samples = sampler.sample()
+        timings.append(time.perf_counter() - started)
+    return samples, min(timings) * 1000
+
+
+def run(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        write_fixture(root, count)
+        psutil.PROCFS_PATH = str(root)
+        psutil_samples, psutil_ms = timed(ProcessSampler())
+        procfs_samples, procfs_ms = timed(ProcfsSampler(proc_root=str(root)))
+        by_pid = {info['pid']: info for info in psutil_samples}
+        mismatches = 0
+        for info in procfs_samples:
+            other = by_pid.get(info['pid'])
+            if other is None or any(info[f] != other[f] for f in COMPARED_FIELDS) \
+                    or info['memory_info'].rss != other['memory_info'].rss \
+                    or abs(info['create_time'] - other['create_time']) > 0.01:
+                mismatches += 1
+        print(f"\n{count} processes")
+        print(f"{'collector':<10} {'samples':>8} {'ms/sweep':>10}")
+        print(f"{'psutil':<10} {len(psutil_samples):>8} {psutil_ms:>10.1f}")
+        print(f"{'procfs':<10} {len(procfs_samples):>8} {procfs_ms:>10.1f}")
+        print(f"speedup {psutil_ms / procfs_ms:.1f}x, mismatched samples: {mismatches}")
+
+
+if __name__ == '__main__':
+    if not sys.platform.startswith('linux'):
+        sys.exit('The procfs collector benchmark only runs on Linux')
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        run(count)
@@ -0,0 +1,90 @@
+"""
+Compares the agent payload encodings (json, gzip, columnar) by bytes on the
+wire, agent encode time and backend parse time.
+
+Usage: python benchmarks/wire_format.py [process_count ...]
+"""
+import io
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'agent'))
+sys.path.insert(0, str(ROOT / 'cyethack'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cyethack.settings')
+
+import django
+django.setup()
+
+from system_monitor_agent import PAYLOAD_ENCODINGS, encode_payload
+from process_monitor.parsers import ColumnarJSONParser, CompressedJSONParser, COLUMNAR_MEDIA_TYPE
+
+NAMES = ['python3', 'nginx', 'postgres', 'java', 'containerd-shim', 'bash', 'sshd', 'node', 'kworker/3:1']
+USERS = ['root', 'www-data', 'postgres', 'app', 'systemd-resolve']
+REPEATS = 5
+
+
+class FakeRequest:
+    def __init__(self, headers):
+        self.META = {}
+        if 'Content-Encoding' in headers:
+            self.META['HTTP_CONTENT_ENCODING'] = headers['Content-Encoding']
+
+
+def make_processes(count, seed=42):
+    rng = random.Random(seed)
+    processes = []
+    for pid in range(1, count + 1):
+        name = rng.choice(NAMES)
+        args = ' '.join(f'--opt{i}=/srv/app/{rng.randrange(10**6)}' for i in range(rng.randrange(0, 12)))
+        processes.append({
+            'pid': pid,
+            'name': name,
+            'parent_pid': rng.randrange(0, pid),
+            'cpu_percent': round(rng.random() * 5, 2),
+            'memory_percent': round(rng.random() * 2, 2),
+            'memory_mb': round(rng.random() * 500, 2),
+            'status': rng.choice(['running', 'sleeping', 'sleeping', 'idle']),
+            'username': rng.choice(USERS),
+            'command_line': f'/usr/bin/{name} {args}'.strip()[:500],
+            'created_time': '2025-01-01T00:00:00'
+        })
+    return processes
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings) * 1000
+
+
+def run(count):
+    payload = {
+        'hostname': 'bench-host',
+        'timestamp': '2025-01-01T00:00:00',
+        'system_info': {'operating_system': 'Linux', 'processor': 'bench', 'processor_cores': 8},
+        'processes': make_processes(count)
+    }
+    print(f"\n{count} processes")
+    print(f"{'encoding':<10} {'bytes':>12} {'ratio':>7} {'encode ms':>10} {'parse ms':>10}")
+    baseline = None
+    for encoding in PAYLOAD_ENCODINGS:
+        (body, headers), encode_ms = best_of(lambda: encode_payload(payload, encoding))
+        parser = ColumnarJSONParser() if headers['Content-Type'] == COLUMNAR_MEDIA_TYPE else CompressedJSONParser()
+        context = {'request': FakeRequest(headers)}
+        parsed, parse_ms = best_of(lambda: parser.parse(io.BytesIO(body), headers['Content-Type'], context))
+        assert parsed['processes'] == payload['processes']
+        baseline = baseline or len(body)
+        print(f"{encoding:<10} {len(body):>12} {len(body) / baseline:>7.2f} {encode_ms:>10.2f} {parse_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        run(count)
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -82,10 +84,81 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'process_monitor.parsers.CompressedJSONParser',
+        'process_monitor.parsers.ColumnarJSONParser',
     ]
 }
 
+# Process ingestion: number of Process rows per bulk INSERT
+PROCESS_MONITOR_INGEST_BATCH_SIZE = 500
+# Most reports accepted by one /api/submit/batch/ request
+PROCESS_MONITOR_MAX_BATCH_REPORTS = 100
+# /api/submit/queued/: writer threads per server process, reports queued before
+# agents get 429, and reports saved per transaction
+PROCESS_MONITOR_INGEST_QUEUE = {
+    'WORKERS': 2,
+    'MAX_SIZE': 1000,
+    'BATCH_SIZE': 20,
+}
+# Agent API keys (X-API-Key) on the submit endpoints. Lookups are cached per server
+# process: a revoked key keeps working for up to CACHE_TTL seconds, and last_used is
+# written every LAST_USED_FLUSH seconds.
+PROCESS_MONITOR_API_KEYS = {
+    'REQUIRED': os.environ.get('PROCESS_MONITOR_REQUIRE_API_KEY') == '1',
+    'CACHE_TTL': 60,
+    'NEGATIVE_TTL': 10,
+    'NEGATIVE_MAX_SIZE': 10000,
+    'LAST_USED_FLUSH': 60,
+}
+# Upper bound for gzip-compressed agent payloads once decompressed
+PROCESS_MONITOR_MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+
+# Retention: days each tier is kept (None keeps it forever). Raw snapshots are
+# rolled up into hourly/daily per-host aggregates before they are deleted.
+PROCESS_MONITOR_RETENTION = {
+    'raw': 7,
+    'hour': 90,
+    'day': 365,
+}
+# Snapshots deleted per transaction
+PROCESS_MONITOR_RETENTION_BATCH_SIZE = 50
+# Run retention in a background thread of the server process, every interval seconds,
+# and reconcile the /api/status counters every reconcile interval seconds.
+# Enable it on one server process only, or use `manage.py apply_retention` from cron.
+PROCESS_MONITOR_RETENTION_SCHEDULER = False
+PROCESS_MONITOR_RETENTION_INTERVAL = 3600
+PROCESS_MONITOR_RECONCILE_INTERVAL = 86400
+
+# Partitioned storage (PostgreSQL, after `manage.py partition_storage --convert`): days per
+# partition and how many days ahead partitions are created. Retention then drops
+# whole expired partitions.
+PROCESS_MONITOR_PARTITIONS = {
+    'days': 1,
+    'premake': 3,
+}
+
+# /api/status counters: rows the ingest transactions spread their increments over,
+# the window ingest rates are averaged over, and when a silent host counts as stale.
+# The retention scheduler corrects drift; without it run `manage.py reconcile_counters` from cron.
+PROCESS_MONITOR_COUNTER_SHARDS = 8
+PROCESS_MONITOR_STATUS_RATE_WINDOW = 300
+PROCESS_MONITOR_STALE_HOST_SECONDS = 300
+
+# Most buckets one time-series request may return
+PROCESS_MONITOR_TIMESERIES_MAX_POINTS = 2000
+
+# Rows fetched per round trip by streamed responses (processes/latest/?view=stream, export/)
+PROCESS_MONITOR_STREAM_CHUNK_SIZE = 2000
+
+# Rendered responses of the latest-snapshot endpoints, keyed by host and snapshot id.
+# BACKEND is 'memory' (per process), 'file' (shared directory), 'none' or a dotted path.
+PROCESS_MONITOR_RESPONSE_CACHE = {
+    'BACKEND': 'memory',
+    'MAX_BYTES': 32 * 1024 * 1024,
+    # 'BACKEND': 'file',
+    # 'LOCATION': BASE_DIR / 'response_cache',
+}
+
 # CORS settings for frontend
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
@@ -98,12 +171,63 @@ CORS_ALLOW_CREDENTIALS = True
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment:
+#   PROCESS_MONITOR_DB_ENGINE          sqlite (default) or postgresql
+#   PROCESS_MONITOR_DB_NAME            SQLite file or PostgreSQL database
+#   PROCESS_MONITOR_DB_USER, _PASSWORD, _HOST, _PORT   PostgreSQL connection
+#   PROCESS_MONITOR_DB_CONN_MAX_AGE    seconds a connection is reused across requests (default 60, 0 closes it after each)
+#   PROCESS_MONITOR_DB_DISABLE_SERVER_SIDE_CURSORS   1 behind PgBouncer in transaction pooling mode
+#   PROCESS_MONITOR_SQLITE_WAL         0 for Django's stock SQLite setup (rollback journal, no tuning)
+#   PROCESS_MONITOR_SQLITE_TIMEOUT     seconds a writer waits for the database lock (default 20)
+
+DB_ENGINE = os.environ.get('PROCESS_MONITOR_DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('PROCESS_MONITOR_DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('PROCESS_MONITOR_DB_NAME', 'process_monitor'),
+            'USER': os.environ.get('PROCESS_MONITOR_DB_USER', ''),
+            'PASSWORD': os.environ.get('PROCESS_MONITOR_DB_PASSWORD', ''),
+            'HOST': os.environ.get('PROCESS_MONITOR_DB_HOST', ''),
+            'PORT': os.environ.get('PROCESS_MONITOR_DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Reused connections are checked before each request, so a restarted server is reconnected
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('PROCESS_MONITOR_DB_DISABLE_SERVER_SIDE_CURSORS') == '1',
+        }
     }
-}
+elif DB_ENGINE == 'sqlite' and os.environ.get('PROCESS_MONITOR_SQLITE_WAL', '1') == '0':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('PROCESS_MONITOR_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'process_monitor.db_backends.sqlite3',
+            'NAME': os.environ.get('PROCESS_MONITOR_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'timeout': int(os.environ.get('PROCESS_MONITOR_SQLITE_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+                'pragmas': {
+                    # Readers no longer block the writer, and commits append to the WAL
+                    'journal_mode': 'wal',
+                    # Durable at checkpoints rather than at every commit; safe against corruption in WAL mode
+                    'synchronous': 'normal',
+                    'cache_size': -64000,
+                    'temp_store': 'memory',
+                    'mmap_size': 268435456,
+                },
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"PROCESS_MONITOR_DB_ENGINE must be 'sqlite' or 'postgresql', not {DB_ENGINE!r}")
 
 
 # Password validation
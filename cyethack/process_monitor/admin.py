@@ -1,8 +1,13 @@
 from django.contrib import admin
-from .models import Host, ProcessSnapshot, Process, APIKey,SystemSnapshot
+from .models import Host, ProcessSnapshot, Process, ProcessIdentity, APIKey,SystemSnapshot, HostInventory, HostRollup, StatusCounter, IngestActivity
 
 admin.site.register(Host)
 admin.site.register(ProcessSnapshot)
 admin.site.register(Process)
+admin.site.register(ProcessIdentity)
 admin.site.register(APIKey)
-admin.site.register(SystemSnapshot)
\ No newline at end of file
+admin.site.register(SystemSnapshot)
+admin.site.register(HostInventory)
+admin.site.register(HostRollup)
+admin.site.register(StatusCounter)
+admin.site.register(IngestActivity)
\ No newline at end of file
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ProcessMonitorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'process_monitor'
+    retention_scheduler = None
+
+    def ready(self):
+        if getattr(settings, 'PROCESS_MONITOR_RETENTION_SCHEDULER', False) and self.retention_scheduler is None:
+            from .retention import RetentionScheduler
+            ProcessMonitorConfig.retention_scheduler = RetentionScheduler()
+            ProcessMonitorConfig.retention_scheduler.start()
@@ -0,0 +1,194 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Case, DateTimeField, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+from .models import APIKey
+
+logger = logging.getLogger(__name__)
+
+API_KEY_HEADER = 'X-API-Key'
+DEFAULT_API_KEYS = {
+    # Reject ingest requests without a valid key
+    'REQUIRED': False,
+    # Seconds an active key is trusted without asking the database: the longest a
+    # revoked key keeps working in another server process
+    'CACHE_TTL': 60,
+    # Seconds an unknown or inactive key is rejected without asking the database
+    'NEGATIVE_TTL': 10,
+    # Most rejected keys remembered, so random keys cannot grow the cache unbounded
+    'NEGATIVE_MAX_SIZE': 10000,
+    # Seconds between the batched last_used updates
+    'LAST_USED_FLUSH': 60,
+}
+
+CachedKey = namedtuple('CachedKey', ['id', 'name'])
+
+
+def get_api_key_config():
+    return {**DEFAULT_API_KEYS, **getattr(settings, 'PROCESS_MONITOR_API_KEYS', {})}
+
+
+def api_key_required():
+    return get_api_key_config()['REQUIRED']
+
+
+class APIKeyCache:
+    # Per-process cache of API key lookups. Active keys are kept for `ttl` seconds and
+    # rejected ones for `negative_ttl`, so an agent costs one key query per TTL instead
+    # of one per report. last_used is recorded in memory and written for all keys in
+    # one UPDATE every `flush_interval` seconds.
+    def __init__(self, ttl=60, negative_ttl=10, negative_max_size=10000, flush_interval=60):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+        self.flush_interval = flush_interval
+        self.active = {}
+        self.rejected = OrderedDict()
+        self.used = {}
+        self.last_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def lookup(self, key):
+        # The CachedKey of an active key, None for an unknown or inactive one
+        now = time.monotonic()
+        with self.lock:
+            cached = self.active.get(key)
+            if cached is not None and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+            rejected_until = self.rejected.get(key)
+            if rejected_until is not None and rejected_until > now:
+                self.hits += 1
+                return None
+            self.misses += 1
+        row = APIKey.objects.filter(key=key, is_active=True).values('id', 'name').first()
+        with self.lock:
+            if row is None:
+                self.active.pop(key, None)
+                self.rejected.pop(key, None)
+                self.rejected[key] = now + self.negative_ttl
+                while len(self.rejected) > self.negative_max_size:
+                    self.rejected.popitem(last=False)
+                return None
+            self.rejected.pop(key, None)
+            entry = CachedKey(row['id'], row['name'])
+            self.active[key] = (entry, now + self.ttl)
+            return entry
+
+    def touch(self, entry):
+        with self.lock:
+            self.used[entry.id] = timezone.now()
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush_last_used()
+
+    def flush_last_used(self):
+        # Writes the recorded last_used times in one UPDATE; another thread already
+        # flushing is left to it
+        if not self.flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self.lock:
+                used, self.used = self.used, {}
+                self.last_flush = time.monotonic()
+            if not used:
+                return 0
+            try:
+                return APIKey.objects.filter(id__in=used).update(last_used=Case(
+                    *[When(id=key_id, then=Value(last_used)) for key_id, last_used in used.items()],
+                    output_field=DateTimeField()
+                ))
+            except Exception:
+                logger.exception(f"Updating last_used of {len(used)} API keys failed")
+                with self.lock:
+                    for key_id, last_used in used.items():
+                        self.used.setdefault(key_id, last_used)
+                return 0
+        finally:
+            self.flush_lock.release()
+
+    def invalidate(self, key):
+        with self.lock:
+            self.active.pop(key, None)
+            self.rejected.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active': len(self.active),
+                'rejected': len(self.rejected),
+                'pending_last_used': len(self.used),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_api_key_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = get_api_key_config()
+            _cache = APIKeyCache(
+                config['CACHE_TTL'], config['NEGATIVE_TTL'], config['NEGATIVE_MAX_SIZE'], config['LAST_USED_FLUSH']
+            )
+            atexit.register(_cache.flush_last_used)
+        return _cache
+
+
+@receiver([post_save, post_delete], sender=APIKey)
+def _forget_api_key(sender, instance, **kwargs):
+    # Revocations made through this process (the admin) apply immediately; other
+    # processes pick them up when their cached entry expires
+    if _cache is not None:
+        _cache.invalidate(instance.key)
+
+
+def authenticate_api_key(key):
+    # The CachedKey for `key`, or None when no key was sent. An invalid key fails
+    # only when keys are required, so agents with a placeholder key keep reporting
+    # until enforcement is turned on.
+    if not key:
+        return None
+    cache = get_api_key_cache()
+    entry = cache.lookup(key)
+    if entry is None:
+        if api_key_required():
+            raise AuthenticationFailed('Invalid API key')
+        return None
+    cache.touch(entry)
+    return entry
+
+
+class APIKeyAuthentication(BaseAuthentication):
+    # Agents authenticate with the X-API-Key header; request.auth is the CachedKey
+    def authenticate(self, request):
+        entry = authenticate_api_key(request.META.get('HTTP_X_API_KEY'))
+        if entry is None:
+            return None
+        return AnonymousUser(), entry
+
+    def authenticate_header(self, request):
+        # Makes DRF answer 401 rather than 403
+        return API_KEY_HEADER
+
+
+class HasAPIKey(BasePermission):
+    # Requires a valid API key when PROCESS_MONITOR_API_KEYS['REQUIRED'] is set
+    def has_permission(self, request, view):
+        return not api_key_required() or isinstance(request.auth, CachedKey)
@@ -0,0 +1,150 @@
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Host, IngestActivity, Process, ProcessSnapshot, StatusCounter, SystemSnapshot
+
+DEFAULT_SHARDS = 8
+DEFAULT_RATE_WINDOW = 300
+DEFAULT_STALE_HOST_SECONDS = 300
+# IngestActivity rows older than this are pruned by retention
+ACTIVITY_RETENTION = timedelta(days=1)
+COUNTER_FIELDS = ('hosts', 'process_snapshots', 'system_snapshots', 'processes')
+# Exact sources of each counter, used by reconcile_counters()
+COUNTER_SOURCES = {
+    'hosts': Host,
+    'process_snapshots': ProcessSnapshot,
+    'system_snapshots': SystemSnapshot,
+    'processes': Process,
+}
+# Retention delete labels -> counter
+DELETED_LABELS = {model._meta.label: field for field, model in COUNTER_SOURCES.items()}
+
+
+def get_shard_count():
+    return max(1, getattr(settings, 'PROCESS_MONITOR_COUNTER_SHARDS', DEFAULT_SHARDS))
+
+
+def _increment(model, lookup, deltas, maxima=None):
+    # UPDATE ... SET field = field + delta (and field = GREATEST(field, value) for
+    # maxima) on one row, creating the row on first use
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    maxima = maxima or {}
+    if not deltas and not maxima:
+        return
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    changes.update({field: Greatest(F(field), value) for field, value in maxima.items()})
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas, **maxima)
+    except IntegrityError:
+        # Created concurrently since the UPDATE
+        model.objects.filter(**lookup).update(**changes)
+
+
+def record_ingest(snapshot_sizes, system_snapshots=0, hosts=0, now=None):
+    # Counts accepted reports inside the ingest transaction, so counters and data
+    # commit or roll back together. snapshot_sizes: (timestamp, process count) per snapshot.
+    if not snapshot_sizes and not system_snapshots and not hosts:
+        return
+    now = now or timezone.now()
+    shard = random.randrange(get_shard_count())
+    processes = sum(count for _, count in snapshot_sizes)
+    _increment(StatusCounter, {'shard': shard}, {
+        'hosts': hosts,
+        'process_snapshots': len(snapshot_sizes),
+        'system_snapshots': system_snapshots,
+        'processes': processes,
+    })
+    if not snapshot_sizes:
+        return
+    delays = [max(0.0, (now - timestamp).total_seconds()) for timestamp, _ in snapshot_sizes]
+    _increment(
+        IngestActivity,
+        {'bucket': now.replace(second=0, microsecond=0), 'shard': shard},
+        {'process_snapshots': len(snapshot_sizes), 'processes': processes, 'delay_seconds_total': sum(delays)},
+        maxima={'max_delay_seconds': max(delays)}
+    )
+
+
+def record_deletions(deleted):
+    # Subtracts rows removed by retention; `deleted` maps model labels to counts
+    deltas = {}
+    for label, count in deleted.items():
+        field = DELETED_LABELS.get(label)
+        if field:
+            deltas[field] = deltas.get(field, 0) - count
+    _increment(StatusCounter, {'shard': random.randrange(get_shard_count())}, deltas)
+
+
+def reconcile_counters(now=None):
+    # Corrects drift (admin deletes, crashes, counts predating the counters) with exact
+    # COUNT(*)s. No lock is held while counting, so reports ingested during the count
+    # may be off by the number that arrived meanwhile.
+    now = now or timezone.now()
+    corrections = {}
+    for field, model in COUNTER_SOURCES.items():
+        before = StatusCounter.objects.aggregate(total=Sum(field))['total'] or 0
+        corrections[field] = model.objects.count() - before
+    with transaction.atomic():
+        _increment(StatusCounter, {'shard': 0}, corrections)
+        StatusCounter.objects.update_or_create(shard=0, defaults={'reconciled_at': now})
+    return corrections
+
+
+def status_counters():
+    totals = StatusCounter.objects.aggregate(
+        **{field: Sum(field) for field in COUNTER_FIELDS},
+        reconciled_at=Max('reconciled_at')
+    )
+    for field in COUNTER_FIELDS:
+        totals[field] = max(0, totals[field] or 0)
+    return totals
+
+
+def ingest_rates(now=None, window=None):
+    # Reports and process rows ingested per second over the last `window` seconds,
+    # with the average and largest delay between report timestamp and ingestion
+    now = now or timezone.now()
+    window = window or getattr(settings, 'PROCESS_MONITOR_STATUS_RATE_WINDOW', DEFAULT_RATE_WINDOW)
+    # Whole minute buckets, so rates divide by the time those buckets actually cover
+    start = (now - timedelta(seconds=window)).replace(second=0, microsecond=0)
+    elapsed = max((now - start).total_seconds(), 1.0)
+    activity = IngestActivity.objects.filter(bucket__gte=start).aggregate(
+        snapshots=Sum('process_snapshots'),
+        processes=Sum('processes'),
+        delay=Sum('delay_seconds_total'),
+        max_delay=Max('max_delay_seconds')
+    )
+    snapshots = activity['snapshots'] or 0
+    return {
+        'window_seconds': window,
+        'snapshots_per_sec': round(snapshots / elapsed, 3),
+        'rows_per_sec': round((activity['processes'] or 0) / elapsed, 3),
+        'avg_delay_seconds': round(activity['delay'] / snapshots, 3) if snapshots else None,
+        'max_delay_seconds': round(activity['max_delay'], 3) if snapshots else None,
+    }
+
+
+def heartbeat_stats(now=None, stale_after=None):
+    # Oldest host heartbeat and how many hosts have been silent longer than stale_after
+    now = now or timezone.now()
+    stale_after = stale_after or getattr(settings, 'PROCESS_MONITOR_STALE_HOST_SECONDS', DEFAULT_STALE_HOST_SECONDS)
+    oldest = Host.objects.order_by('last_seen').values('hostname', 'last_seen').first()
+    return {
+        'oldest_hostname': oldest['hostname'] if oldest else None,
+        'oldest_last_seen': oldest['last_seen'].isoformat() if oldest else None,
+        'oldest_lag_seconds': round((now - oldest['last_seen']).total_seconds(), 3) if oldest else None,
+        'stale_after_seconds': stale_after,
+        'stale_hosts': Host.objects.filter(last_seen__lt=now - timedelta(seconds=stale_after)).count(),
+    }
+
+
+def prune_activity(now=None):
+    now = now or timezone.now()
+    return IngestActivity.objects.filter(bucket__lt=now - ACTIVITY_RETENTION).delete()[0]
@@ -0,0 +1,35 @@
+import re
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Django's SQLite backend with two extra OPTIONS:
+    # - 'pragmas': {name: value} applied to every new connection (journal_mode, synchronous, ...)
+    # - 'transaction_mode': how atomic blocks BEGIN. IMMEDIATE takes the write lock up front,
+    #   so concurrent writers queue on the busy timeout instead of failing with "database is
+    #   locked" when a transaction that started by reading tries to write.
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pragmas', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+                raise ImproperlyConfigured(f"Invalid SQLite pragma {name} = {value!r}")
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"'transaction_mode' must be one of {', '.join(TRANSACTION_MODES)}")
+        self.cursor().execute(f'BEGIN {mode}')
@@ -0,0 +1,637 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import (
+    EXTENDED_COUNT_FIELDS, EXTENDED_FIELDS, EXTENDED_RATE_FIELDS, INVENTORY_FIELDS, Host, HostInventory,
+    ProcessIdentity, ProcessSnapshot, Process, SystemSnapshot, partition_day, utc_today
+)
+from .counters import record_ingest
+
+DEFAULT_BATCH_SIZE = 500
+# Host columns every accepted report updates
+HOST_INGEST_FIELDS = [
+    'last_seen', 'last_sequence', 'baseline_process_snapshot', 'latest_process_snapshot', 'latest_system_snapshot',
+    'inventory'
+]
+# Fingerprints per lookup query, below SQLite's 999 bound parameters
+IDENTITY_LOOKUP_SIZE = 500
+REPORT_NOT_OBJECT = 'Report must be a JSON object'
+BASELINE_FIELDS = (
+    'pid', 'name', 'parent_pid', 'cpu_percent', 'memory_percent', 'memory_mb',
+    'status', 'username', 'command_line', 'created_time', *EXTENDED_FIELDS
+)
+
+
+class BaselineMismatch(Exception):
+    # A delta snapshot does not apply on top of what the backend last stored for the host
+    def __init__(self, host, baseline_sequence):
+        self.host = host
+        self.baseline_sequence = baseline_sequence
+        super().__init__(
+            f"Delta for {host.hostname} expects baseline {baseline_sequence}, "
+            f"last applied is {host.last_sequence}"
+        )
+
+
+def get_batch_size():
+    return getattr(settings, 'PROCESS_MONITOR_INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def _created_time(value):
+    # created_time as an aware datetime, whether it arrives as a string or from the database
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if isinstance(value, datetime) and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value if isinstance(value, datetime) else None
+
+
+def identity_fingerprint(proc_data, created_time):
+    key = (
+        proc_data.get('pid', 0),
+        created_time.timestamp() if created_time else None,
+        proc_data.get('name', 'Unknown'),
+        proc_data.get('username'),
+        proc_data.get('command_line', ''),
+    )
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+def build_identity(host_id, fingerprint, proc_data, created_time):
+    return ProcessIdentity(
+        host_id=host_id,
+        fingerprint=fingerprint,
+        pid=proc_data.get('pid', 0),
+        name=proc_data.get('name', 'Unknown'),
+        username=proc_data.get('username'),
+        command_line=proc_data.get('command_line', ''),
+        created_time=created_time
+    )
+
+
+def _lookup_identities(fingerprints_by_host, seen_on=None):
+    # With `seen_on`, identities last seen before it are marked seen before they are
+    # read: the UPDATE's row locks make retention wait for this transaction, then skip them
+    found = {}
+    for host_id, fingerprints in fingerprints_by_host.items():
+        fingerprints = list(fingerprints)
+        for start in range(0, len(fingerprints), IDENTITY_LOOKUP_SIZE):
+            identities = ProcessIdentity.objects.filter(
+                host_id=host_id, fingerprint__in=fingerprints[start:start + IDENTITY_LOOKUP_SIZE]
+            )
+            if seen_on is not None:
+                identities.filter(last_seen__lt=seen_on).update(last_seen=seen_on)
+            rows = identities.values_list('fingerprint', 'id')
+            found.update(((host_id, fingerprint), identity_id) for fingerprint, identity_id in rows)
+    return found
+
+
+def resolve_identities(host_processes, batch_size=None):
+    # (host_id, proc_data) pairs -> ProcessIdentity id per pair. Existing identities are
+    # looked up by fingerprint and the missing ones created in bulk, so a long-lived
+    # process costs no new identity row however many snapshots it appears in.
+    keys = []
+    wanted = {}
+    for host_id, proc_data in host_processes:
+        created_time = _created_time(proc_data.get('created_time'))
+        key = (host_id, identity_fingerprint(proc_data, created_time))
+        keys.append(key)
+        wanted.setdefault(key, (proc_data, created_time))
+    by_host = {}
+    for host_id, fingerprint in wanted:
+        by_host.setdefault(host_id, set()).add(fingerprint)
+    identity_ids = _lookup_identities(by_host, seen_on=utc_today())
+    missing = [key for key in wanted if key not in identity_ids]
+    if missing:
+        ProcessIdentity.objects.bulk_create(
+            [build_identity(host_id, fingerprint, *wanted[(host_id, fingerprint)]) for host_id, fingerprint in missing],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+        by_host = {}
+        for host_id, fingerprint in missing:
+            by_host.setdefault(host_id, set()).add(fingerprint)
+        identity_ids.update(_lookup_identities(by_host))
+    return [identity_ids[key] for key in keys], len(missing)
+
+
+class ProcessIngestor:
+    # Builds Process rows in memory and writes them with chunked bulk INSERTs
+    def __init__(self, batch_size=None):
+        self.batch_size = max(1, int(batch_size or get_batch_size()))
+
+    def build_rows(self, snapshot, processes_data, identity_ids):
+        day = partition_day(snapshot.timestamp)
+        return [
+            Process(
+                info=snapshot,
+                identity_id=identity_id,
+                day=day,
+                pid=proc_data.get('pid', 0),
+                parent_pid=proc_data.get('parent_pid'),
+                cpu_percent=proc_data.get('cpu_percent', 0.0),
+                memory_percent=proc_data.get('memory_percent', 0.0),
+                memory_mb=proc_data.get('memory_mb', 0.0),
+                status=proc_data.get('status', 'running'),
+                **{field: proc_data.get(field) for field in EXTENDED_FIELDS}
+            )
+            for proc_data, identity_id in zip(processes_data, identity_ids)
+        ]
+
+    def write(self, rows):
+        batches = []
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            started = time.perf_counter()
+            Process.objects.bulk_create(chunk)
+            batches.append(_elapsed_ms(started))
+        return batches
+
+    def ingest(self, snapshot, processes_data):
+        return self.ingest_many([(snapshot, processes_data)])
+
+    def ingest_many(self, snapshot_processes):
+        # Writes the processes of several (snapshot, processes_data) pairs in shared chunks
+        snapshot_processes = list(snapshot_processes)
+        started = time.perf_counter()
+        identity_ids, identities_created = resolve_identities(
+            ((snapshot.host_id, proc_data) for snapshot, processes_data in snapshot_processes
+             for proc_data in processes_data),
+            self.batch_size
+        )
+        identity_ms = _elapsed_ms(started)
+        started = time.perf_counter()
+        rows = []
+        offset = 0
+        for snapshot, processes_data in snapshot_processes:
+            count = len(processes_data)
+            rows.extend(self.build_rows(snapshot, processes_data, identity_ids[offset:offset + count]))
+            offset += count
+        build_ms = _elapsed_ms(started)
+        batches = self.write(rows)
+        return {
+            'rows': len(rows),
+            'batch_size': self.batch_size,
+            'batches': len(batches),
+            'identities_created': identities_created,
+            'identity_ms': identity_ms,
+            'build_ms': build_ms,
+            'insert_ms': round(sum(batches), 3),
+            'max_batch_ms': max(batches) if batches else 0.0,
+        }
+
+
+def build_system_snapshot(host, timestamp, system_info):
+    return SystemSnapshot(
+        host=host,
+        timestamp=timestamp,
+        cpu_percent=system_info.get('cpu_percent'),
+        ram_total_gb=system_info.get('ram_total_gb', 0.0),
+        ram_used_gb=system_info.get('ram_used_gb', 0.0),
+        ram_available_gb=system_info.get('ram_available_gb', 0.0),
+        storage_total_gb=system_info.get('storage_total_gb', 0.0),
+        storage_used_gb=system_info.get('storage_used_gb', 0.0),
+        storage_free_gb=system_info.get('storage_free_gb', 0.0)
+    )
+
+
+def report_system_readings(report, timestamp):
+    # (timestamp, figures) of every system reading in a report: the `system_samples`
+    # the agent took since its previous report, each with its own timestamp, then
+    # `system_info` at the report timestamp
+    samples = report.get('system_samples', [])
+    if not isinstance(samples, list):
+        raise ValueError("'system_samples' must be a list")
+    readings = []
+    for sample in samples:
+        if not isinstance(sample, dict):
+            raise ValueError('Every system sample must be an object')
+        readings.append((_parse_timestamp(sample.get('timestamp'), 'system sample timestamp'), sample))
+    system_info = report.get('system_info')
+    if system_info is not None:
+        if not isinstance(system_info, dict):
+            raise ValueError("'system_info' must be an object")
+        readings.append((timestamp, system_info))
+    return readings
+
+
+def report_omitted(report):
+    # ProcessSnapshot totals of the processes the agent summarized instead of sending
+    omitted = report.get('omitted_processes')
+    if omitted is None:
+        return {}
+    if not isinstance(omitted, dict):
+        raise ValueError("'omitted_processes' must be an object")
+    try:
+        return {
+            'omitted_count': int(omitted.get('count', 0)),
+            'omitted_cpu_percent': float(omitted.get('cpu_percent', 0.0)),
+            'omitted_memory_mb': float(omitted.get('memory_mb', 0.0)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid omitted_processes: {omitted!r}")
+
+
+def _optional_int(value, field):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}: {value!r}")
+
+
+def _optional_float(value, field):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}: {value!r}")
+
+
+def report_inventory(report):
+    # The static inventory of a report: its 'inventory' object or, from agents that
+    # predate it, the same fields inside system_info. None when it carries neither.
+    inventory = report.get('inventory')
+    if inventory is None:
+        inventory = report.get('system_info')
+        if not isinstance(inventory, dict) or not any(field in inventory for field in INVENTORY_FIELDS):
+            return None
+    elif not isinstance(inventory, dict):
+        raise ValueError("'inventory' must be an object")
+    return {
+        'operating_system': str(inventory.get('operating_system', 'Unknown'))[:255],
+        'processor': str(inventory.get('processor', 'Unknown'))[:255],
+        'processor_cores': _optional_int(inventory.get('processor_cores'), 'processor_cores'),
+        'processor_threads': _optional_int(inventory.get('processor_threads'), 'processor_threads'),
+    }
+
+
+def inventory_fingerprint(inventory):
+    # Must match the agent's fingerprint of the inventory it sends
+    canonical = json.dumps({field: inventory[field] for field in INVENTORY_FIELDS}, sort_keys=True)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def apply_inventory(host, inventory, timestamp):
+    # Points the host at `inventory`, adding a HostInventory row only when it differs
+    # from the current one. Late (spooled) reports do not move the pointer back.
+    fingerprint = inventory_fingerprint(inventory)
+    current = host.inventory
+    if current is not None and (current.fingerprint == fingerprint or timestamp < current.recorded_at):
+        return
+    host.inventory = HostInventory.objects.create(
+        host=host, fingerprint=fingerprint, recorded_at=timestamp, **inventory
+    )
+
+
+def inventory_required(host, report):
+    # True when the report names an inventory fingerprint the backend does not hold,
+    # so the agent should send its inventory again
+    fingerprint = report.get('inventory_fingerprint')
+    return fingerprint is not None and (host.inventory is None or host.inventory.fingerprint != fingerprint)
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else []
+
+
+def load_baseline(host):
+    # Process list of the snapshot holding the host's last_sequence, or None when it has none
+    if host.baseline_process_snapshot is None:
+        return None
+    return list(Process.objects.in_snapshot(host.baseline_process_snapshot).identity_values(*BASELINE_FIELDS))
+
+
+def expand_delta(host, data, baseline=None):
+    # Rebuilds the full process list from the host's baseline snapshot (or the given
+    # baseline) plus the removed/changed/added entries. Entries are matched by pid,
+    # which is unique within a snapshot; pid reuse arrives as a removal plus an addition.
+    baseline_sequence = data.get('baseline_sequence')
+    if baseline_sequence is None or host.last_sequence != baseline_sequence:
+        raise BaselineMismatch(host, baseline_sequence)
+    if baseline is None:
+        baseline = load_baseline(host)
+    if baseline is None:
+        raise BaselineMismatch(host, baseline_sequence)
+    processes = {row['pid']: row for row in baseline}
+    for removed in _as_list(data.get('removed')):
+        pid = removed.get('pid') if isinstance(removed, dict) else removed
+        processes.pop(pid, None)
+    for proc_data in _as_list(data.get('changed')) + _as_list(data.get('added')):
+        if not isinstance(proc_data, dict) or 'pid' not in proc_data:
+            raise ValueError('Every process needs a pid')
+        processes[proc_data['pid']] = proc_data
+    return list(processes.values())
+
+
+def report_processes(host, report, baseline=None):
+    # The report's full process list, normalized by clean_process(); delta reports are
+    # expanded against the host's baseline first
+    if report.get('mode') == 'delta':
+        processes = expand_delta(host, report, baseline)
+    else:
+        processes = report.get('processes', [])
+        if not isinstance(processes, list):
+            raise ValueError("'processes' must be a list")
+    return [clean_process(proc) for proc in processes]
+
+
+def newest(current, snapshot):
+    # The snapshot a latest-pointer should reference; late (spooled) reports do not move it back
+    if current is None or snapshot.timestamp >= current.timestamp:
+        return snapshot
+    return current
+
+
+def _locked_hosts():
+    # Host rows locked for the ingest transaction so concurrent reports update the
+    # latest-snapshot pointers one after the other
+    return Host.objects.select_for_update(of=('self',)).select_related(
+        'baseline_process_snapshot', 'latest_process_snapshot', 'latest_system_snapshot', 'inventory'
+    )
+
+
+def ingest_payload(data, batch_size=None):
+    # Saves one agent payload (host, system info, process list) in a single transaction.
+    # Raises ValueError, and writes nothing, when the payload is malformed.
+    started = time.perf_counter()
+    timings = {}
+    if not isinstance(data, dict):
+        raise ValueError(REPORT_NOT_OBJECT)
+    hostname = _report_hostname(data, 'Unknown')
+    if hostname is None:
+        raise ValueError('Missing or invalid hostname')
+    with transaction.atomic():
+        step = time.perf_counter()
+        timestamp = _parse_timestamp(data.get('timestamp', timezone.now()), 'timestamp')
+        host, created = _locked_hosts().get_or_create(hostname=hostname)
+        host.last_seen = timezone.now()
+        processes_data = report_processes(host, data)
+        host.last_sequence = data.get('sequence')
+        inventory = report_inventory(data)
+        if inventory is not None:
+            apply_inventory(host, inventory, timestamp)
+        timings['host_ms'] = _elapsed_ms(step)
+        readings = report_system_readings(data, timestamp)
+        if readings:
+            step = time.perf_counter()
+            system_snapshots = _create_snapshots(SystemSnapshot, [
+                build_system_snapshot(host, reading_time, figures) for reading_time, figures in readings
+            ])
+            for system_snapshot in system_snapshots:
+                host.latest_system_snapshot = newest(host.latest_system_snapshot, system_snapshot)
+            timings['system_ms'] = _elapsed_ms(step)
+        step = time.perf_counter()
+        snapshot = ProcessSnapshot.objects.create(host=host, timestamp=timestamp, **report_omitted(data))
+        host.baseline_process_snapshot = snapshot
+        host.latest_process_snapshot = newest(host.latest_process_snapshot, snapshot)
+        timings['snapshot_ms'] = _elapsed_ms(step)
+        timings['processes'] = ProcessIngestor(batch_size).ingest(snapshot, processes_data)
+        host.save(update_fields=HOST_INGEST_FIELDS)
+        step = time.perf_counter()
+        record_ingest([(timestamp, len(processes_data))], system_snapshots=len(readings), hosts=int(created))
+        timings['counters_ms'] = _elapsed_ms(step)
+    timings['total_ms'] = _elapsed_ms(started)
+    return {
+        'host': host,
+        'snapshot': snapshot,
+        'processes_count': len(processes_data),
+        'sequence': host.last_sequence,
+        'inventory_required': inventory_required(host, data),
+        'timings': timings,
+    }
+
+
+def _parse_timestamp(value, field):
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid {field}: {value!r}")
+    else:
+        raise ValueError(f"Invalid {field}: {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def clean_process(proc_data):
+    # Normalizes one process entry so a bad value is rejected before the bulk INSERT
+    if not isinstance(proc_data, dict) or 'pid' not in proc_data:
+        raise ValueError('Every process needs a pid')
+    try:
+        created_time = proc_data.get('created_time')
+        username = proc_data.get('username')
+        return {
+            'pid': int(proc_data['pid']),
+            'name': str(proc_data.get('name', 'Unknown'))[:255],
+            'parent_pid': int(proc_data['parent_pid']) if proc_data.get('parent_pid') is not None else None,
+            'cpu_percent': float(proc_data.get('cpu_percent', 0.0)),
+            'memory_percent': float(proc_data.get('memory_percent', 0.0)),
+            'memory_mb': float(proc_data.get('memory_mb', 0.0)),
+            'status': str(proc_data.get('status', 'running'))[:50],
+            'username': str(username)[:255] if username is not None else None,
+            'command_line': proc_data.get('command_line', ''),
+            'created_time': _parse_timestamp(created_time, 'created_time') if created_time else None,
+            **{field: _optional_int(proc_data.get(field), field) for field in EXTENDED_COUNT_FIELDS},
+            **{field: _optional_float(proc_data.get(field), field) for field in EXTENDED_RATE_FIELDS}
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid process {proc_data.get('pid')}: {e}")
+
+
+def resolve_hosts(hostnames):
+    # (hostname -> locked Host for every name, number of hosts created), creating the
+    # missing ones in bulk
+    hosts = {host.hostname: host for host in _locked_hosts().filter(hostname__in=hostnames).order_by('id')}
+    missing = set(hostnames) - hosts.keys()
+    if missing:
+        Host.objects.bulk_create([Host(hostname=name) for name in missing], ignore_conflicts=True)
+        hosts.update({host.hostname: host for host in _locked_hosts().filter(hostname__in=missing).order_by('id')})
+    return hosts, len(missing)
+
+
+def _create_snapshots(model, snapshots):
+    # Bulk INSERT that still sets primary keys, which the latest-snapshot pointers need
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(snapshots)
+    for snapshot in snapshots:
+        snapshot.save()
+    return snapshots
+
+
+def _report_hostname(report, default=None):
+    if not isinstance(report, dict):
+        return None
+    hostname = report.get('hostname', default)
+    if not isinstance(hostname, str) or not hostname or len(hostname) > 255:
+        return None
+    return hostname
+
+
+def validate_report(report):
+    # Checks a full (non-delta) report up front, for callers that answer before it is
+    # written. Returns it with normalized processes and the arrival time as the default
+    # timestamp; raises ValueError like ingest_batch() would.
+    if not isinstance(report, dict):
+        raise ValueError(REPORT_NOT_OBJECT)
+    hostname = _report_hostname(report)
+    if hostname is None:
+        raise ValueError('Missing or invalid hostname')
+    if report.get('mode') == 'delta':
+        raise ValueError('Delta reports must be sent to /api/submit/')
+    timestamp = _parse_timestamp(report.get('timestamp', timezone.now()), 'timestamp')
+    processes = report_processes(None, report)
+    report_system_readings(report, timestamp)
+    report_omitted(report)
+    return {
+        **report,
+        'timestamp': timestamp,
+        'inventory': report_inventory(report),
+        'processes': processes
+    }
+
+
+def ingest_batch(reports, batch_size=None):
+    # Saves many agent payloads, from one or many hosts, in a single transaction:
+    # one query to resolve hosts and bulk INSERTs for every table. Reports are
+    # validated up front, so a bad one is reported without aborting the rest, and
+    # a new host is created only when at least one of its reports is accepted.
+    # Returns one result per report, in order, plus the batch timings.
+    started = time.perf_counter()
+    timings = {}
+    results = [None] * len(reports)
+    with transaction.atomic():
+        step = time.perf_counter()
+        hostnames = {name for name in map(_report_hostname, reports) if name}
+        hosts = {
+            host.hostname: host for host in _locked_hosts().filter(hostname__in=hostnames).order_by('id')
+        } if hostnames else {}
+        timings['hosts_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        now = timezone.now()
+        accepted = []
+        baselines = {}
+        for index, report in enumerate(reports):
+            if not isinstance(report, dict):
+                results[index] = {'status': 400, 'error': REPORT_NOT_OBJECT}
+                continue
+            hostname = _report_hostname(report)
+            if hostname is None:
+                results[index] = {'status': 400, 'error': 'Missing or invalid hostname'}
+                continue
+            host = hosts.get(hostname)
+            if host is None:
+                # Saved below, only once one of its reports is accepted
+                host = hosts[hostname] = Host(hostname=hostname)
+            try:
+                timestamp = _parse_timestamp(report.get('timestamp', now), 'timestamp')
+                processes = report_processes(host, report, baselines.get(hostname))
+                readings = report_system_readings(report, timestamp)
+                omitted = report_omitted(report)
+                inventory = report_inventory(report)
+            except BaselineMismatch:
+                results[index] = {
+                    'status': 409,
+                    'error': 'Delta baseline mismatch',
+                    'resend_baseline': True,
+                    'last_sequence': host.last_sequence
+                }
+                continue
+            except ValueError as e:
+                results[index] = {'status': 400, 'error': str(e)}
+                continue
+            host.last_seen = now
+            host.last_sequence = report.get('sequence')
+            baselines[hostname] = processes
+            accepted.append({
+                'index': index,
+                'host': host,
+                'timestamp': timestamp,
+                'system_readings': readings,
+                'inventory': inventory,
+                'omitted': omitted,
+                'processes': processes,
+                'sequence': host.last_sequence
+            })
+        timings['prepare_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        new_hostnames = {item['host'].hostname for item in accepted if item['host'].pk is None}
+        hosts_created = 0
+        if new_hostnames:
+            created, hosts_created = resolve_hosts(new_hostnames)
+            for hostname, host in created.items():
+                host.last_seen = now
+                host.last_sequence = hosts[hostname].last_sequence
+                hosts[hostname] = host
+            for item in accepted:
+                item['host'] = hosts[item['host'].hostname]
+        for item in accepted:
+            if item['inventory'] is not None:
+                apply_inventory(item['host'], item['inventory'], item['timestamp'])
+        timings['new_hosts_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        system_snapshots = _create_snapshots(SystemSnapshot, [
+            build_system_snapshot(item['host'], reading_time, figures)
+            for item in accepted
+            for reading_time, figures in item['system_readings']
+        ])
+        snapshots = _create_snapshots(ProcessSnapshot, [
+            ProcessSnapshot(host=item['host'], timestamp=item['timestamp'], **item['omitted'])
+            for item in accepted
+        ])
+        for system_snapshot in system_snapshots:
+            host = system_snapshot.host
+            host.latest_system_snapshot = newest(host.latest_system_snapshot, system_snapshot)
+        for snapshot in snapshots:
+            # In report order, so the host's last accepted report becomes its delta baseline
+            host = snapshot.host
+            host.baseline_process_snapshot = snapshot
+            host.latest_process_snapshot = newest(host.latest_process_snapshot, snapshot)
+        timings['snapshots_ms'] = _elapsed_ms(step)
+
+        timings['processes'] = ProcessIngestor(batch_size).ingest_many(
+            (snapshot, item['processes']) for snapshot, item in zip(snapshots, accepted)
+        )
+
+        step = time.perf_counter()
+        touched = {item['host'].id: item['host'] for item in accepted}
+        Host.objects.bulk_update(list(touched.values()), HOST_INGEST_FIELDS)
+        timings['hosts_update_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        record_ingest(
+            [(item['timestamp'], len(item['processes'])) for item in accepted],
+            system_snapshots=len(system_snapshots),
+            hosts=hosts_created,
+            now=now
+        )
+        timings['counters_ms'] = _elapsed_ms(step)
+
+    for snapshot, item in zip(snapshots, accepted):
+        results[item['index']] = {
+            'status': 200,
+            'host_id': item['host'].id,
+            'hostname': item['host'].hostname,
+            'snapshot_id': snapshot.id,
+            'processes_count': len(item['processes']),
+            'sequence': item['sequence'],
+            'inventory_required': inventory_required(item['host'], reports[item['index']])
+        }
+    timings['total_ms'] = _elapsed_ms(started)
+    return results, timings
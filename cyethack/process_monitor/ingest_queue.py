@@ -0,0 +1,181 @@
+import atexit
+import logging
+import math
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from django.conf import settings
+from django.db import close_old_connections
+from .ingest import ingest_batch
+from .response_cache import get_response_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE = {
+    'WORKERS': 2,
+    'MAX_SIZE': 1000,
+    'BATCH_SIZE': 20,
+}
+# Writes kept for the latency metrics
+LATENCY_SAMPLES = 500
+# Attempts per batch before its reports are dropped (database errors are usually transient)
+WRITE_ATTEMPTS = 3
+MAX_RETRY_AFTER = 60
+
+
+class IngestQueue:
+    # Write-behind ingestion: accepted reports wait in bounded in-memory queues and
+    # writer threads save them with ingest_batch(), several reports per transaction.
+    # Reports of a host always go to the same writer, so they are written in the order
+    # they arrived. Queued reports live in this process only and are lost if it is killed.
+    def __init__(self, workers=2, max_size=1000, batch_size=20):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        per_worker = max(1, math.ceil(max_size / self.workers))
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self.stopping = threading.Event()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        # (reports, write ms, longest wait in the queue ms) per write
+        self.writes = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        for index, reports in enumerate(self.queues):
+            thread = threading.Thread(target=self._run, args=(reports,), name=f'ingest-writer-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=10):
+        # Writers save what is already queued before they exit
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def submit(self, report):
+        # Queues a validated report; False when its writer's queue is full
+        reports = self.queues[zlib.crc32(report['hostname'].encode()) % self.workers]
+        try:
+            reports.put_nowait((time.monotonic(), report))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.enqueued += 1
+        return True
+
+    def depth(self):
+        return sum(reports.qsize() for reports in self.queues)
+
+    def retry_after(self):
+        # Seconds until the backlog should have drained at the recent write speed
+        with self.lock:
+            writes = list(self.writes)
+        reports = sum(count for count, _, _ in writes)
+        ms_per_report = sum(ms for _, ms, _ in writes) / reports if reports else 1000.0
+        seconds = math.ceil(self.depth() / self.workers * ms_per_report / 1000)
+        return min(MAX_RETRY_AFTER, max(1, seconds))
+
+    def _take(self, reports):
+        batch = [reports.get(timeout=0.5)]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(reports.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, reports):
+        while not (self.stopping.is_set() and reports.empty()):
+            try:
+                batch = self._take(reports)
+            except queue.Empty:
+                continue
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.monotonic()
+        results = None
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                results, _ = ingest_batch([report for _, report in batch])
+                break
+            except Exception:
+                logger.exception(f"Writing {len(batch)} queued reports failed (attempt {attempt})")
+                if attempt < WRITE_ATTEMPTS:
+                    self.stopping.wait(attempt)
+            finally:
+                close_old_connections()
+        finished = time.monotonic()
+        results = results or [{'status': 500, 'error': 'Write failed'}] * len(batch)
+        cache = get_response_cache()
+        for host_id in {result['host_id'] for result in results if result['status'] == 200}:
+            cache.invalidate_host(host_id)
+        failed = 0
+        for (_, report), result in zip(batch, results):
+            if result['status'] != 200:
+                failed += 1
+                logger.warning(f"Dropped queued report from {report['hostname']}: {result.get('error')}")
+        with self.lock:
+            self.written += len(batch) - failed
+            self.failed += failed
+            self.writes.append((
+                len(batch),
+                (finished - started) * 1000,
+                (finished - min(queued_at for queued_at, _ in batch)) * 1000
+            ))
+
+    def metrics(self):
+        with self.lock:
+            writes = list(self.writes)
+            totals = {
+                'enqueued': self.enqueued,
+                'rejected': self.rejected,
+                'written': self.written,
+                'failed': self.failed,
+            }
+        write_ms = sorted(ms for _, ms, _ in writes)
+        return {
+            'workers': self.workers,
+            'depth': self.depth(),
+            'capacity': sum(reports.maxsize for reports in self.queues),
+            **totals,
+            'recent_writes': len(writes),
+            'avg_reports_per_write': round(sum(count for count, _, _ in writes) / len(writes), 2) if writes else None,
+            'avg_write_ms': round(sum(write_ms) / len(write_ms), 3) if writes else None,
+            'p95_write_ms': round(write_ms[int(len(write_ms) * 0.95)], 3) if writes else None,
+            'max_write_ms': round(write_ms[-1], 3) if writes else None,
+            'max_queued_ms': round(max(wait for _, _, wait in writes), 3) if writes else None,
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue_config():
+    return {**DEFAULT_QUEUE, **getattr(settings, 'PROCESS_MONITOR_INGEST_QUEUE', {})}
+
+
+def get_ingest_queue():
+    # The process-wide queue, with its writers started on first use
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            config = get_queue_config()
+            _queue = IngestQueue(config['WORKERS'], config['MAX_SIZE'], config['BATCH_SIZE'])
+            _queue.start()
+            atexit.register(_queue.stop)
+        return _queue
+
+
+def ingest_queue_metrics():
+    # Metrics of the running queue, or None before anything was queued in this process
+    return _queue.metrics() if _queue is not None else None
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from process_monitor.retention import get_batch_size, run_retention
+
+
+class Command(BaseCommand):
+    help = 'Roll up raw snapshots into hourly/daily aggregates and delete expired data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=get_batch_size(),
+            help='Snapshots deleted per transaction'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Stop after this many delete batches per table (default: no limit)'
+        )
+        parser.add_argument(
+            '--skip-rollup',
+            action='store_true',
+            help='Only delete expired data, do not build rollups'
+        )
+
+    def handle(self, *args, **options):
+        stats = run_retention(
+            batch_size=options['batch_size'],
+            rollup=not options['skip_rollup'],
+            max_batches=options['max_batches']
+        )
+        self.stdout.write(f"Hourly rollups written: {stats['hourly_rollups']}")
+        self.stdout.write(f"Daily rollups written: {stats['daily_rollups']}")
+        for label, count in sorted(stats['deleted'].items()):
+            self.stdout.write(f"Deleted {label}: {count}")
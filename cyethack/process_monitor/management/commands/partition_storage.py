@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from process_monitor.partitions import (
+    PARTITION_KEYS, PartitioningUnsupported, convert_to_partitions, ensure_partitions, list_partitions,
+    partitioning_enabled
+)
+
+
+class Command(BaseCommand):
+    help = 'Store snapshots in daily partitions (PostgreSQL) and create the upcoming partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='Convert the snapshot and process tables to partitioned tables (locks them while copying)'
+        )
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            try:
+                converted = convert_to_partitions()
+            except PartitioningUnsupported as e:
+                raise CommandError(str(e))
+            for table in converted:
+                self.stdout.write(f"Converted {table}")
+        elif not partitioning_enabled():
+            raise CommandError('Tables are not partitioned, run with --convert first (PostgreSQL only)')
+        for name in ensure_partitions():
+            self.stdout.write(f"Created {name}")
+        for model, _ in PARTITION_KEYS:
+            partitions = list_partitions(model)
+            self.stdout.write(f"{model._meta.db_table}: {len(partitions)} partitions")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from process_monitor.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Correct the /api/status counters with exact row counts'
+
+    def handle(self, *args, **options):
+        corrections = reconcile_counters()
+        for field, correction in corrections.items():
+            self.stdout.write(f"{field}: {correction:+d}")
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='last_sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='baseline_process_snapshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='process_monitor.processsnapshot'),
+        ),
+    ]
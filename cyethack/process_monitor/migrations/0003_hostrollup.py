@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0002_host_last_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=10)),
+                ('bucket', models.DateTimeField()),
+                ('snapshot_count', models.IntegerField(default=0)),
+                ('avg_process_count', models.FloatField(default=0.0)),
+                ('max_process_count', models.IntegerField(default=0)),
+                ('avg_cpu_percent', models.FloatField(default=0.0)),
+                ('max_cpu_percent', models.FloatField(default=0.0)),
+                ('avg_memory_mb', models.FloatField(default=0.0)),
+                ('max_memory_mb', models.FloatField(default=0.0)),
+                ('system_count', models.IntegerField(default=0)),
+                ('avg_ram_used_gb', models.FloatField(blank=True, null=True)),
+                ('max_ram_used_gb', models.FloatField(blank=True, null=True)),
+                ('avg_storage_used_gb', models.FloatField(blank=True, null=True)),
+                ('max_storage_used_gb', models.FloatField(blank=True, null=True)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='process_monitor.host')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hostrollup',
+            constraint=models.UniqueConstraint(fields=('host', 'resolution', 'bucket'), name='unique_host_rollup_bucket'),
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:10
+
+import hashlib
+from django.db import migrations, models
+import django.db.models.deletion
+import process_monitor.models
+
+BATCH_SIZE = 2000
+
+
+def fingerprint(row):
+    # Same key as process_monitor.ingest.identity_fingerprint
+    created_time = row['created_time']
+    key = (
+        row['pid'],
+        created_time.timestamp() if created_time else None,
+        row['name'],
+        row['username'],
+        row['command_line'],
+    )
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+def intern_identities(apps, schema_editor):
+    Process = apps.get_model('process_monitor', 'Process')
+    ProcessIdentity = apps.get_model('process_monitor', 'ProcessIdentity')
+    identity_ids = {}
+    last_id = 0
+    while True:
+        rows = list(
+            Process.objects.filter(id__gt=last_id).order_by('id')
+            .values('id', 'info__host_id', 'pid', 'name', 'username', 'command_line', 'created_time')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        keys = [(row['info__host_id'], fingerprint(row)) for row in rows]
+        new = {}
+        for key, row in zip(keys, rows):
+            if key not in identity_ids and key not in new:
+                new[key] = ProcessIdentity(
+                    host_id=key[0], fingerprint=key[1], pid=row['pid'], name=row['name'],
+                    username=row['username'], command_line=row['command_line'], created_time=row['created_time']
+                )
+        for key, identity in zip(new, ProcessIdentity.objects.bulk_create(new.values())):
+            identity_ids[key] = identity.pk
+        if any(identity_id is None for identity_id in identity_ids.values()):
+            # Backends that cannot return ids from bulk inserts
+            for identity in ProcessIdentity.objects.filter(fingerprint__in=[key[1] for key in new]):
+                identity_ids[(identity.host_id, identity.fingerprint)] = identity.pk
+        processes = [Process(id=row['id'], identity_id=identity_ids[key]) for key, row in zip(keys, rows)]
+        Process.objects.bulk_update(processes, ['identity'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0003_hostrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessIdentity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('pid', models.IntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('username', models.CharField(blank=True, max_length=255, null=True)),
+                ('command_line', models.TextField(blank=True, null=True)),
+                ('created_time', models.DateTimeField(blank=True, null=True)),
+                ('last_seen', models.DateField(default=process_monitor.models.utc_today)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='process_identities', to='process_monitor.host')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='processidentity',
+            constraint=models.UniqueConstraint(fields=('host', 'fingerprint'), name='unique_process_identity'),
+        ),
+        migrations.AddIndex(
+            model_name='processidentity',
+            index=models.Index(fields=['last_seen'], name='process_mon_last_se_4bf548_idx'),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='identity',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='process_monitor.processidentity'),
+        ),
+        migrations.RunPython(intern_identities, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='process',
+            name='identity',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='samples', to='process_monitor.processidentity'),
+        ),
+        migrations.RemoveField(
+            model_name='process',
+            name='command_line',
+        ),
+        migrations.RemoveField(
+            model_name='process',
+            name='created_time',
+        ),
+        migrations.RemoveField(
+            model_name='process',
+            name='name',
+        ),
+        migrations.RemoveField(
+            model_name='process',
+            name='username',
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_latest_snapshots(apps, schema_editor):
+    Host = apps.get_model('process_monitor', 'Host')
+    ProcessSnapshot = apps.get_model('process_monitor', 'ProcessSnapshot')
+    SystemSnapshot = apps.get_model('process_monitor', 'SystemSnapshot')
+    Host.objects.update(
+        latest_process_snapshot=models.Subquery(
+            ProcessSnapshot.objects.filter(host=models.OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+        ),
+        latest_system_snapshot=models.Subquery(
+            SystemSnapshot.objects.filter(host=models.OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0004_processidentity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='latest_process_snapshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='process_monitor.processsnapshot'),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='latest_system_snapshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='process_monitor.systemsnapshot'),
+        ),
+        migrations.AddIndex(
+            model_name='processsnapshot',
+            index=models.Index(fields=['host', '-timestamp'], name='process_mon_host_id_f76a9d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processsnapshot',
+            index=models.Index(fields=['timestamp'], name='process_mon_timesta_5bdb64_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemsnapshot',
+            index=models.Index(fields=['host', '-timestamp'], name='process_mon_host_id_29fac0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemsnapshot',
+            index=models.Index(fields=['timestamp'], name='process_mon_timesta_71387f_idx'),
+        ),
+        migrations.RunPython(backfill_latest_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:18
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def initialize_counters(apps, schema_editor):
+    # Start the counters from exact counts of the existing data
+    StatusCounter = apps.get_model('process_monitor', 'StatusCounter')
+    StatusCounter.objects.create(
+        shard=0,
+        hosts=apps.get_model('process_monitor', 'Host').objects.count(),
+        process_snapshots=apps.get_model('process_monitor', 'ProcessSnapshot').objects.count(),
+        system_snapshots=apps.get_model('process_monitor', 'SystemSnapshot').objects.count(),
+        processes=apps.get_model('process_monitor', 'Process').objects.count(),
+        reconciled_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0005_host_latest_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('shard', models.SmallIntegerField(default=0)),
+                ('process_snapshots', models.BigIntegerField(default=0)),
+                ('processes', models.BigIntegerField(default=0)),
+                ('delay_seconds_total', models.FloatField(default=0.0)),
+                ('max_delay_seconds', models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.SmallIntegerField(unique=True)),
+                ('hosts', models.BigIntegerField(default=0)),
+                ('process_snapshots', models.BigIntegerField(default=0)),
+                ('system_snapshots', models.BigIntegerField(default=0)),
+                ('processes', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['last_seen'], name='process_mon_last_se_0b04f5_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingestactivity',
+            constraint=models.UniqueConstraint(fields=('bucket', 'shard'), name='unique_ingest_activity_bucket'),
+        ),
+        migrations.RunPython(initialize_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0006_status_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='processidentity',
+            index=models.Index(fields=['host', 'name'], name='process_mon_host_id_c04f8e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processidentity',
+            index=models.Index(fields=['host', 'pid', 'created_time'], name='process_mon_host_id_6d83d8_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:40
+
+from datetime import datetime, timedelta, timezone
+from django.db import migrations, models
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def fill_days(apps, schema_editor):
+    # One UPDATE per day of snapshots, setting the same value as models.partition_day()
+    ProcessSnapshot = apps.get_model('process_monitor', 'ProcessSnapshot')
+    Process = apps.get_model('process_monitor', 'Process')
+    for start in ProcessSnapshot.objects.datetimes('timestamp', 'day', tzinfo=timezone.utc):
+        Process.objects.filter(
+            info__timestamp__gte=start, info__timestamp__lt=start + timedelta(days=1)
+        ).update(day=(start - EPOCH).days)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0007_process_identity_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='process',
+            name='day',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(fill_days, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='process',
+            name='day',
+            field=models.IntegerField(),
+        ),
+    ]
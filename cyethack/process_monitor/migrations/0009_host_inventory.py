@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:34
+
+import hashlib
+import json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+INVENTORY_FIELDS = ('operating_system', 'processor', 'processor_cores', 'processor_threads')
+
+
+def fingerprint(inventory):
+    # Same value as ingest.inventory_fingerprint()
+    canonical = json.dumps({field: inventory[field] for field in INVENTORY_FIELDS}, sort_keys=True)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def move_inventory(apps, schema_editor):
+    # One HostInventory per change of the static fields along each host's system
+    # snapshots; the host points at the newest
+    SystemSnapshot = apps.get_model('process_monitor', 'SystemSnapshot')
+    HostInventory = apps.get_model('process_monitor', 'HostInventory')
+    Host = apps.get_model('process_monitor', 'Host')
+    rows = (
+        SystemSnapshot.objects.order_by('host_id', 'timestamp', 'id')
+        .values('host_id', 'timestamp', *INVENTORY_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+    current = {}
+    for row in rows:
+        inventory = {field: row[field] for field in INVENTORY_FIELDS}
+        previous = current.get(row['host_id'])
+        if previous is not None and previous[1] == inventory:
+            continue
+        created = HostInventory.objects.create(
+            host_id=row['host_id'], fingerprint=fingerprint(inventory), recorded_at=row['timestamp'], **inventory
+        )
+        current[row['host_id']] = (created.id, inventory)
+    for host_id, (inventory_id, _) in current.items():
+        Host.objects.filter(id=host_id).update(inventory_id=inventory_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0008_process_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32)),
+                ('recorded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('operating_system', models.CharField(max_length=255)),
+                ('processor', models.CharField(max_length=255)),
+                ('processor_cores', models.IntegerField(null=True)),
+                ('processor_threads', models.IntegerField(null=True)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventories', to='process_monitor.host')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='inventory',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='process_monitor.hostinventory'),
+        ),
+        migrations.AddIndex(
+            model_name='hostinventory',
+            index=models.Index(fields=['host', '-recorded_at'], name='process_mon_host_id_e36027_idx'),
+        ),
+        migrations.RunPython(move_inventory, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='systemsnapshot',
+            name='operating_system',
+        ),
+        migrations.RemoveField(
+            model_name='systemsnapshot',
+            name='processor',
+        ),
+        migrations.RemoveField(
+            model_name='systemsnapshot',
+            name='processor_cores',
+        ),
+        migrations.RemoveField(
+            model_name='systemsnapshot',
+            name='processor_threads',
+        ),
+    ]
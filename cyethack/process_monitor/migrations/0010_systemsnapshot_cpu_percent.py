@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0009_host_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemsnapshot',
+            name='cpu_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
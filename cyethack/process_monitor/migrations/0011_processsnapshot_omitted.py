@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0010_systemsnapshot_cpu_percent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processsnapshot',
+            name='omitted_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='processsnapshot',
+            name='omitted_cpu_percent',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='processsnapshot',
+            name='omitted_memory_mb',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
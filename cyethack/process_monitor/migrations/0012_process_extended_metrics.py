@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('process_monitor', '0011_processsnapshot_omitted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='process',
+            name='involuntary_ctx_switches_per_sec',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='io_read_bytes_per_sec',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='io_write_bytes_per_sec',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='num_fds',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='num_threads',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='voluntary_ctx_switches_per_sec',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
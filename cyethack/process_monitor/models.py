@@ -1,22 +1,83 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.db import models
 from django.utils import timezone
 
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_day(timestamp):
+    # UTC days since the epoch: the partition key of Process rows
+    return (timestamp - EPOCH).days
+
+
+def day_start(day):
+    return EPOCH + timedelta(days=day)
+
+
+def utc_today():
+    return timezone.now().date()
+
+
 class Host(models.Model):
     hostname = models.CharField(max_length=255, unique=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     last_seen = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Sequence number of the last report applied, used to validate delta snapshots
+    last_sequence = models.BigIntegerField(null=True, blank=True)
+    # Newest snapshots by timestamp, maintained on ingest so reads need no sorted lookup
+    latest_process_snapshot = models.ForeignKey(
+        'ProcessSnapshot', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    latest_system_snapshot = models.ForeignKey(
+        'SystemSnapshot', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Snapshot of the report numbered last_sequence, which the next delta applies to. Not
+    # the latest one: a late or clock-skewed report can be applied without being newest.
+    baseline_process_snapshot = models.ForeignKey(
+        'ProcessSnapshot', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Current static inventory (OS, processor), stored once per change
+    inventory = models.ForeignKey(
+        'HostInventory', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
     
     def __str__(self):
         return self.hostname
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_seen']),
+        ]
+
+class HostInventory(models.Model):
+    # Static description of a host. A row is added only when the inventory changes, so
+    # system snapshots carry just the volatile memory and storage figures.
+    host = models.ForeignKey(Host, on_delete=models.CASCADE, related_name='inventories')
+    fingerprint = models.CharField(max_length=32)
+    # Timestamp of the first report carrying this inventory
+    recorded_at = models.DateTimeField(default=timezone.now)
+    operating_system = models.CharField(max_length=255)
+    processor = models.CharField(max_length=255)
+    processor_cores = models.IntegerField(null=True)
+    processor_threads = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.host.hostname} - {self.recorded_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['host', '-recorded_at']),
+        ]
+
+# Report fields stored on HostInventory
+INVENTORY_FIELDS = ('operating_system', 'processor', 'processor_cores', 'processor_threads')
+
 class SystemSnapshot(models.Model):
     host = models.ForeignKey(Host, on_delete=models.CASCADE, related_name='system_snapshots')
     timestamp = models.DateTimeField(default=timezone.now)
-    operating_system = models.CharField(max_length=255)
-    processor = models.CharField(max_length=255)
-    processor_cores = models.IntegerField()
-    processor_threads = models.IntegerField()
+    # Whole-host CPU utilization; None from agents that do not report it
+    cpu_percent = models.FloatField(null=True, blank=True)
     ram_total_gb = models.FloatField()
     ram_used_gb = models.FloatField()
     ram_available_gb = models.FloatField()
@@ -27,6 +88,10 @@ class SystemSnapshot(models.Model):
     class Meta:
         # db_table = 'system_snapshots'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['host', '-timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
     
     def __str__(self):
         return f"{self.host.hostname} - {self.timestamp}"
@@ -35,25 +100,112 @@ class ProcessSnapshot(models.Model):
     host = models.ForeignKey(Host, on_delete=models.CASCADE, related_name='snapshots')
     timestamp = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Processes the agent left out of the report (beyond max_processes, idle kernel
+    # threads), kept only as totals
+    omitted_count = models.IntegerField(default=0)
+    omitted_cpu_percent = models.FloatField(default=0.0)
+    omitted_memory_mb = models.FloatField(default=0.0)
     
     def __str__(self):
         return f"{self.host.hostname} - {self.timestamp}"
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['host', '-timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+
+class ProcessIdentity(models.Model):
+    # Stable attributes of one process instance, stored once per host and shared by
+    # every snapshot the process appears in. `fingerprint` hashes all of them.
+    host = models.ForeignKey(Host, on_delete=models.CASCADE, related_name='process_identities')
+    fingerprint = models.CharField(max_length=32)
+    pid = models.IntegerField()
+    name = models.CharField(max_length=255)
+    username = models.CharField(max_length=255, null=True, blank=True)
+    command_line = models.TextField(null=True, blank=True)
+    created_time = models.DateTimeField(null=True, blank=True)
+    # Day (UTC) an ingest last resolved it; retention only deletes identities unreferenced
+    # and unresolved for longer than the raw window
+    last_seen = models.DateField(default=utc_today)
+
+    def __str__(self):
+        return f"{self.name} (PID - {self.pid})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'fingerprint'], name='unique_process_identity'),
+        ]
+        indexes = [
+            models.Index(fields=['last_seen']),
+            models.Index(fields=['host', 'name']),
+            models.Index(fields=['host', 'pid', 'created_time']),
+        ]
+
+# Optional per-process metrics: counts, then per-second rates
+EXTENDED_COUNT_FIELDS = ('num_threads', 'num_fds')
+EXTENDED_RATE_FIELDS = (
+    'io_read_bytes_per_sec', 'io_write_bytes_per_sec',
+    'voluntary_ctx_switches_per_sec', 'involuntary_ctx_switches_per_sec'
+)
+EXTENDED_FIELDS = EXTENDED_COUNT_FIELDS + EXTENDED_RATE_FIELDS
+
+# Process attributes stored on ProcessIdentity
+IDENTITY_FIELDS = ('name', 'username', 'command_line', 'created_time')
+
+class ProcessQuerySet(models.QuerySet):
+    def with_identity(self):
+        return self.select_related('identity')
+
+    def identity_values(self, *fields):
+        # .values() where identity attributes appear under their old Process field names
+        return self.values(
+            *(field for field in fields if field not in IDENTITY_FIELDS),
+            **{field: models.F(f'identity__{field}') for field in fields if field in IDENTITY_FIELDS}
+        )
+
+    # Filters that include the partition key, so partitioned tables only scan matching partitions
+
+    def in_snapshot(self, snapshot):
+        return self.filter(info_id=snapshot.pk, day=partition_day(snapshot.timestamp))
+
+    def in_snapshots(self, snapshots):
+        snapshots = list(snapshots)
+        return self.filter(
+            info_id__in=[snapshot.pk for snapshot in snapshots],
+            day__in={partition_day(snapshot.timestamp) for snapshot in snapshots}
+        )
+
+    def between(self, start, end):
+        # Rows of snapshots taken in [start, end)
+        return self.filter(
+            info__timestamp__gte=start, info__timestamp__lt=end,
+            day__gte=partition_day(start), day__lte=partition_day(end)
+        )
 
 class Process(models.Model):
+    # One process in one snapshot: the identity plus the metrics that change between snapshots
     info = models.ForeignKey(ProcessSnapshot, on_delete=models.CASCADE, related_name='processes')
-    name = models.CharField(max_length=255)
+    identity = models.ForeignKey(ProcessIdentity, on_delete=models.CASCADE, related_name='samples')
     pid = models.IntegerField()
     parent_pid = models.IntegerField(null=True, blank=True)
     cpu_percent = models.FloatField(default=0.0)
     memory_percent = models.FloatField(default=0.0)
     memory_mb = models.FloatField(default=0.0)
     status = models.CharField(max_length=50, default='running')
-    username = models.CharField(max_length=255, null=True, blank=True)
-    command_line = models.TextField(null=True, blank=True)
-    created_time = models.DateTimeField(null=True, blank=True)
+    # Extended metrics, sampled by the agent for some processes or cycles only (None
+    # when not sampled); rates are per second since the agent's previous reading
+    num_threads = models.IntegerField(null=True, blank=True)
+    num_fds = models.IntegerField(null=True, blank=True)
+    io_read_bytes_per_sec = models.FloatField(null=True, blank=True)
+    io_write_bytes_per_sec = models.FloatField(null=True, blank=True)
+    voluntary_ctx_switches_per_sec = models.FloatField(null=True, blank=True)
+    involuntary_ctx_switches_per_sec = models.FloatField(null=True, blank=True)
+    # partition_day() of the snapshot timestamp, so rows can be partitioned by time
+    day = models.IntegerField()
+
+    objects = ProcessQuerySet.as_manager()
     
     def __str__(self):
         return f"{self.name} (PID - {self.pid})"
@@ -64,6 +216,22 @@ class Process(models.Model):
             models.Index(fields=['parent_pid']),
             models.Index(fields=['info']),
         ]
+
+    @property
+    def name(self):
+        return self.identity.name
+
+    @property
+    def username(self):
+        return self.identity.username
+
+    @property
+    def command_line(self):
+        return self.identity.command_line
+
+    @property
+    def created_time(self):
+        return self.identity.created_time
     
     @property
     def children(self):
@@ -75,6 +243,71 @@ class Process(models.Model):
             return self.info.processes.filter(pid=self.parent_pid).first()
         return None
 
+class HostRollup(models.Model):
+    # Hourly/daily per-host aggregates that outlive the raw snapshots they summarize
+    RESOLUTION_HOUR = 'hour'
+    RESOLUTION_DAY = 'day'
+    RESOLUTION_CHOICES = [
+        (RESOLUTION_HOUR, 'Hourly'),
+        (RESOLUTION_DAY, 'Daily'),
+    ]
+
+    host = models.ForeignKey(Host, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=10, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField()
+    snapshot_count = models.IntegerField(default=0)
+    avg_process_count = models.FloatField(default=0.0)
+    max_process_count = models.IntegerField(default=0)
+    avg_cpu_percent = models.FloatField(default=0.0)
+    max_cpu_percent = models.FloatField(default=0.0)
+    avg_memory_mb = models.FloatField(default=0.0)
+    max_memory_mb = models.FloatField(default=0.0)
+    system_count = models.IntegerField(default=0)
+    avg_ram_used_gb = models.FloatField(null=True, blank=True)
+    max_ram_used_gb = models.FloatField(null=True, blank=True)
+    avg_storage_used_gb = models.FloatField(null=True, blank=True)
+    max_storage_used_gb = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'resolution', 'bucket'], name='unique_host_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.host.hostname} - {self.resolution} - {self.bucket}"
+
+class StatusCounter(models.Model):
+    # Running totals kept by ingestion and retention so /api/status needs no COUNT(*).
+    # Split over shards to spread row-lock contention; read as the sum of all shards.
+    shard = models.SmallIntegerField(unique=True)
+    hosts = models.BigIntegerField(default=0)
+    process_snapshots = models.BigIntegerField(default=0)
+    system_snapshots = models.BigIntegerField(default=0)
+    processes = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Counters shard {self.shard}"
+
+class IngestActivity(models.Model):
+    # Ingest volume per minute (sharded like StatusCounter) for rate and delay metrics.
+    # Delay is the time between a report's timestamp and its ingestion.
+    bucket = models.DateTimeField()
+    shard = models.SmallIntegerField(default=0)
+    process_snapshots = models.BigIntegerField(default=0)
+    processes = models.BigIntegerField(default=0)
+    delay_seconds_total = models.FloatField(default=0.0)
+    max_delay_seconds = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'shard'], name='unique_ingest_activity_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.bucket} - shard {self.shard}"
+
 class APIKey(models.Model):
     key = models.CharField(max_length=64, unique=True)
     name = models.CharField(max_length=255)
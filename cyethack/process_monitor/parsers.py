@@ -0,0 +1,97 @@
+import io
+import json
+import zlib
+from django.conf import settings
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.process-monitor.columnar+json'
+# Payload keys that carry process lists (full snapshots and delta snapshots)
+COLUMNAR_KEYS = ('processes', 'added', 'changed')
+DEFAULT_MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+
+
+def _max_decompressed_bytes():
+    return getattr(settings, 'PROCESS_MONITOR_MAX_DECOMPRESSED_BYTES', DEFAULT_MAX_DECOMPRESSED_BYTES)
+
+
+def read_body(stream, parser_context):
+    # Returns the raw request body, gunzipped when sent with Content-Encoding: gzip
+    request = (parser_context or {}).get('request')
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower() if request else ''
+    body = stream.read() if stream is not None else b''
+    if encoding in ('', 'identity'):
+        return body
+    if encoding != 'gzip':
+        raise UnsupportedMediaType(f'Content-Encoding {encoding}')
+    limit = _max_decompressed_bytes()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, limit + 1)
+    except zlib.error as e:
+        raise ParseError(f'Invalid gzip body - {e}')
+    if len(data) > limit or decompressor.unconsumed_tail:
+        raise ParseError('Decompressed body too large')
+    return data
+
+
+def decode_columns(columns):
+    # {'pid': [1, 2], 'name': ['a', 'b']} -> [{'pid': 1, 'name': 'a'}, {'pid': 2, 'name': 'b'}]
+    if not isinstance(columns, dict):
+        raise ParseError("Columnar process lists must be objects of field arrays")
+    fields = list(columns.keys())
+    arrays = [columns[field] for field in fields]
+    if any(not isinstance(array, list) for array in arrays):
+        raise ParseError("Columnar process fields must be arrays")
+    lengths = {len(array) for array in arrays}
+    if len(lengths) > 1:
+        raise ParseError("Columnar process arrays differ in length")
+    return [dict(zip(fields, row)) for row in zip(*arrays)]
+
+
+class CompressedJSONParser(JSONParser):
+    # JSONParser that also accepts gzip-compressed bodies
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = read_body(stream, parser_context)
+        try:
+            return json.loads(body.decode(self._encoding(parser_context)))
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+    def _encoding(self, parser_context):
+        return (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+
+
+class ColumnarJSONParser(CompressedJSONParser):
+    # Agent payload whose process lists are one array per field instead of one object per process
+    media_type = COLUMNAR_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = super().parse(stream, media_type, parser_context)
+        if not isinstance(data, dict):
+            raise ParseError('Columnar payload must be an object')
+        reports = data.get('reports')
+        if isinstance(reports, list):
+            for report in reports:
+                if isinstance(report, dict):
+                    self._decode_report(report)
+        else:
+            self._decode_report(data)
+        return data
+
+    def _decode_report(self, report):
+        for key in COLUMNAR_KEYS:
+            if key in report:
+                report[key] = decode_columns(report[key])
+
+
+def parse_request(request):
+    # Parses an agent payload from a plain Django request (no DRF view) with the same
+    # parsers as the API views: JSON or columnar JSON, optionally gzip-compressed
+    for parser_class in (CompressedJSONParser, ColumnarJSONParser):
+        if request.content_type == parser_class.media_type:
+            break
+    else:
+        raise UnsupportedMediaType(request.content_type)
+    parser_context = {'request': request, 'encoding': request.encoding or settings.DEFAULT_CHARSET}
+    return parser_class().parse(io.BytesIO(request.body), request.content_type, parser_context)
@@ -0,0 +1,232 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Host, Process, ProcessSnapshot, SystemSnapshot, day_start, partition_day
+
+# Range-partitioned storage on PostgreSQL. ProcessSnapshot and SystemSnapshot are
+# partitioned by timestamp and Process by the day of its snapshot, over the same day
+# ranges, so the planner only reads the partitions a query's range touches and
+# retention drops a whole day with DROP TABLE instead of deleting its rows.
+
+DEFAULT_PARTITIONS = {
+    # Days covered by each partition
+    'days': 1,
+    # Days ahead of today to create partitions for
+    'premake': 3,
+}
+# Partitioned models and their partition key column, snapshots first
+PARTITION_KEYS = (
+    (ProcessSnapshot, 'timestamp'),
+    (SystemSnapshot, 'timestamp'),
+    (Process, 'day'),
+)
+# Partition names end with the first and the (exclusive) last day they cover
+PARTITION_NAME = re.compile(r'_(\d{8})_(\d{8})$')
+
+
+class PartitioningUnsupported(Exception):
+    pass
+
+
+def get_partition_config():
+    return {**DEFAULT_PARTITIONS, **getattr(settings, 'PROCESS_MONITOR_PARTITIONS', {})}
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(model):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [model._meta.db_table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitioning_enabled():
+    return all(is_partitioned(model) for model, _ in PARTITION_KEYS)
+
+
+def _parse_day(value):
+    return partition_day(datetime.strptime(value, '%Y%m%d').replace(tzinfo=dt_timezone.utc))
+
+
+def list_partitions(model):
+    # (name, first day, end day) of each range partition, ordered by first day
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [model._meta.db_table]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.search(name)
+        if match:
+            partitions.append((name, _parse_day(match.group(1)), _parse_day(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _bounds(key, start, end):
+    if key == 'day':
+        return str(start), str(end)
+    return f"'{day_start(start).isoformat()}'", f"'{day_start(end).isoformat()}'"
+
+
+def _free_range(day, days, existing):
+    # The `days`-aligned range around `day`, trimmed so it does not overlap existing partitions
+    start = day - day % days
+    end = start + days
+    for low, high in existing:
+        if high <= day:
+            start = max(start, high)
+        elif low > day:
+            end = min(end, low)
+    return start, end
+
+
+def create_partition(model, key, start, end):
+    # Rows of the range already in the default partition (late reports) move into the new one
+    table = model._meta.db_table
+    name = f'{table}_{day_start(start):%Y%m%d}_{day_start(end):%Y%m%d}'
+    low, high = _bounds(key, start, end)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {_quote(name)} (LIKE {_quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {_quote(table + "_default")} '
+            f'WHERE {_quote(key)} >= {low} AND {_quote(key)} < {high} RETURNING *) '
+            f'INSERT INTO {_quote(name)} SELECT * FROM moved'
+        )
+        cursor.execute(f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(name)} FOR VALUES FROM ({low}) TO ({high})')
+    return name
+
+
+def _ensure_range(model, key, first_day, last_day, days):
+    existing = [(start, end) for _, start, end in list_partitions(model)]
+    created = []
+    for day in range(first_day, last_day + 1):
+        if any(start <= day < end for start, end in existing):
+            continue
+        start, end = _free_range(day, days, existing)
+        created.append(create_partition(model, key, start, end))
+        existing.append((start, end))
+    return created
+
+
+def ensure_partitions(now=None):
+    # Creates the partitions for today through `premake` days ahead. Reports falling
+    # outside every partition land in the default partition rather than failing.
+    now = now or timezone.now()
+    config = get_partition_config()
+    today = partition_day(now)
+    created = []
+    for model, key in PARTITION_KEYS:
+        created.extend(_ensure_range(model, key, today, today + config['premake'], config['days']))
+    return created
+
+
+def drop_expired_partitions(cutoff):
+    # Drops every partition whose whole range is older than `cutoff`. Returns the deleted
+    # row counts by model label, and the cutoff for the row-by-row delete of what is left:
+    # rounded down to the start of the oldest kept partition, so partitions that are only
+    # partly expired wait until they can be dropped whole.
+    cutoff_day = partition_day(cutoff)
+    kept_from = cutoff_day
+    deleted = {}
+    for model, _ in PARTITION_KEYS:
+        for name, start, end in list_partitions(model):
+            if end > cutoff_day:
+                kept_from = min(kept_from, start)
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                # The foreign keys into partitioned tables are not enforced by the database
+                if model is ProcessSnapshot:
+                    Host.objects.filter(latest_process_snapshot__timestamp__lt=day_start(end)).update(
+                        latest_process_snapshot=None
+                    )
+                    Host.objects.filter(baseline_process_snapshot__timestamp__lt=day_start(end)).update(
+                        baseline_process_snapshot=None
+                    )
+                elif model is SystemSnapshot:
+                    Host.objects.filter(latest_system_snapshot__timestamp__lt=day_start(end)).update(
+                        latest_system_snapshot=None
+                    )
+                cursor.execute(f'SELECT count(*) FROM {_quote(name)}')
+                count = cursor.fetchone()[0]
+                cursor.execute(f'DROP TABLE {_quote(name)}')
+            deleted[model._meta.label] = deleted.get(model._meta.label, 0) + count
+    return deleted, min(cutoff, day_start(kept_from))
+
+
+def _key_day_range(cursor, table, key):
+    cursor.execute(f'SELECT min({_quote(key)}), max({_quote(key)}) FROM {_quote(table)}')
+    low, high = cursor.fetchone()
+    if low is None:
+        return None
+    if key == 'day':
+        return low, high
+    return partition_day(low), partition_day(high)
+
+
+def convert_table(model, key, now=None):
+    # Replaces the table by a partitioned one holding the same rows: partitions for every
+    # day with data through `premake` days ahead, plus a default partition. Locks the
+    # table for the whole copy, so run it in a maintenance window.
+    now = now or timezone.now()
+    config = get_partition_config()
+    table = model._meta.db_table
+    legacy = f'{table}_unpartitioned'
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # A foreign key into a partitioned table has to include the partition key,
+            # which a Django ForeignKey cannot, so the ones into this table are dropped.
+            # Django still applies on_delete itself.
+            cursor.execute(
+                "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                "WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+                [table]
+            )
+            for referencing, constraint in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE {referencing} DROP CONSTRAINT {_quote(constraint)}')
+            cursor.execute(f'ALTER TABLE {_quote(table)} RENAME TO {_quote(legacy)}')
+            cursor.execute(
+                f'CREATE TABLE {_quote(table)} (LIKE {_quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                f'PARTITION BY RANGE ({_quote(key)})'
+            )
+            cursor.execute(f'CREATE TABLE {_quote(table + "_default")} PARTITION OF {_quote(table)} DEFAULT')
+            today = partition_day(now)
+            first, last = _key_day_range(cursor, legacy, key) or (today, today)
+            _ensure_range(model, key, min(first, today), max(last, today + config['premake']), config['days'])
+            cursor.execute(f'INSERT INTO {_quote(table)} SELECT * FROM {_quote(legacy)}')
+            # Dropping the old table drops its identity sequence, so ids continue from an owned
+            # sequence (identity columns on partitioned tables need PostgreSQL 17)
+            cursor.execute(f'DROP TABLE {_quote(legacy)}')
+            sequence = _quote(f'{table}_id_seq')
+            cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {_quote(table)}.id')
+            cursor.execute(f"ALTER TABLE {_quote(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+            cursor.execute(f"SELECT setval('{sequence}', coalesce(max(id), 0) + 1, false) FROM {_quote(table)}")
+            # The primary key of a partitioned table must contain the partition key
+            cursor.execute(f'ALTER TABLE {_quote(table)} ADD PRIMARY KEY (id, {_quote(key)})')
+        with connection.schema_editor() as editor:
+            for statement in editor._model_indexes_sql(model):
+                editor.execute(statement)
+            for field in model._meta.local_fields:
+                if field.remote_field and field.db_constraint and not is_partitioned(field.related_model):
+                    editor.execute(editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+
+
+def convert_to_partitions(now=None):
+    # Converts the tables that are not partitioned yet; returns their names
+    if connection.vendor != 'postgresql':
+        raise PartitioningUnsupported('Partitioned storage requires PostgreSQL')
+    converted = []
+    for model, key in PARTITION_KEYS:
+        if not is_partitioned(model):
+            convert_table(model, key, now)
+            converted.append(model._meta.db_table)
+    return converted
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Host segment of keys whose response covers every host (the host list)
+ALL_HOSTS = 'all'
+
+
+def response_key(host, *parts):
+    # Keys start with the host id, so a host's entries can be dropped together, and
+    # include the snapshot ids the response was built from, so a new snapshot is a new key
+    return ':'.join(str(part) for part in (host, *parts))
+
+
+def make_etag(key):
+    return f'"{hashlib.sha1(key.encode()).hexdigest()[:24]}"'
+
+
+class NullCache:
+    # Caching disabled: every request rebuilds its response
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def invalidate_host(self, host_id):
+        pass
+
+    def stats(self):
+        return {'backend': 'none'}
+
+
+class MemoryCache:
+    # Per-process LRU of response bodies, bounded by their total size in bytes
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, **options):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+
+    def invalidate_host(self, host_id):
+        prefixes = (f'{host_id}:', f'{ALL_HOSTS}:')
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefixes)]:
+                self._discard(key)
+
+    def _discard(self, key):
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+
+    def stats(self):
+        return {'backend': 'memory', 'entries': len(self.entries), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class FileCache:
+    # Response bodies as files in one directory, shared by every server process.
+    # Reads refresh the file's mtime, and writes evict the least recently used
+    # files once the directory exceeds max_bytes.
+    def __init__(self, location, max_bytes=DEFAULT_MAX_BYTES, **options):
+        self.location = Path(location)
+        self.location.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        host = key.split(':', 1)[0]
+        return self.location / f'{host}.{hashlib.sha1(key.encode()).hexdigest()}.json'
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            value = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for path in self.location.glob('*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        if size <= self.max_bytes:
+            return
+        for _, file_size, path in sorted(entries, key=lambda entry: entry[0]):
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            size -= file_size
+            if size <= self.max_bytes:
+                break
+
+    def invalidate_host(self, host_id):
+        for prefix in (host_id, ALL_HOSTS):
+            for path in self.location.glob(f'{prefix}.*.json'):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def stats(self):
+        entries = self._entries()
+        return {'backend': 'file', 'entries': len(entries), 'bytes': sum(entry[1] for entry in entries),
+                'hits': self.hits, 'misses': self.misses}
+
+
+BACKENDS = {
+    'none': NullCache,
+    'memory': MemoryCache,
+    'file': FileCache,
+}
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    # The configured backend, built on first use and rebuilt after the setting changes
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            config = dict(getattr(settings, 'PROCESS_MONITOR_RESPONSE_CACHE', {}))
+            backend = config.pop('BACKEND', 'memory')
+            backend_class = BACKENDS.get(backend) or import_string(backend)
+            _response_cache = backend_class(**{name.lower(): value for name, value in config.items()})
+        return _response_cache
+
+
+@receiver(setting_changed)
+def reset_response_cache(setting, **kwargs):
+    global _response_cache
+    if setting == 'PROCESS_MONITOR_RESPONSE_CACHE':
+        with _response_cache_lock:
+            _response_cache = None
+
+
+def _etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return any(tag.strip() in ('*', etag, f'W/{etag}') for tag in header.split(','))
+
+
+def set_validators(response, key):
+    response['ETag'] = make_etag(key)
+    # Browsers keep the body but revalidate it on every poll
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified(request, key):
+    # 304 response when the client already holds the body for `key`, else None
+    if _etag_matches(request, make_etag(key)):
+        return set_validators(HttpResponseNotModified(), key)
+    return None
+
+
+def cached_json_response(request, key, build):
+    # JSON response for `key`, answering If-None-Match with 304 before anything is built
+    # and otherwise serving the cached body or rendering build() once and storing it
+    response = not_modified(request, key)
+    if response is not None:
+        return response
+    cache = get_response_cache()
+    body = cache.get(key)
+    if body is None:
+        body = JSONRenderer().render(build())
+        cache.set(key, body)
+    return set_validators(HttpResponse(body, content_type='application/json'), key)
+
+
+def hosts_fingerprint(rows):
+    # Digest of the host rows a host-list response is built from
+    return hashlib.sha1(json.dumps(rows, default=str).encode()).hexdigest()
@@ -0,0 +1,329 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from .counters import prune_activity, reconcile_counters, record_deletions
+from .models import HostRollup, IngestActivity, Process, ProcessIdentity, ProcessSnapshot, SystemSnapshot, partition_day
+from .partitions import drop_expired_partitions, ensure_partitions, partitioning_enabled
+
+logger = logging.getLogger(__name__)
+
+# Days each tier is kept; None keeps it forever
+DEFAULT_RETENTION = {
+    'raw': 7,
+    'hour': 90,
+    'day': 365,
+}
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_INTERVAL = 3600
+DEFAULT_RECONCILE_INTERVAL = 86400
+DEFAULT_LOOKBACK_HOURS = 6
+IDENTITY_DELETE_BATCH_SIZE = 500
+ROLLUP_VALUE_FIELDS = (
+    'snapshot_count', 'avg_process_count', 'max_process_count',
+    'avg_cpu_percent', 'max_cpu_percent', 'avg_memory_mb', 'max_memory_mb',
+    'system_count', 'avg_ram_used_gb', 'max_ram_used_gb',
+    'avg_storage_used_gb', 'max_storage_used_gb'
+)
+
+
+def get_retention():
+    return {**DEFAULT_RETENTION, **getattr(settings, 'PROCESS_MONITOR_RETENTION', {})}
+
+
+def get_batch_size():
+    return getattr(settings, 'PROCESS_MONITOR_RETENTION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def floor_bucket(value, resolution):
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if resolution == HostRollup.RESOLUTION_DAY:
+        value = value.replace(hour=0)
+    return value
+
+
+def _rollup_start(resolution, earliest):
+    # Re-roll a few buckets before the last one written so late (spooled) reports are counted
+    last = HostRollup.objects.filter(resolution=resolution).aggregate(last=Max('bucket'))['last']
+    if last is None:
+        return earliest
+    lookback = timedelta(hours=getattr(settings, 'PROCESS_MONITOR_ROLLUP_LOOKBACK_HOURS', DEFAULT_LOOKBACK_HOURS))
+    return floor_bucket(last - lookback, resolution)
+
+
+def _max(current, value):
+    if current is None:
+        return value
+    if value is None:
+        return current
+    return max(current, value)
+
+
+class _Bucket:
+    # Running totals for one (host, bucket); averages are weighted by sample counts
+    def __init__(self):
+        self.snapshot_count = 0
+        self.process_count_total = 0.0
+        self.max_process_count = 0
+        self.cpu_total = 0.0
+        self.max_cpu_percent = 0.0
+        self.memory_total = 0.0
+        self.max_memory_mb = 0.0
+        self.system_count = 0
+        self.ram_total = 0.0
+        self.max_ram_used_gb = None
+        self.storage_total = 0.0
+        self.max_storage_used_gb = None
+
+    def add_processes(self, count, avg_process_count, max_process_count, avg_cpu, max_cpu, avg_memory, max_memory):
+        self.snapshot_count += count
+        self.process_count_total += avg_process_count * count
+        self.max_process_count = max(self.max_process_count, max_process_count)
+        self.cpu_total += avg_cpu * count
+        self.max_cpu_percent = max(self.max_cpu_percent, max_cpu)
+        self.memory_total += avg_memory * count
+        self.max_memory_mb = max(self.max_memory_mb, max_memory)
+
+    def add_system(self, count, avg_ram, max_ram, avg_storage, max_storage):
+        if not count:
+            return
+        self.system_count += count
+        self.ram_total += (avg_ram or 0.0) * count
+        self.storage_total += (avg_storage or 0.0) * count
+        self.max_ram_used_gb = _max(self.max_ram_used_gb, max_ram)
+        self.max_storage_used_gb = _max(self.max_storage_used_gb, max_storage)
+
+    def to_rollup(self, host_id, resolution, bucket):
+        snapshots = self.snapshot_count or 1
+        systems = self.system_count or 1
+        return HostRollup(
+            host_id=host_id,
+            resolution=resolution,
+            bucket=bucket,
+            snapshot_count=self.snapshot_count,
+            avg_process_count=self.process_count_total / snapshots,
+            max_process_count=self.max_process_count,
+            avg_cpu_percent=self.cpu_total / snapshots,
+            max_cpu_percent=self.max_cpu_percent,
+            avg_memory_mb=self.memory_total / snapshots,
+            max_memory_mb=self.max_memory_mb,
+            system_count=self.system_count,
+            avg_ram_used_gb=self.ram_total / systems if self.system_count else None,
+            max_ram_used_gb=self.max_ram_used_gb,
+            avg_storage_used_gb=self.storage_total / systems if self.system_count else None,
+            max_storage_used_gb=self.max_storage_used_gb,
+        )
+
+
+def _save_rollups(buckets, resolution):
+    rollups = [bucket.to_rollup(host_id, resolution, start) for (host_id, start), bucket in buckets.items()]
+    HostRollup.objects.bulk_create(
+        rollups,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['host', 'resolution', 'bucket'],
+        update_fields=list(ROLLUP_VALUE_FIELDS),
+    )
+    return len(rollups)
+
+
+def rollup_hourly(until):
+    # Aggregates raw snapshots in complete hours before `until` into hourly rollups.
+    # cpu/memory figures are per-snapshot totals over all processes.
+    earliest = ProcessSnapshot.objects.aggregate(first=Min('timestamp'))['first']
+    if earliest is None:
+        return 0
+    start = _rollup_start(HostRollup.RESOLUTION_HOUR, floor_bucket(earliest, HostRollup.RESOLUTION_HOUR))
+    buckets = {}
+    snapshots = (
+        ProcessSnapshot.objects
+        .filter(timestamp__gte=start, timestamp__lt=until)
+        .annotate(
+            bucket=TruncHour('timestamp'),
+            process_count=Count('processes'),
+            cpu_total=Sum('processes__cpu_percent'),
+            memory_total=Sum('processes__memory_mb'),
+        )
+        .values('host_id', 'bucket', 'process_count', 'cpu_total', 'memory_total')
+        .order_by()
+    )
+    for row in snapshots.iterator(chunk_size=2000):
+        cpu, memory = row['cpu_total'] or 0.0, row['memory_total'] or 0.0
+        buckets.setdefault((row['host_id'], row['bucket']), _Bucket()).add_processes(
+            1, row['process_count'], row['process_count'], cpu, cpu, memory, memory
+        )
+    systems = (
+        SystemSnapshot.objects
+        .filter(timestamp__gte=start, timestamp__lt=until)
+        .annotate(bucket=TruncHour('timestamp'))
+        .values('host_id', 'bucket')
+        .annotate(
+            count=Count('id'),
+            avg_ram=Avg('ram_used_gb'),
+            max_ram=Max('ram_used_gb'),
+            avg_storage=Avg('storage_used_gb'),
+            max_storage=Max('storage_used_gb'),
+        )
+        .order_by()
+    )
+    for row in systems:
+        buckets.setdefault((row['host_id'], row['bucket']), _Bucket()).add_system(
+            row['count'], row['avg_ram'], row['max_ram'], row['avg_storage'], row['max_storage']
+        )
+    return _save_rollups(buckets, HostRollup.RESOLUTION_HOUR)
+
+
+def rollup_daily(until):
+    # Folds hourly rollups of complete days before `until` into daily rollups
+    earliest = HostRollup.objects.filter(resolution=HostRollup.RESOLUTION_HOUR).aggregate(first=Min('bucket'))['first']
+    if earliest is None:
+        return 0
+    start = _rollup_start(HostRollup.RESOLUTION_DAY, floor_bucket(earliest, HostRollup.RESOLUTION_DAY))
+    buckets = {}
+    hourly = HostRollup.objects.filter(
+        resolution=HostRollup.RESOLUTION_HOUR, bucket__gte=start, bucket__lt=until
+    ).order_by()
+    for hour in hourly.iterator(chunk_size=2000):
+        bucket = buckets.setdefault((hour.host_id, floor_bucket(hour.bucket, HostRollup.RESOLUTION_DAY)), _Bucket())
+        bucket.add_processes(
+            hour.snapshot_count, hour.avg_process_count, hour.max_process_count,
+            hour.avg_cpu_percent, hour.max_cpu_percent, hour.avg_memory_mb, hour.max_memory_mb
+        )
+        bucket.add_system(
+            hour.system_count, hour.avg_ram_used_gb, hour.max_ram_used_gb,
+            hour.avg_storage_used_gb, hour.max_storage_used_gb
+        )
+    return _save_rollups(buckets, HostRollup.RESOLUTION_DAY)
+
+
+def _delete_in_batches(model, cutoff, batch_size, max_batches=None):
+    # Deletes rows older than cutoff a batch at a time so no transaction grows unbounded
+    deleted = {}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            model.objects.filter(timestamp__lt=cutoff)
+            .order_by('timestamp')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            if model is ProcessSnapshot:
+                _, counts = Process.objects.filter(info_id__in=ids, day__lte=partition_day(cutoff)).delete()
+                for label, count in counts.items():
+                    deleted[label] = deleted.get(label, 0) + count
+            _, counts = model.objects.filter(id__in=ids).delete()
+        for label, count in counts.items():
+            deleted[label] = deleted.get(label, 0) + count
+        batches += 1
+    return deleted
+
+
+def _delete_orphan_identities(cutoff, max_batches=None):
+    # Identities no longer referenced by any Process row once their snapshots expired,
+    # and not resolved by an ingest since `cutoff`. An identity an ingest has resolved
+    # but not yet used is marked seen first, so it is never deleted under it. Orphans
+    # are paged through in id order, so a run never holds more than one batch of ids.
+    seen_before = cutoff.date()
+    orphans = ProcessIdentity.objects.filter(last_seen__lt=seen_before, samples__isnull=True)
+    deleted = 0
+    batches = 0
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            orphans.filter(id__gt=last_id).order_by('id')
+            .values_list('id', flat=True)[:IDENTITY_DELETE_BATCH_SIZE]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        with transaction.atomic():
+            deleted += orphans.filter(id__in=ids).delete()[0]
+        batches += 1
+    return deleted
+
+
+def run_retention(now=None, batch_size=None, rollup=True, max_batches=None):
+    # Rolls raw data up first so nothing is deleted before it has been summarized
+    now = now or timezone.now()
+    batch_size = batch_size or get_batch_size()
+    retention = get_retention()
+    stats = {'hourly_rollups': 0, 'daily_rollups': 0, 'deleted': {}}
+    if rollup:
+        stats['hourly_rollups'] = rollup_hourly(floor_bucket(now, HostRollup.RESOLUTION_HOUR))
+        stats['daily_rollups'] = rollup_daily(floor_bucket(now, HostRollup.RESOLUTION_DAY))
+    partitioned = partitioning_enabled()
+    if partitioned:
+        ensure_partitions(now)
+    if retention['raw'] is not None:
+        cutoff = now - timedelta(days=retention['raw'])
+        if partitioned:
+            # Whole expired days are dropped; the batched delete below only finds rows
+            # that landed in the default partition
+            stats['deleted'], cutoff = drop_expired_partitions(cutoff)
+        for model in (ProcessSnapshot, SystemSnapshot):
+            for label, count in _delete_in_batches(model, cutoff, batch_size, max_batches).items():
+                stats['deleted'][label] = stats['deleted'].get(label, 0) + count
+        identities = _delete_orphan_identities(cutoff, max_batches)
+        if identities:
+            stats['deleted'][ProcessIdentity._meta.label] = identities
+        record_deletions(stats['deleted'])
+    for resolution in (HostRollup.RESOLUTION_HOUR, HostRollup.RESOLUTION_DAY):
+        if retention[resolution] is None:
+            continue
+        cutoff = now - timedelta(days=retention[resolution])
+        _, counts = HostRollup.objects.filter(resolution=resolution, bucket__lt=cutoff).delete()
+        if counts:
+            label = f'{HostRollup._meta.label}.{resolution}'
+            stats['deleted'][label] = sum(counts.values())
+    pruned = prune_activity(now)
+    if pruned:
+        stats['deleted'][IngestActivity._meta.label] = pruned
+    return stats
+
+
+class RetentionScheduler:
+    # In-process background thread running run_retention() every `interval` seconds,
+    # and reconcile_counters() on the first run and then every `reconcile_interval` seconds
+    def __init__(self, interval=None, reconcile_interval=None):
+        self.interval = interval or getattr(settings, 'PROCESS_MONITOR_RETENTION_INTERVAL', DEFAULT_INTERVAL)
+        self.reconcile_interval = reconcile_interval or getattr(
+            settings, 'PROCESS_MONITOR_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL
+        )
+        self.last_reconciled = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='retention-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        # First run waits one interval so startup (and migrate) is not slowed down
+        while not self.stopping.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Retention run failed")
+            finally:
+                close_old_connections()
+
+    def run_once(self):
+        stats = run_retention()
+        logger.info(f"Retention run finished: {stats}")
+        started = time.monotonic()
+        if self.last_reconciled is None or started - self.last_reconciled >= self.reconcile_interval:
+            corrections = reconcile_counters()
+            self.last_reconciled = started
+            logger.info(f"Counters reconciled: {corrections}")
@@ -1,7 +1,12 @@
 from rest_framework import serializers
 from .models import Host, ProcessSnapshot, Process
+from .tree import ProcessTree
 
 class ProcessSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='identity.name', read_only=True)
+    username = serializers.CharField(source='identity.username', read_only=True)
+    command_line = serializers.CharField(source='identity.command_line', read_only=True)
+    created_time = serializers.DateTimeField(source='identity.created_time', read_only=True)
     children = serializers.SerializerMethodField()
     
     class Meta:
@@ -13,11 +18,15 @@ class ProcessSerializer(serializers.ModelSerializer):
         ]
     
     def get_children(self, obj):
-        children = Process.objects.filter(
-            snapshot=obj.snapshot,
-            parent_pid=obj.pid
-        ).order_by('name')
-        return ProcessSerializer(children, many=True).data
+        # One ProcessTree per snapshot is shared through the context, so nested
+        # serialization costs a single query however deep the hierarchy goes
+        trees = self.context.setdefault('process_trees', {})
+        tree = trees.get(obj.info_id)
+        if tree is None:
+            tree = ProcessTree.for_snapshot(obj.info_id, order_by=['identity__name'], as_values=False, day=obj.day)
+            trees[obj.info_id] = tree
+        children = tree.children_of(obj.pid)
+        return ProcessSerializer(children, many=True, context=self.context).data
 
 class ProcessSnapshotSerializer(serializers.ModelSerializer):
     host_name = serializers.CharField(source='host.hostname', read_only=True)
@@ -28,7 +37,7 @@ class ProcessSnapshotSerializer(serializers.ModelSerializer):
         fields = ['id', 'host_name', 'timestamp', 'process_count']
     
     def get_process_count(self, obj):
-        return obj.processes.count()
+        return Process.objects.in_snapshot(obj).count()
 
 class HostSerializer(serializers.ModelSerializer):
     latest_snapshot = serializers.SerializerMethodField()
@@ -38,7 +47,7 @@ class HostSerializer(serializers.ModelSerializer):
         fields = ['id', 'hostname', 'ip_address', 'last_seen', 'latest_snapshot']
     
     def get_latest_snapshot(self, obj):
-        latest = obj.snapshots.first()
+        latest = obj.latest_process_snapshot
         if latest:
             return ProcessSnapshotSerializer(latest).data
         return None
@@ -0,0 +1,129 @@
+import heapq
+import json
+from django.conf import settings
+from .models import EXTENDED_FIELDS, INVENTORY_FIELDS, HostInventory, Process, ProcessSnapshot, SystemSnapshot
+from .tree import PROCESS_FIELDS, serialize_omitted, serialize_process
+
+DEFAULT_CHUNK_SIZE = 2000
+EXPORT_PROCESS_FIELDS = (
+    'pid', 'parent_pid', 'name', 'username', 'command_line', 'created_time',
+    'cpu_percent', 'memory_mb', 'memory_percent', 'status', *EXTENDED_FIELDS
+)
+EXPORT_SYSTEM_FIELDS = (
+    'cpu_percent', 'ram_total_gb', 'ram_used_gb', 'ram_available_gb',
+    'storage_total_gb', 'storage_used_gb', 'storage_free_gb'
+)
+
+
+def get_chunk_size():
+    return getattr(settings, 'PROCESS_MONITOR_STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+
+
+def stream_json(header, items, key='points'):
+    # Renders {..header, key: [...]} piece by piece as the items are read
+    yield json.dumps(header)[:-1] + f', "{key}": ['
+    for index, item in enumerate(items):
+        yield (', ' if index else '') + json.dumps(item)
+    yield ']}'
+
+
+def stream_latest_processes(snapshot, chunk_size=None):
+    # The flat process list of a snapshot, written as rows come off a server-side cursor.
+    # Rows carry parent_pid but no children: nesting needs the whole snapshot in memory.
+    rows = (
+        Process.objects.in_snapshot(snapshot)
+        .order_by('id')
+        .identity_values(*PROCESS_FIELDS)
+        .iterator(chunk_size=chunk_size or get_chunk_size())
+    )
+    header = {'id': snapshot.id, 'timestamp': snapshot.timestamp.isoformat(), 'omitted': serialize_omitted(snapshot)}
+    return stream_json(header, (serialize_process(row) for row in rows), key='processes')
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _process_snapshot_lines(host, start, end, chunk_size):
+    # Merge-joins snapshots with their processes, both read in (timestamp, id) order,
+    # so only one snapshot's processes are held at a time
+    snapshots = (
+        ProcessSnapshot.objects.filter(host=host, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp', 'id')
+        .values('id', 'timestamp', 'omitted_count', 'omitted_cpu_percent', 'omitted_memory_mb')
+        .iterator(chunk_size=chunk_size)
+    )
+    processes = iter(
+        Process.objects.between(start, end).filter(info__host=host)
+        .order_by('info__timestamp', 'info_id')
+        .identity_values('info_id', 'info__timestamp', *EXPORT_PROCESS_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    pending = next(processes, None)
+    for snapshot in snapshots:
+        position = (snapshot['timestamp'], snapshot['id'])
+        # Skip rows of snapshots committed after the snapshot query started reading
+        while pending is not None and (pending['info__timestamp'], pending['info_id']) < position:
+            pending = next(processes, None)
+        rows = []
+        while pending is not None and pending['info_id'] == snapshot['id']:
+            rows.append({
+                field: _isoformat(pending[field]) if field == 'created_time' else pending[field]
+                for field in EXPORT_PROCESS_FIELDS
+            })
+            pending = next(processes, None)
+        line = {
+            'type': 'processes',
+            'id': snapshot['id'],
+            'timestamp': snapshot['timestamp'].isoformat(),
+            'omitted': {
+                'count': snapshot['omitted_count'],
+                'cpu_percent': snapshot['omitted_cpu_percent'],
+                'memory_mb': snapshot['omitted_memory_mb']
+            },
+            'processes': rows
+        }
+        yield snapshot['timestamp'], json.dumps(line) + '\n'
+
+
+def _system_snapshot_lines(host, start, end, chunk_size):
+    snapshots = (
+        SystemSnapshot.objects.filter(host=host, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp', 'id')
+        .values('id', 'timestamp', *EXPORT_SYSTEM_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    for snapshot in snapshots:
+        line = {'type': 'system', **snapshot, 'timestamp': snapshot['timestamp'].isoformat()}
+        yield snapshot['timestamp'], json.dumps(line) + '\n'
+
+
+def _inventory_lines(host, start, end):
+    # The inventory in effect at `start`, then every change up to `end`
+    inventories = HostInventory.objects.filter(host=host, recorded_at__lt=end).order_by('recorded_at', 'id')
+    previous = inventories.filter(recorded_at__lt=start).last()
+    rows = ([previous] if previous else []) + list(inventories.filter(recorded_at__gte=start))
+    for inventory in rows:
+        line = {
+            'type': 'inventory',
+            'timestamp': inventory.recorded_at.isoformat(),
+            **{field: getattr(inventory, field) for field in INVENTORY_FIELDS}
+        }
+        yield max(inventory.recorded_at, start), json.dumps(line) + '\n'
+
+
+def export_ndjson(host, start, end, chunk_size=None):
+    # Every process and system snapshot of a host in [start, end), one JSON object per
+    # line in timestamp order, with the host inventory as it changes. Memory stays flat
+    # however long the range: rows are read through server-side cursors and at most one
+    # snapshot's processes are buffered.
+    chunk_size = chunk_size or get_chunk_size()
+    # On equal timestamps the inventory comes first
+    lines = heapq.merge(
+        _inventory_lines(host, start, end),
+        _process_snapshot_lines(host, start, end, chunk_size),
+        _system_snapshot_lines(host, start, end, chunk_size),
+        key=lambda item: item[0]
+    )
+    for _, line in lines:
+        yield line
@@ -0,0 +1,99 @@
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from .models import Host, Process, ProcessSnapshot
+
+SYSTEM_SUMMARY_FIELDS = (
+    'timestamp', 'ram_total_gb', 'ram_used_gb', 'ram_available_gb',
+    'storage_total_gb', 'storage_used_gb', 'storage_free_gb'
+)
+CONSUMER_FIELDS = ('info_id', 'pid', 'name', 'cpu_percent', 'memory_percent', 'memory_mb')
+
+
+def host_summary_queryset():
+    # One query: every host joined to its latest process/system snapshot pointers
+    system_annotations = {
+        f'system_{field}': F(f'latest_system_snapshot__{field}')
+        for field in SYSTEM_SUMMARY_FIELDS
+    }
+    return (
+        Host.objects
+        .annotate(
+            latest_snapshot_id=F('latest_process_snapshot_id'),
+            latest_snapshot_timestamp=F('latest_process_snapshot__timestamp'),
+            **system_annotations
+        )
+        .order_by('id')
+    )
+
+
+def process_counts(snapshots):
+    # Snapshot id -> number of processes, in one grouped query over the snapshots' partitions
+    if not snapshots:
+        return {}
+    rows = Process.objects.in_snapshots(snapshots).order_by().values('info_id').annotate(total=Count('id'))
+    return {row['info_id']: row['total'] for row in rows}
+
+
+def top_consumers(snapshots, field, top_n):
+    # Top-N processes per snapshot ranked by `field`, in one windowed query
+    if not snapshots or top_n <= 0:
+        return {}
+    rows = (
+        Process.objects.in_snapshots(snapshots)
+        .annotate(rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('info_id')],
+            order_by=[F(field).desc(), F('pid').asc()]
+        ))
+        .filter(rank__lte=top_n)
+        .identity_values(*CONSUMER_FIELDS)
+        .order_by('info_id', f'-{field}', 'pid')
+    )
+    result = {}
+    for row in rows:
+        snapshot_id = row.pop('info_id')
+        result.setdefault(snapshot_id, []).append(row)
+    return result
+
+
+def host_summaries(after=None, limit=50, top_n=5):
+    # Keyset page of host summaries ordered by host id; returns (results, next_after)
+    queryset = host_summary_queryset()
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    hosts = list(queryset[:limit + 1])
+    has_more = len(hosts) > limit
+    hosts = hosts[:limit]
+    snapshots = [
+        ProcessSnapshot(id=host.latest_snapshot_id, timestamp=host.latest_snapshot_timestamp)
+        for host in hosts if host.latest_snapshot_id
+    ]
+    counts = process_counts(snapshots)
+    top_cpu = top_consumers(snapshots, 'cpu_percent', top_n)
+    top_memory = top_consumers(snapshots, 'memory_mb', top_n)
+    results = []
+    for host in hosts:
+        host_info = {
+            'id': host.id,
+            'hostname': host.hostname,
+            'ip_address': host.ip_address,
+            'first_seen': host.created_at.isoformat(),
+            'last_seen': host.last_seen.isoformat(),
+            'latest_system_snapshot': None,
+            'latest_process_snapshot': None
+        }
+        if host.latest_snapshot_id:
+            host_info['latest_process_snapshot'] = {
+                'id': host.latest_snapshot_id,
+                'timestamp': host.latest_snapshot_timestamp.isoformat(),
+                'process_count': counts.get(host.latest_snapshot_id, 0),
+                'top_cpu': top_cpu.get(host.latest_snapshot_id, []),
+                'top_memory': top_memory.get(host.latest_snapshot_id, [])
+            }
+        if host.system_timestamp:
+            system_info = {field: getattr(host, f'system_{field}') for field in SYSTEM_SUMMARY_FIELDS}
+            system_info['timestamp'] = system_info['timestamp'].isoformat()
+            host_info['latest_system_snapshot'] = system_info
+        results.append(host_info)
+    next_after = hosts[-1].id if has_more else None
+    return results, next_after
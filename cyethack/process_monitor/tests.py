@@ -1,3 +1,752 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import authentication, retention
+from .authentication import APIKeyCache, CachedKey
+from .counters import reconcile_counters, status_counters
+from .ingest_queue import IngestQueue
+from .models import (
+    APIKey, Host, HostRollup, Process, ProcessIdentity, ProcessSnapshot, SystemSnapshot, day_start, partition_day, utc_today
+)
+from .response_cache import FileCache, MemoryCache, NullCache, get_response_cache
+from .retention import RetentionScheduler, run_retention
+
+
+def make_process(pid, **fields):
+    return {
+        'pid': pid,
+        'name': f'proc{pid}',
+        'parent_pid': 1 if pid != 1 else None,
+        'cpu_percent': 1.0,
+        'memory_percent': 0.5,
+        'memory_mb': 10.0,
+        'status': 'running',
+        'username': 'root',
+        'command_line': f'/usr/bin/proc{pid}',
+        'created_time': '2025-01-01T00:00:00',
+        **fields
+    }
+
+
+def make_report(hostname='host1', timestamp='2025-01-01T12:00:00Z', **fields):
+    return {
+        'hostname': hostname,
+        'timestamp': timestamp,
+        'system_info': {
+            'ram_total_gb': 8, 'ram_used_gb': 4, 'ram_available_gb': 4,
+            'storage_total_gb': 100, 'storage_used_gb': 50, 'storage_free_gb': 50,
+        },
+        **fields
+    }
+
+
+class SubmitTestCase(TestCase):
+    def submit(self, report, path='/api/submit/'):
+        return self.client.post(path, report, content_type='application/json')
+
+    def latest_processes(self, hostname='host1'):
+        snapshot = Host.objects.get(hostname=hostname).snapshots.first()
+        return {
+            row['pid']: row
+            for row in Process.objects.filter(info=snapshot).identity_values('pid', 'name', 'username', 'cpu_percent')
+        }
+
+
+class SubmitValidationTests(SubmitTestCase):
+    # The single, batch and queued paths reject the same malformed input with 400,
+    # before anything is written or queued
+    def assert_rejected(self, body, message):
+        response = self.submit(body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()['error'])
+        with mock.patch('process_monitor.views.get_ingest_queue') as get_ingest_queue:
+            response = self.submit(body, '/api/submit/queued/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()['error'])
+        get_ingest_queue.assert_not_called()
+        response = self.submit({'reports': [body]}, '/api/submit/batch/')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()['results'][0]
+        self.assertEqual(result['status'], 400)
+        self.assertIn(message, result['error'])
+        self.assertFalse(Process.objects.exists())
+        self.assertFalse(Host.objects.exists())
+
+    def test_non_object_report(self):
+        self.assert_rejected([make_report(processes=[])], 'Report must be a JSON object')
+
+    def test_invalid_hostname(self):
+        self.assert_rejected(make_report(hostname='h' * 300, processes=[]), 'Missing or invalid hostname')
+
+    def test_non_list_processes(self):
+        self.assert_rejected(make_report(processes='junk'), "'processes' must be a list")
+
+    def test_non_object_process(self):
+        self.assert_rejected(make_report(processes=['junk']), 'Every process needs a pid')
+
+    def test_invalid_process_value(self):
+        self.assert_rejected(make_report(processes=[make_process(1, cpu_percent='high')]), 'Invalid process 1')
+
+    def test_over_length_values_are_truncated(self):
+        long_name = 'n' * 300
+        response = self.submit(make_report(processes=[
+            make_process(1, name=long_name, status='s' * 80, username='u' * 300)
+        ]))
+        self.assertEqual(response.status_code, 200)
+        process = self.latest_processes()[1]
+        self.assertEqual(process['name'], long_name[:255])
+        self.assertEqual(process['username'], 'u' * 255)
+
+
+class DeltaIngestTests(SubmitTestCase):
+    def full_report(self, sequence, pids, timestamp='2025-01-01T12:00:00Z', **fields):
+        return make_report(
+            timestamp=timestamp, mode='full', sequence=sequence,
+            processes=[make_process(pid) for pid in pids], **fields
+        )
+
+    def delta_report(self, sequence, baseline_sequence, timestamp='2025-01-01T12:01:00Z', **fields):
+        return make_report(
+            timestamp=timestamp, mode='delta', sequence=sequence, baseline_sequence=baseline_sequence,
+            **{'added': [], 'changed': [], 'removed': [], **fields}
+        )
+
+    def snapshot_pids(self, timestamp):
+        return sorted(Process.objects.filter(info__timestamp=timestamp).values_list('pid', flat=True))
+
+    def test_delta_expands_on_full_snapshot(self):
+        self.assertEqual(self.submit(self.full_report(1, [1, 2, 3])).status_code, 200)
+        response = self.submit(self.delta_report(
+            2, 1, added=[make_process(4)], changed=[make_process(2, cpu_percent=50.0)], removed=[{'pid': 3}]
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processes_count'], 3)
+        processes = self.latest_processes()
+        self.assertEqual(sorted(processes), [1, 2, 4])
+        self.assertEqual(processes[2]['cpu_percent'], 50.0)
+        self.assertEqual(Host.objects.get(hostname='host1').last_sequence, 2)
+
+    def test_stale_baseline_is_rejected(self):
+        self.submit(self.full_report(1, [1, 2]))
+        self.submit(self.delta_report(2, 1))
+        response = self.submit(self.delta_report(3, 1, timestamp='2025-01-01T12:02:00Z'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {
+            'error': 'Delta baseline mismatch', 'resend_baseline': True, 'last_sequence': 2
+        })
+        self.assertEqual(Host.objects.get(hostname='host1').last_sequence, 2)
+
+    def test_delta_without_baseline_is_rejected(self):
+        response = self.submit(self.delta_report(1, None))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Host.objects.filter(hostname='host1').exists())
+
+    def test_non_object_delta_entry(self):
+        self.submit(self.full_report(1, [1]))
+        response = self.submit(self.delta_report(2, 1, added=['junk']))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Host.objects.get(hostname='host1').last_sequence, 1)
+
+    def test_delta_applies_to_last_sequence_not_newest_snapshot(self):
+        # The clock went back (e.g. a DST fall-back in the agent's local time): the
+        # second full report is older than the first but is still the delta baseline
+        self.submit(self.full_report(1, [1, 2], timestamp='2025-01-01T12:00:00Z'))
+        self.submit(self.full_report(2, [1, 3], timestamp='2025-01-01T11:00:00Z'))
+        response = self.submit(self.delta_report(3, 2, timestamp='2025-01-01T11:01:00Z', added=[make_process(4)]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.snapshot_pids('2025-01-01T11:01:00Z'), [1, 3, 4])
+
+    def test_batch_statuses(self):
+        reports = [
+            self.full_report(1, [1, 2]),
+            self.delta_report(2, 1, added=[make_process(3)]),
+            self.delta_report(3, 1, timestamp='2025-01-01T12:02:00Z'),
+            make_report('host2', timestamp='bad', processes=[]),
+            {'timestamp': '2025-01-01T12:00:00Z', 'processes': []},
+            self.delta_report(4, 2, timestamp='2025-01-01T12:03:00Z', removed=[{'pid': 1}]),
+        ]
+        response = self.submit({'reports': reports}, '/api/submit/batch/')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([result['status'] for result in body['results']], [200, 200, 409, 400, 400, 200])
+        self.assertEqual((body['accepted'], body['rejected']), (3, 3))
+        self.assertEqual(body['results'][2]['last_sequence'], 2)
+        self.assertEqual(body['results'][3]['error'], "Invalid timestamp: 'bad'")
+        self.assertEqual(body['results'][4]['error'], 'Missing or invalid hostname')
+        self.assertEqual(self.snapshot_pids('2025-01-01T12:03:00Z'), [2, 3])
+        self.assertEqual(Host.objects.get(hostname='host1').last_sequence, 4)
+        self.assertFalse(Host.objects.filter(hostname='host2').exists())
+
+    def test_batch_delta_on_earlier_single_report(self):
+        self.submit(self.full_report(1, [1, 2]))
+        response = self.submit({'reports': [self.delta_report(2, 1, removed=[{'pid': 2}])]}, '/api/submit/batch/')
+        self.assertEqual(response.json()['results'][0]['status'], 200)
+        self.assertEqual(self.snapshot_pids('2025-01-01T12:01:00Z'), [1])
+
+
+class BatchHostTests(SubmitTestCase):
+    def test_long_username_does_not_reject_the_batch(self):
+        reports = [
+            make_report('host1', processes=[make_process(1, username='u' * 300)]),
+            make_report('host2', processes=[make_process(1)]),
+        ]
+        response = self.submit({'reports': reports}, '/api/submit/batch/')
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 200])
+        self.assertEqual(self.latest_processes('host1')[1]['username'], 'u' * 255)
+
+    def test_host_with_only_rejected_reports_is_not_created(self):
+        reports = [
+            make_report('host1', processes=[make_process(1)]),
+            make_report('host2', processes='junk'),
+        ]
+        response = self.submit({'reports': reports}, '/api/submit/batch/')
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 400])
+        self.assertEqual(list(Host.objects.values_list('hostname', flat=True)), ['host1'])
+        self.assertEqual(self.client.get('/api/status/').json()['total_hosts'], 1)
+
+    def test_new_host_full_then_delta_in_one_batch(self):
+        reports = [
+            make_report('host1', mode='full', sequence=1, processes=[make_process(1), make_process(2)],
+                        inventory={'operating_system': 'Linux', 'processor': 'cpu',
+                                   'processor_cores': 2, 'processor_threads': 4}),
+            make_report('host1', timestamp='2025-01-01T12:01:00Z', mode='delta', sequence=2,
+                        baseline_sequence=1, added=[make_process(3)], changed=[], removed=[{'pid': 2}]),
+        ]
+        response = self.submit({'reports': reports}, '/api/submit/batch/')
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 200])
+        host = Host.objects.get(hostname='host1')
+        self.assertEqual(host.last_sequence, 2)
+        self.assertEqual(host.inventory.operating_system, 'Linux')
+        self.assertEqual(sorted(self.latest_processes()), [1, 3])
+        self.assertEqual(host.baseline_process_snapshot, host.snapshots.first())
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class RetentionTests(SubmitTestCase):
+    # Snapshots from 2025-01-01; "now" is far enough ahead that all raw data has expired
+    NOW = utc(2025, 1, 20, 0, 30)
+
+    def setUp(self):
+        for timestamp, cpu, ram in (
+            ('2025-01-01T10:05:00Z', 1.0, 2.0),
+            ('2025-01-01T10:35:00Z', 3.0, 4.0),
+            ('2025-01-01T11:05:00Z', 5.0, 6.0),
+        ):
+            report = make_report(timestamp=timestamp, processes=[
+                make_process(1, cpu_percent=cpu), make_process(2, cpu_percent=cpu)
+            ])
+            report['system_info']['ram_used_gb'] = ram
+            self.assertEqual(self.submit(report).status_code, 200)
+        self.host = Host.objects.get(hostname='host1')
+
+    def rollups(self, resolution):
+        return {rollup.bucket: rollup for rollup in HostRollup.objects.filter(resolution=resolution)}
+
+    def test_hourly_rollups(self):
+        stats = run_retention(now=self.NOW, max_batches=0)
+        self.assertEqual(stats['hourly_rollups'], 2)
+        rollups = self.rollups(HostRollup.RESOLUTION_HOUR)
+        self.assertEqual(sorted(rollups), [utc(2025, 1, 1, 10), utc(2025, 1, 1, 11)])
+        ten = rollups[utc(2025, 1, 1, 10)]
+        self.assertEqual((ten.snapshot_count, ten.system_count), (2, 2))
+        self.assertEqual((ten.avg_process_count, ten.max_process_count), (2.0, 2))
+        # cpu and memory are per-snapshot totals over all processes
+        self.assertEqual((ten.avg_cpu_percent, ten.max_cpu_percent), (4.0, 6.0))
+        self.assertEqual((ten.avg_memory_mb, ten.max_memory_mb), (20.0, 20.0))
+        self.assertEqual((ten.avg_ram_used_gb, ten.max_ram_used_gb), (3.0, 4.0))
+
+    def test_daily_rollups_weight_hours_by_snapshot_count(self):
+        stats = run_retention(now=self.NOW, max_batches=0)
+        self.assertEqual(stats['daily_rollups'], 1)
+        day = self.rollups(HostRollup.RESOLUTION_DAY)[utc(2025, 1, 1)]
+        self.assertEqual(day.snapshot_count, 3)
+        self.assertEqual((day.avg_cpu_percent, day.max_cpu_percent), (6.0, 10.0))
+        self.assertEqual((day.avg_ram_used_gb, day.max_ram_used_gb), (4.0, 6.0))
+
+    def test_rerun_does_not_double_count(self):
+        run_retention(now=self.NOW, max_batches=0)
+        run_retention(now=self.NOW, max_batches=0)
+        self.assertEqual(self.rollups(HostRollup.RESOLUTION_HOUR)[utc(2025, 1, 1, 10)].snapshot_count, 2)
+        self.assertEqual(self.rollups(HostRollup.RESOLUTION_DAY)[utc(2025, 1, 1)].snapshot_count, 3)
+
+    def test_incomplete_hour_is_not_rolled_up(self):
+        run_retention(now=utc(2025, 1, 1, 11, 30), rollup=True, max_batches=0)
+        self.assertEqual(sorted(self.rollups(HostRollup.RESOLUTION_HOUR)), [utc(2025, 1, 1, 10)])
+        self.assertEqual(self.rollups(HostRollup.RESOLUTION_DAY), {})
+
+    def test_expired_snapshots_are_deleted_in_batches(self):
+        stats = run_retention(now=self.NOW, batch_size=2, max_batches=1, rollup=False)
+        # One batch of the two oldest snapshots, their processes, and two system snapshots
+        self.assertEqual(stats['deleted'], {
+            Process._meta.label: 4, ProcessSnapshot._meta.label: 2, SystemSnapshot._meta.label: 2
+        })
+        self.assertEqual(list(ProcessSnapshot.objects.values_list('timestamp', flat=True)), [utc(2025, 1, 1, 11, 5)])
+        self.assertEqual(Process.objects.count(), 2)
+        run_retention(now=self.NOW, batch_size=2, rollup=False)
+        self.assertFalse(ProcessSnapshot.objects.exists())
+        self.assertFalse(Process.objects.exists())
+        self.assertFalse(SystemSnapshot.objects.exists())
+
+    def test_recent_snapshots_are_kept(self):
+        run_retention(now=utc(2025, 1, 8, 10, 30), batch_size=1)
+        self.assertEqual(
+            list(ProcessSnapshot.objects.order_by('timestamp').values_list('timestamp', flat=True)),
+            [utc(2025, 1, 1, 10, 35), utc(2025, 1, 1, 11, 5)]
+        )
+
+    def test_expired_rollups_are_deleted(self):
+        run_retention(now=self.NOW)
+        with self.settings(PROCESS_MONITOR_RETENTION={'hour': 30, 'day': None}):
+            stats = run_retention(now=utc(2025, 2, 15))
+        self.assertEqual(stats['deleted'], {f'{HostRollup._meta.label}.hour': 2})
+        self.assertEqual(HostRollup.objects.filter(resolution=HostRollup.RESOLUTION_DAY).count(), 1)
+
+    def test_rollups_endpoint(self):
+        run_retention(now=self.NOW, max_batches=0)
+        url = f'/api/hosts/{self.host.id}/rollups/'
+        body = self.client.get(url).json()
+        self.assertEqual((body['hostname'], body['resolution']), ('host1', 'hour'))
+        self.assertEqual(
+            [rollup['bucket'] for rollup in body['rollups']],
+            ['2025-01-01T11:00:00+00:00', '2025-01-01T10:00:00+00:00']
+        )
+        self.assertEqual(body['rollups'][1]['avg_cpu_percent'], 4.0)
+        body = self.client.get(url, {'resolution': 'day'}).json()
+        self.assertEqual([rollup['snapshot_count'] for rollup in body['rollups']], [3])
+        self.assertEqual(len(self.client.get(url, {'limit': 1}).json()['rollups']), 1)
+        self.assertEqual(self.client.get(url, {'resolution': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/hosts/999/rollups/').status_code, 404)
+
+
+class OrphanIdentityTests(SubmitTestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.long_ago = utc_today() - timedelta(days=30)
+
+    def submit_pids(self, pids):
+        self.submit(make_report(timestamp=self.now.isoformat(), processes=[make_process(pid) for pid in pids]))
+
+    def test_only_identities_unseen_for_the_raw_window_are_deleted(self):
+        self.submit_pids([1, 2])
+        ProcessIdentity.objects.update(last_seen=self.long_ago)
+        ProcessSnapshot.objects.all().delete()
+        # pid 2 is resolved again (and so marked seen) by a newer report
+        self.submit_pids([2])
+        Process.objects.all().delete()
+        stats = run_retention(now=self.now, rollup=False)
+        self.assertEqual(stats['deleted'].get(ProcessIdentity._meta.label), 1)
+        remaining = ProcessIdentity.objects.get()
+        self.assertEqual((remaining.pid, remaining.last_seen), (2, utc_today()))
+
+    def test_referenced_identities_are_kept(self):
+        self.submit_pids([1, 2])
+        ProcessIdentity.objects.update(last_seen=self.long_ago)
+        run_retention(now=self.now, rollup=False)
+        self.assertEqual(ProcessIdentity.objects.count(), 2)
+
+    def test_orphans_are_deleted_a_page_at_a_time(self):
+        self.submit_pids(range(1, 8))
+        ProcessIdentity.objects.update(last_seen=self.long_ago)
+        # pid 4 is still referenced, in the middle of the id range
+        Process.objects.exclude(pid=4).delete()
+        with mock.patch.object(retention, 'IDENTITY_DELETE_BATCH_SIZE', 2):
+            stats = run_retention(now=self.now, rollup=False, max_batches=2)
+            self.assertEqual(stats['deleted'][ProcessIdentity._meta.label], 4)
+            self.assertEqual(ProcessIdentity.objects.count(), 3)
+            stats = run_retention(now=self.now, rollup=False)
+        self.assertEqual(stats['deleted'][ProcessIdentity._meta.label], 2)
+        self.assertEqual(list(ProcessIdentity.objects.values_list('pid', flat=True)), [4])
+
+
+@override_settings(PROCESS_MONITOR_RESPONSE_CACHE={'BACKEND': 'memory'})
+class ResponseCacheTests(SubmitTestCase):
+    def setUp(self):
+        self.submit(make_report(processes=[make_process(1), make_process(2)]))
+        self.host = Host.objects.get(hostname='host1')
+        self.url = f'/api/hosts/{self.host.id}/processes/latest/'
+
+    def test_etag_revalidation(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=header)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_cached_body_is_served_until_a_submission_invalidates_it(self):
+        first = self.client.get(self.url)
+        cache = get_response_cache()
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(self.client.get(self.url).content, first.content)
+        self.assertEqual(cache.stats()['hits'], 1)
+        # Another host's report leaves this host's entries alone
+        self.submit(make_report(hostname='host2', processes=[make_process(1)]))
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.submit(make_report(timestamp='2025-01-01T12:01:00Z', processes=[make_process(3)]))
+        self.assertEqual(cache.stats()['entries'], 0)
+        second = self.client.get(self.url)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual([proc['pid'] for proc in second.json()['processes']], [3])
+
+    def test_batch_submission_invalidates_accepted_hosts_and_the_host_list(self):
+        self.client.get(self.url)
+        self.client.get('/api/hosts/')
+        cache = get_response_cache()
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.submit({'reports': [make_report(hostname='host2', processes=[make_process(1)])]}, '/api/submit/batch/')
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.submit({'reports': [make_report(timestamp='2025-01-01T12:01:00Z', processes=[])]}, '/api/submit/batch/')
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_backend_follows_the_setting(self):
+        self.assertIsInstance(get_response_cache(), MemoryCache)
+        self.assertIs(get_response_cache(), get_response_cache())
+        with override_settings(PROCESS_MONITOR_RESPONSE_CACHE={'BACKEND': 'none'}):
+            self.assertIsInstance(get_response_cache(), NullCache)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertIsInstance(get_response_cache(), MemoryCache)
+
+    def test_memory_cache_is_bounded_by_bytes(self):
+        cache = MemoryCache(max_bytes=10)
+        cache.set('1:a', b'x' * 11)
+        self.assertIsNone(cache.get('1:a'))
+        cache.set('1:a', b'a' * 4)
+        cache.set('1:b', b'b' * 4)
+        cache.get('1:a')
+        # 1:b is the least recently used entry
+        cache.set('2:c', b'c' * 4)
+        self.assertEqual((cache.get('1:b'), cache.get('1:a'), cache.size), (None, b'aaaa', 8))
+        cache.set('1:a', b'a' * 6)
+        self.assertEqual(cache.size, 10)
+        cache.invalidate_host(1)
+        self.assertEqual((list(cache.entries), cache.size), (['2:c'], 4))
+
+    def test_file_cache_is_bounded_by_bytes(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache = FileCache(location, max_bytes=10)
+            cache.set('1:a', b'x' * 11)
+            self.assertIsNone(cache.get('1:a'))
+            cache.set('1:a', b'a' * 4)
+            cache.set('1:b', b'b' * 4)
+            # Explicit mtimes, so 1:b is the least recently used file
+            os.utime(cache._path('1:a'), (2, 2))
+            os.utime(cache._path('1:b'), (1, 1))
+            cache.set('2:c', b'c' * 4)
+            self.assertEqual(cache.stats()['bytes'], 8)
+            self.assertEqual((cache.get('1:b'), cache.get('1:a'), cache.get('2:c')), (None, b'aaaa', b'cccc'))
+            cache.invalidate_host(2)
+            self.assertEqual(cache.stats()['entries'], 1)
+
+
+class StatusCounterTests(SubmitTestCase):
+    def totals(self):
+        totals = status_counters()
+        return {field: totals[field] for field in ('hosts', 'process_snapshots', 'system_snapshots', 'processes')}
+
+    def exact_totals(self):
+        return {
+            'hosts': Host.objects.count(),
+            'process_snapshots': ProcessSnapshot.objects.count(),
+            'system_snapshots': SystemSnapshot.objects.count(),
+            'processes': Process.objects.count(),
+        }
+
+    def test_counters_follow_ingest(self):
+        self.submit(make_report(processes=[make_process(1), make_process(2)]))
+        self.assertEqual(self.totals(), {'hosts': 1, 'process_snapshots': 1, 'system_snapshots': 1, 'processes': 2})
+        self.submit({'reports': [
+            make_report(timestamp='2025-01-01T12:01:00Z', processes=[make_process(1)]),
+            make_report(hostname='host2', processes=[make_process(1)]),
+            make_report(hostname='host3', processes='bad'),
+        ]}, '/api/submit/batch/')
+        self.submit(make_report(hostname='host4', processes=[{'name': 'no pid'}]))
+        self.assertEqual(self.totals(), self.exact_totals())
+        body = self.client.get('/api/status/').json()
+        self.assertEqual((body['total_hosts'], body['total_snapshots'], body['total_processes']), (2, 3, 4))
+
+    def test_counters_follow_retention(self):
+        now = timezone.now()
+        self.submit(make_report(timestamp=(now - timedelta(days=30)).isoformat(), processes=[make_process(1)]))
+        self.submit(make_report(timestamp=now.isoformat(), processes=[make_process(1), make_process(2)]))
+        run_retention(now=now, rollup=False)
+        self.assertEqual(self.totals(), {'hosts': 1, 'process_snapshots': 1, 'system_snapshots': 1, 'processes': 2})
+        self.assertEqual(self.totals(), self.exact_totals())
+
+    def test_reconcile_corrects_drift(self):
+        self.submit(make_report(processes=[make_process(1), make_process(2)]))
+        # Deleted outside retention, so the counters miss it
+        Process.objects.filter(pid=2).delete()
+        Host.objects.create(hostname='host2')
+        self.assertEqual(reconcile_counters(), {'hosts': 1, 'process_snapshots': 0, 'system_snapshots': 0, 'processes': -1})
+        self.assertEqual(self.totals(), self.exact_totals())
+        self.assertIsNotNone(status_counters()['reconciled_at'])
+        self.assertEqual(reconcile_counters(), {'hosts': 0, 'process_snapshots': 0, 'system_snapshots': 0, 'processes': 0})
+
+    def test_scheduler_reconciles_on_its_interval(self):
+        scheduler = RetentionScheduler(interval=60, reconcile_interval=3600)
+        with mock.patch.object(retention, 'reconcile_counters') as reconcile, \
+                mock.patch.object(retention.time, 'monotonic') as monotonic:
+            for now in (1000, 1060, 4599, 4600):
+                monotonic.return_value = now
+                scheduler.run_once()
+        self.assertEqual(reconcile.call_count, 2)
+
+
+class PartitionKeyTests(SubmitTestCase):
+    # Reads of Process rows filter on `day`, so partitioned tables scan one partition
+    def assert_process_queries_use_day(self, queries):
+        table = Process._meta.db_table
+        process_queries = [query['sql'] for query in queries if f'FROM "{table}"' in query['sql']]
+        self.assertTrue(process_queries)
+        for sql in process_queries:
+            self.assertIn(f'"{table}"."day"', sql)
+
+    def test_host_summaries_filter_on_day(self):
+        self.submit(make_report('host1', processes=[make_process(1), make_process(2)]))
+        self.submit(make_report('host2', timestamp='2025-01-03T12:00:00Z', processes=[make_process(1)]))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/hosts/?summary=1')
+        self.assertEqual(response.status_code, 200)
+        counts = {
+            host['hostname']: host['latest_process_snapshot']['process_count']
+            for host in response.json()['results']
+        }
+        self.assertEqual(counts, {'host1': 2, 'host2': 1})
+        self.assert_process_queries_use_day(queries.captured_queries)
+
+    def test_delta_baseline_filters_on_day(self):
+        self.submit(make_report(mode='full', sequence=1, processes=[make_process(1)]))
+        delta = make_report(
+            timestamp='2025-01-01T12:01:00Z', mode='delta', sequence=2, baseline_sequence=1,
+            added=[make_process(2)], changed=[], removed=[]
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.submit(delta).status_code, 200)
+        baseline_queries = [query for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assert_process_queries_use_day(baseline_queries)
+
+
+class PartitionDayTests(SubmitTestCase):
+    def test_partition_day_counts_utc_days(self):
+        self.assertEqual(partition_day(utc(1970, 1, 1)), 0)
+        self.assertEqual(partition_day(utc(2025, 1, 1)), 20089)
+        self.assertEqual(partition_day(utc(2025, 1, 1, 23, 59, 59)), 20089)
+        # Local midnight two hours east of UTC is still the previous UTC day
+        east = dt_timezone(timedelta(hours=2))
+        self.assertEqual(partition_day(datetime(2025, 1, 1, 1, tzinfo=east)), 20088)
+        self.assertEqual(day_start(20089), utc(2025, 1, 1))
+
+    def test_snapshot_filters_use_the_day(self):
+        self.submit(make_report(timestamp='2025-01-01T23:59:00Z', processes=[make_process(1), make_process(2)]))
+        self.submit(make_report(timestamp='2025-01-02T00:01:00Z', processes=[make_process(3)]))
+        late, early = ProcessSnapshot.objects.order_by('-timestamp')
+        self.assertEqual(
+            set(Process.objects.values_list('info_id', 'day')),
+            {(early.id, 20089), (late.id, 20090)}
+        )
+        self.assertEqual(sorted(Process.objects.in_snapshot(early).values_list('pid', flat=True)), [1, 2])
+        self.assertEqual(Process.objects.in_snapshots([early, late]).count(), 3)
+        # between() is half-open on the snapshot timestamp
+        self.assertEqual(list(Process.objects.between(utc(2025, 1, 2), utc(2025, 1, 3)).values_list('pid', flat=True)), [3])
+        self.assertEqual(Process.objects.between(utc(2025, 1, 1), utc(2025, 1, 2, 0, 1)).count(), 2)
+        self.assertIn('"day"', str(Process.objects.between(utc(2025, 1, 1), utc(2025, 1, 2)).query))
+
+    def test_unpartitioned_retention_deletes_in_batches(self):
+        now = utc(2025, 1, 20)
+        for day in (1, 2, 3):
+            self.submit(make_report(timestamp=utc(2025, 1, day).isoformat(), processes=[make_process(day)]))
+        self.submit(make_report(timestamp=now.isoformat(), processes=[make_process(4)]))
+        with mock.patch.object(retention, 'drop_expired_partitions') as drop:
+            stats = run_retention(now=now, batch_size=1, rollup=False, max_batches=2)
+            self.assertEqual(stats['deleted'][ProcessSnapshot._meta.label], 2)
+            self.assertEqual(stats['deleted'][Process._meta.label], 2)
+            run_retention(now=now, batch_size=1, rollup=False)
+        drop.assert_not_called()
+        self.assertEqual(list(Process.objects.values_list('pid', flat=True)), [4])
+
+
+class QueuedSubmitTests(SubmitTestCase):
+    # The writers are not started: tests drain the queues on the test thread, so the
+    # writes run inside the test transaction
+    def setUp(self):
+        self.queue = IngestQueue(workers=2, max_size=10, batch_size=2)
+        patcher = mock.patch('process_monitor.views.get_ingest_queue', return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def submit_queued(self, report):
+        return self.submit(report, '/api/submit/queued/')
+
+    def drain(self):
+        for reports in self.queue.queues:
+            while not reports.empty():
+                self.queue._write(self.queue._take(reports))
+
+    def test_accepted_reports_are_written_by_the_writers(self):
+        response = self.submit_queued(make_report(processes=[make_process(1), make_process(2)]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['processes_count'], 2)
+        self.assertEqual(response.json()['queue_depth'], 1)
+        self.assertFalse(Host.objects.exists())
+        self.drain()
+        self.assertEqual(sorted(self.latest_processes()), [1, 2])
+        self.assertEqual(self.queue.metrics()['written'], 1)
+
+    def test_full_queue_answers_429_with_retry_after(self):
+        self.queue = IngestQueue(workers=1, max_size=1)
+        with mock.patch('process_monitor.views.get_ingest_queue', return_value=self.queue):
+            self.assertEqual(self.submit_queued(make_report(processes=[])).status_code, 202)
+            # Recent writes took 1.5 s per report, so one queued report drains in 2 s
+            self.queue.writes.append((2, 3000.0, 0.0))
+            response = self.submit_queued(make_report(hostname='host2', processes=[]))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['retry_after'], 2)
+        self.assertEqual(self.queue.metrics()['rejected'], 1)
+
+    def test_reports_of_a_host_are_written_in_order(self):
+        for sequence in (1, 2, 3):
+            timestamp = f'2025-01-01T12:0{sequence}:00Z'
+            self.submit_queued(make_report(timestamp=timestamp, sequence=sequence, processes=[make_process(sequence)]))
+        self.submit_queued(make_report(hostname='host2', processes=[]))
+        queued = [
+            [report['sequence'] for _, report in reports.queue if report['hostname'] == 'host1']
+            for reports in self.queue.queues
+        ]
+        self.assertIn([1, 2, 3], queued)
+        self.drain()
+        host = Host.objects.get(hostname='host1')
+        self.assertEqual(host.last_sequence, 3)
+        self.assertEqual(host.baseline_process_snapshot, host.latest_process_snapshot)
+        self.assertEqual(
+            list(Process.objects.order_by('id').values_list('info__timestamp__minute', flat=True)), [1, 2, 3]
+        )
+
+    def test_delta_reports_are_rejected(self):
+        delta = make_report(mode='delta', sequence=2, baseline_sequence=1, added=[], changed=[], removed=[])
+        response = self.submit_queued(delta)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('/api/submit/', response.json()['error'])
+        self.assertEqual(self.queue.depth(), 0)
+
+
+class APIKeyCacheTests(SubmitTestCase):
+    def setUp(self):
+        self.key = APIKey.objects.create(key='k' * 40, name='agent1')
+        self.cache = APIKeyCache(ttl=60, negative_ttl=10, negative_max_size=2, flush_interval=60)
+        self.now = 1000.0
+        self.cache.last_flush = self.now
+        for patcher in (
+            mock.patch.object(authentication, '_cache', self.cache),
+            mock.patch.object(authentication.time, 'monotonic', lambda: self.now),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_active_keys_are_trusted_for_the_ttl(self):
+        entry = self.cache.lookup(self.key.key)
+        self.assertEqual(entry, CachedKey(self.key.id, 'agent1'))
+        # Revoked without a signal, as another server process would
+        APIKey.objects.filter(id=self.key.id).update(is_active=False)
+        self.now += 59
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.lookup(self.key.key), entry)
+        self.now += 1
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.lookup(self.key.key))
+
+    def test_rejected_keys_are_cached_and_bounded(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.lookup('unknown'))
+            self.assertIsNone(self.cache.lookup('unknown'))
+        self.now += 10
+        with self.assertNumQueries(1):
+            self.cache.lookup('unknown')
+        self.cache.lookup('unknown2')
+        self.cache.lookup('unknown3')
+        self.assertEqual(list(self.cache.rejected), ['unknown2', 'unknown3'])
+        # A key created since it was rejected works once the negative entry expires
+        APIKey.objects.create(key='unknown2', name='agent2')
+        self.now += 10
+        self.assertEqual(self.cache.lookup('unknown2').name, 'agent2')
+
+    def test_saving_or_deleting_a_key_drops_its_entry(self):
+        self.cache.lookup(self.key.key)
+        self.key.is_active = False
+        self.key.save()
+        self.assertIsNone(self.cache.lookup(self.key.key))
+        self.key.is_active = True
+        self.key.save()
+        self.assertIsNotNone(self.cache.lookup(self.key.key))
+        self.key.delete()
+        self.assertIsNone(self.cache.lookup(self.key.key))
+
+    def test_last_used_is_flushed_in_one_update(self):
+        other = APIKey.objects.create(key='o' * 40, name='agent2')
+        entries = [self.cache.lookup(self.key.key), self.cache.lookup(other.key)]
+        with self.assertNumQueries(0):
+            for entry in entries * 2:
+                self.cache.touch(entry)
+        self.assertFalse(APIKey.objects.filter(last_used__isnull=False).exists())
+        self.now += 60
+        with self.assertNumQueries(1):
+            # The first touch after the interval flushes both keys
+            self.cache.touch(entries[0])
+            self.assertEqual(self.cache.flush_last_used(), 0)
+        self.assertEqual(APIKey.objects.filter(last_used__isnull=False).count(), 2)
+
+    @override_settings(PROCESS_MONITOR_API_KEYS={'REQUIRED': True})
+    def test_required_keys_guard_every_submit_path(self):
+        report = make_report(processes=[make_process(1)])
+        for path in ('/api/submit/', '/api/submit/batch/', '/api/submit/queued/'):
+            body = {'reports': [report]} if path.endswith('batch/') else report
+            for key in (None, 'wrong'):
+                headers = {'HTTP_X_API_KEY': key} if key else {}
+                response = self.client.post(path, body, content_type='application/json', **headers)
+                self.assertEqual(response.status_code, 401, (path, key))
+                self.assertEqual(response['WWW-Authenticate'], 'X-API-Key')
+        response = self.client.post('/api/submit/', report, content_type='application/json', HTTP_X_API_KEY=self.key.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Host.objects.exclude(hostname='host1').exists())
+
+
+class DeltaExtendedMetricsTests(SubmitTestCase):
+    def test_unchanged_process_keeps_extended_metrics(self):
+        # Extended metrics alone do not make a process "changed": the backend keeps
+        # the values of the last entry the agent sent until it changes or is resynced
+        full = [
+            make_process(1, num_threads=4, voluntary_ctx_switches_per_sec=10.0),
+            make_process(2, num_threads=2, voluntary_ctx_switches_per_sec=3.0),
+        ]
+        self.assertEqual(self.submit(make_report(mode='full', sequence=1, processes=full)).status_code, 200)
+        delta = make_report(
+            timestamp='2025-01-01T12:01:00Z', mode='delta', sequence=2, baseline_sequence=1,
+            added=[], removed=[],
+            changed=[make_process(2, cpu_percent=20.0, num_threads=8, voluntary_ctx_switches_per_sec=50.0)]
+        )
+        self.assertEqual(self.submit(delta).status_code, 200)
+        host = Host.objects.get(hostname='host1')
+        processes = {
+            row['pid']: row
+            for row in Process.objects.in_snapshot(host.latest_process_snapshot).identity_values(
+                'pid', 'num_threads', 'voluntary_ctx_switches_per_sec'
+            )
+        }
+        self.assertEqual(processes[1]['num_threads'], 4)
+        self.assertEqual(processes[1]['voluntary_ctx_switches_per_sec'], 10.0)
+        self.assertEqual(processes[2]['num_threads'], 8)
+        self.assertEqual(processes[2]['voluntary_ctx_switches_per_sec'], 50.0)
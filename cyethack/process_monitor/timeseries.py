@@ -0,0 +1,109 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Min, Window
+from django.db.models.functions import Ceil, RowNumber, TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Process, ProcessIdentity, SystemSnapshot
+
+# Bucket width name -> (truncation, seconds); 'auto' picks the finest within the point limit
+BUCKETS = {
+    'minute': (TruncMinute, 60),
+    'hour': (TruncHour, 3600),
+    'day': (TruncDay, 86400),
+}
+SYSTEM_METRICS = ('cpu_percent', 'ram_used_gb', 'ram_available_gb', 'ram_total_gb', 'storage_used_gb', 'storage_free_gb')
+PROCESS_METRICS = ('cpu_percent', 'memory_mb', 'memory_percent')
+PERCENTILE = 0.95
+DEFAULT_RANGE = timedelta(hours=24)
+DEFAULT_MAX_POINTS = 2000
+
+
+def get_max_points():
+    return getattr(settings, 'PROCESS_MONITOR_TIMESERIES_MAX_POINTS', DEFAULT_MAX_POINTS)
+
+
+def parse_datetime_param(params, name, default):
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"'{name}' must be an ISO 8601 datetime")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_range(params):
+    # (start, end, bucket) from ?start=&end=&bucket=, defaulting to the last 24 hours
+    end = parse_datetime_param(params, 'end', timezone.now())
+    start = parse_datetime_param(params, 'start', end - DEFAULT_RANGE)
+    if start >= end:
+        raise ValueError("'start' must be before 'end'")
+    bucket = params.get('bucket') or 'auto'
+    max_points = get_max_points()
+    seconds = (end - start).total_seconds()
+    if bucket == 'auto':
+        bucket = next((name for name, (_, width) in BUCKETS.items() if seconds / width <= max_points), 'day')
+    if bucket not in BUCKETS:
+        raise ValueError(f"'bucket' must be one of auto, {', '.join(BUCKETS)}")
+    if seconds / BUCKETS[bucket][1] > max_points:
+        raise ValueError(f"Range has more than {max_points} {bucket} buckets, use a wider bucket")
+    return start, end, bucket
+
+
+def bucketed_series(queryset, timestamp_field, value_field, bucket):
+    # Yields {bucket, count, avg, min, max, p95} per bucket, in time order. Both the
+    # grouping and the nearest-rank 95th percentile run in the database.
+    trunc = BUCKETS[bucket][0]
+    p95_rows = (
+        queryset
+        .annotate(
+            bucket=trunc(timestamp_field),
+            rank=Window(RowNumber(), partition_by=[trunc(timestamp_field)], order_by=F(value_field).asc()),
+            total=Window(Count('pk'), partition_by=[trunc(timestamp_field)])
+        )
+        .filter(rank=Ceil(F('total') * PERCENTILE))
+        .values_list('bucket', value_field)
+        .order_by()
+    )
+    p95 = dict(p95_rows)
+    stats = (
+        queryset
+        .annotate(bucket=trunc(timestamp_field))
+        .values('bucket')
+        .annotate(count=Count('pk'), avg=Avg(value_field), min=Min(value_field), max=Max(value_field))
+        .order_by('bucket')
+    )
+    for row in stats.iterator():
+        row['p95'] = p95.get(row['bucket'])
+        row['bucket'] = row['bucket'].isoformat()
+        yield row
+
+
+def host_metric_series(host, metric, start, end, bucket):
+    snapshots = SystemSnapshot.objects.filter(
+        host=host, timestamp__gte=start, timestamp__lt=end, **{f'{metric}__isnull': False}
+    )
+    return bucketed_series(snapshots, 'timestamp', metric, bucket)
+
+
+def process_queryset(host, start, end, name=None, pid=None, created_time=None):
+    # Samples of the processes matching a name, or a pid (optionally with its creation
+    # time, to tell reused pids apart); every match in every snapshot is one sample
+    # Matching identities come first, so the scan starts from their few Process rows rather
+    # than from every process of every snapshot in the range
+    identities = ProcessIdentity.objects.filter(host=host)
+    if name is not None:
+        identities = identities.filter(name=name)
+    if pid is not None:
+        identities = identities.filter(pid=pid)
+    if created_time is not None:
+        identities = identities.filter(created_time=created_time)
+    return Process.objects.between(start, end).filter(identity__in=identities.values('id'))
+
+
+def process_metric_series(host, metric, start, end, bucket, **match):
+    return bucketed_series(process_queryset(host, start, end, **match), 'info__timestamp', metric, bucket)
+
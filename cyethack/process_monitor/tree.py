@@ -0,0 +1,127 @@
+from collections import defaultdict
+from .models import EXTENDED_FIELDS, Process, ProcessSnapshot
+
+PROCESS_FIELDS = (
+    'id', 'name', 'pid', 'parent_pid', 'cpu_percent', 'memory_mb',
+    'status', 'username', 'command_line', 'created_time', *EXTENDED_FIELDS
+)
+
+
+def _get(proc, field):
+    if isinstance(proc, dict):
+        return proc.get(field)
+    return getattr(proc, field)
+
+
+def serialize_process(proc):
+    created_time = _get(proc, 'created_time')
+    return {
+        'id': _get(proc, 'id'),
+        'name': _get(proc, 'name'),
+        'pid': _get(proc, 'pid'),
+        'parent_pid': _get(proc, 'parent_pid'),
+        'cpu_percent': _get(proc, 'cpu_percent'),
+        'memory_mb': _get(proc, 'memory_mb'),
+        'status': _get(proc, 'status'),
+        'username': _get(proc, 'username') or '',
+        'command_line': _get(proc, 'command_line') or '',
+        'created_time': created_time.isoformat() if created_time else None,
+        **{field: _get(proc, field) for field in EXTENDED_FIELDS}
+    }
+
+
+def serialize_omitted(snapshot):
+    return {
+        'count': snapshot.omitted_count,
+        'cpu_percent': snapshot.omitted_cpu_percent,
+        'memory_mb': snapshot.omitted_memory_mb
+    }
+
+
+class ProcessTree:
+    # Parent -> children index over one snapshot, built in memory from a single query.
+    # Accepts Process instances or dicts from .values().
+    def __init__(self, processes):
+        self.processes = list(processes)
+        self.by_pid = {}
+        self.children = defaultdict(list)
+        for proc in self.processes:
+            self.by_pid[_get(proc, 'pid')] = proc
+        for proc in self.processes:
+            if not self._is_root(proc):
+                self.children[_get(proc, 'parent_pid')].append(proc)
+
+    @classmethod
+    def for_snapshot(cls, snapshot, order_by=None, as_values=True, day=None):
+        # `snapshot` is a ProcessSnapshot, or a snapshot id with the partition `day` of its rows
+        if isinstance(snapshot, ProcessSnapshot):
+            queryset = Process.objects.in_snapshot(snapshot)
+        else:
+            queryset = Process.objects.filter(info_id=snapshot, day=day)
+        if order_by:
+            queryset = queryset.order_by(*order_by)
+        if as_values:
+            queryset = queryset.identity_values(*PROCESS_FIELDS)
+        else:
+            queryset = queryset.with_identity()
+        return cls(queryset)
+
+    def _is_root(self, proc):
+        pid = _get(proc, 'pid')
+        parent_pid = _get(proc, 'parent_pid')
+        return parent_pid is None or parent_pid == pid or parent_pid not in self.by_pid
+
+    def roots(self):
+        return [proc for proc in self.processes if self._is_root(proc)]
+
+    def children_of(self, pid):
+        return self.children.get(pid, [])
+
+    def flat(self, serialize=serialize_process):
+        # Every process with its direct children, the shape script.js consumes
+        result = []
+        for proc in self.processes:
+            info = serialize(proc)
+            info['children'] = [serialize(child) for child in self.children_of(info['pid'])]
+            result.append(info)
+        return result
+
+    def nested(self, serialize=serialize_process):
+        # Root processes with their full descendant hierarchy. Iterative, and each
+        # pid is expanded only once so reused/cyclic parent pids cannot loop.
+        result = []
+        seen = set()
+        stack = []
+        for root in reversed(self.roots()):
+            node = serialize(root)
+            node['children'] = []
+            result.append(node)
+            stack.append((root, node))
+        result.reverse()
+        while stack:
+            proc, node = stack.pop()
+            pid = _get(proc, 'pid')
+            if pid in seen:
+                continue
+            seen.add(pid)
+            for child in self.children_of(pid):
+                child_node = serialize(child)
+                child_node['children'] = []
+                node['children'].append(child_node)
+                stack.append((child, child_node))
+        return result
+
+    def depth(self):
+        # Longest root-to-leaf chain
+        max_depth = 0
+        seen = set()
+        stack = [(root, 1) for root in self.roots()]
+        while stack:
+            proc, level = stack.pop()
+            pid = _get(proc, 'pid')
+            if pid in seen:
+                continue
+            seen.add(pid)
+            max_depth = max(max_depth, level)
+            stack.extend((child, level + 1) for child in self.children_of(pid))
+        return max_depth
@@ -5,8 +5,14 @@ urlpatterns = [
     path('hosts/', views.HostListView.as_view(), name='host_list'),
     path('hosts/<int:host_id>/system/latest/', views.host_system_info, name='host_system_info'),
     path('hosts/<int:host_id>/processes/latest/', views.host_processes_latest, name='host_processes_latest'),
+    path('hosts/<int:host_id>/rollups/', views.host_rollups, name='host_rollups'),
+    path('hosts/<int:host_id>/timeseries/', views.host_timeseries, name='host_timeseries'),
+    path('hosts/<int:host_id>/processes/timeseries/', views.process_timeseries, name='process_timeseries'),
+    path('hosts/<int:host_id>/export/', views.host_export, name='host_export'),
     path('hosts/<str:hostname>/processes/', views.host_processes_by_name, name='host_processes_by_name'),
     path('hosts/<str:hostname>/system/', views.host_system_by_name, name='host_system_by_name'),
     path('status/', views.system_status, name='system_status'),
     path('submit/', views.submit_process_data, name='submit_process_data'),
+    path('submit/batch/', views.submit_batch_data, name='submit_batch_data'),
+    path('submit/queued/', views.submit_process_data_queued, name='submit_process_data_queued'),
 ]
\ No newline at end of file
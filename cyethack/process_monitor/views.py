@@ -1,25 +1,75 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.exceptions import APIException, NotAuthenticated
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.utils import timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Host, ProcessSnapshot, Process, SystemSnapshot
+from django.utils import timezone
+from .models import Host, HostRollup
+from .authentication import API_KEY_HEADER, APIKeyAuthentication, HasAPIKey, api_key_required, authenticate_api_key
+from .counters import heartbeat_stats, ingest_rates, status_counters
+from .ingest import BaselineMismatch, ingest_batch, ingest_payload, validate_report
+from .ingest_queue import get_ingest_queue, ingest_queue_metrics
+from .parsers import parse_request
+from .tree import ProcessTree, serialize_omitted
+from .summary import host_summaries
+from .timeseries import (
+    DEFAULT_RANGE, PROCESS_METRICS, SYSTEM_METRICS, host_metric_series, parse_datetime_param, parse_range,
+    process_metric_series
+)
+from .streaming import export_ndjson, stream_json, stream_latest_processes
+from .response_cache import (
+    ALL_HOSTS, cached_json_response, get_response_cache, hosts_fingerprint, not_modified, response_key, set_validators
+)
 import logging
-from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
+HOST_SUMMARY_PAGE_SIZE = 50
+HOST_SUMMARY_MAX_PAGE_SIZE = 500
+HOST_SUMMARY_TOP_N = 5
+HOST_SUMMARY_MAX_TOP_N = 50
+HOST_ROLLUP_LIMIT = 168
+HOST_ROLLUP_MAX_LIMIT = 5000
+
+def _int_param(request, name, default, minimum=0, maximum=None):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+    if value < minimum:
+        raise ValueError(f"'{name}' must be at least {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"'{name}' must be at most {maximum}")
+    return value
+
 class HostListView(APIView):
-    # Returns all hosts with their latest process snapshot
+    # Returns all hosts with their latest process snapshot,
+    # or a keyset-paginated summary page with ?summary=1
     permission_classes = [AllowAny]
     
     def get(self, request):
-        hosts = Host.objects.all()
+        if request.query_params.get('summary') in ('1', 'true'):
+            return self.get_summary(request)
+        hosts = list(Host.objects.select_related('latest_process_snapshot').order_by('id'))
+        fingerprint = hosts_fingerprint([
+            (host.id, host.hostname, host.ip_address, host.created_at, host.last_seen, host.latest_process_snapshot_id)
+            for host in hosts
+        ])
+        key = response_key(ALL_HOSTS, 'hosts', fingerprint)
+        return cached_json_response(request, key, lambda: self.build_host_list(hosts))
+
+    def build_host_list(self, hosts):
         host_data = []
         for host in hosts:
-            latest_snapshot = host.snapshots.first()
+            latest_snapshot = host.latest_process_snapshot
             host_info = {
                 'id': host.id,
                 'hostname': host.hostname,
@@ -30,58 +80,51 @@ class HostListView(APIView):
                 'latest_process_snapshot': None
             }
             if latest_snapshot:
-                processes = latest_snapshot.processes.all()
-                process_data = []
-                for proc in processes:
-                    process_info = {
-                        'id': proc.id,
-                        'name': proc.name,
-                        'pid': proc.pid,
-                        'parent_pid': proc.parent_pid,
-                        'cpu_percent': proc.cpu_percent,
-                        'memory_mb': proc.memory_mb,
-                        'status': proc.status,
-                        'username': proc.username or '',
-                        'command_line': proc.command_line or '',
-                        'children': []
-                    }
-                    children = processes.filter(parent_pid=proc.pid)
-                    for child in children:
-                        process_info['children'].append({
-                            'id': child.id,
-                            'name': child.name,
-                            'pid': child.pid,
-                            'parent_pid': child.parent_pid,
-                            'cpu_percent': child.cpu_percent,
-                            'memory_mb': child.memory_mb,
-                            'status': child.status,
-                            'username': child.username or '',
-                            'command_line': child.command_line or ''
-                        })
-                    process_data.append(process_info)
+                process_data = ProcessTree.for_snapshot(latest_snapshot).flat()
                 host_info['latest_process_snapshot'] = {
                     'id': latest_snapshot.id,
                     'timestamp': latest_snapshot.timestamp.isoformat(),
                     'processes': process_data
                 }
             host_data.append(host_info)
-        return Response(host_data)
+        return host_data
+
+    def get_summary(self, request):
+        try:
+            after = _int_param(request, 'after', None)
+            limit = _int_param(request, 'limit', HOST_SUMMARY_PAGE_SIZE, minimum=1, maximum=HOST_SUMMARY_MAX_PAGE_SIZE)
+            top_n = _int_param(request, 'top', HOST_SUMMARY_TOP_N, maximum=HOST_SUMMARY_MAX_TOP_N)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results, next_after = host_summaries(after=after, limit=limit, top_n=top_n)
+        return Response({
+            'results': results,
+            'next_after': next_after
+        })
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def host_system_info(request, host_id):
     # Returns system info for a specific host
-    host = get_object_or_404(Host, id=host_id)
-    latest_system = host.system_snapshots.first()
+    host = get_object_or_404(Host.objects.select_related('latest_system_snapshot', 'inventory'), id=host_id)
+    # Without a system snapshot the response reports last_seen, so that versions it instead
+    version = host.latest_system_snapshot_id or host.last_seen.isoformat()
+    key = response_key(host.id, 'system', version, host.inventory_id)
+    return cached_json_response(request, key, lambda: _system_info_data(host))
+
+def _system_info_data(host):
+    latest_system = host.latest_system_snapshot
+    inventory = host.inventory
     if latest_system:
         system_info = {
             'id': host.id,
             'hostname': host.hostname,
             'timestamp': latest_system.timestamp.isoformat(),
-            'operating_system': latest_system.operating_system,
-            'processor': latest_system.processor,
-            'processor_cores': latest_system.processor_cores,
-            'processor_threads': latest_system.processor_threads,
+            'operating_system': inventory.operating_system if inventory else 'Unknown',
+            'processor': inventory.processor if inventory else 'Unknown',
+            'processor_cores': inventory.processor_cores if inventory else 'Unknown',
+            'processor_threads': inventory.processor_threads if inventory else 'Unknown',
+            'cpu_percent': latest_system.cpu_percent,
             'ram_total_gb': latest_system.ram_total_gb,
             'ram_used_gb': latest_system.ram_used_gb,
             'ram_available_gb': latest_system.ram_available_gb,
@@ -98,6 +141,7 @@ def host_system_info(request, host_id):
             'processor': 'Unknown',
             'processor_cores': 'Unknown',
             'processor_threads': 'Unknown',
+            'cpu_percent': 'Unknown',
             'ram_total_gb': 'Unknown',
             'ram_used_gb': 'Unknown',
             'ram_available_gb': 'Unknown',
@@ -105,53 +149,144 @@ def host_system_info(request, host_id):
             'storage_used_gb': 'Unknown',
             'storage_free_gb': 'Unknown'
         }
-    return Response(system_info)
+    return system_info
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def host_processes_latest(request, host_id):
     # Returns process snapshot for a specific host
-    host = get_object_or_404(Host, id=host_id)
-    latest_snapshot = host.snapshots.first()
+    host = get_object_or_404(Host.objects.select_related('latest_process_snapshot'), id=host_id)
+    latest_snapshot = host.latest_process_snapshot
     if not latest_snapshot:
         return Response({'error': 'No process data found'}, status=status.HTTP_404_NOT_FOUND)
-    processes = latest_snapshot.processes.all()
-    process_data = []
-    for proc in processes:
-        process_info = {
-            'id': proc.id,
-            'name': proc.name,
-            'pid': proc.pid,
-            'parent_pid': proc.parent_pid,
-            'cpu_percent': proc.cpu_percent,
-            'memory_mb': proc.memory_mb,
-            'status': proc.status,
-            'username': proc.username or '',
-            'command_line': proc.command_line or '',
-            'created_time': proc.created_time.isoformat() if proc.created_time else None,
-            'children': []
-        }
-        children = processes.filter(parent_pid=proc.pid)
-        for child in children:
-            process_info['children'].append({
-                'id': child.id,
-                'name': child.name,
-                'pid': child.pid,
-                'parent_pid': child.parent_pid,
-                'cpu_percent': child.cpu_percent,
-                'memory_mb': child.memory_mb,
-                'status': child.status,
-                'username': child.username or '',
-                'command_line': child.command_line or '',
-                'created_time': child.created_time.isoformat() if child.created_time else None
-            })
-        process_data.append(process_info)
-    response_data = {
-        'id': latest_snapshot.id,
-        'timestamp': latest_snapshot.timestamp.isoformat(),
-        'processes': process_data
+    # ?view=tree returns root processes nested to full depth instead of the flat list;
+    # ?view=stream writes the flat list (without children) as rows are read
+    view = request.query_params.get('view')
+    view = view if view in ('tree', 'stream') else 'flat'
+    key = response_key(host.id, 'processes', latest_snapshot.id, view)
+    if view == 'stream':
+        response = not_modified(request, key)
+        if response is None:
+            response = StreamingHttpResponse(stream_latest_processes(latest_snapshot), content_type='application/json')
+        return set_validators(response, key)
+    return cached_json_response(request, key, lambda: _latest_processes_data(latest_snapshot, view))
+
+def _latest_processes_data(snapshot, view):
+    tree = ProcessTree.for_snapshot(snapshot)
+    return {
+        'id': snapshot.id,
+        'timestamp': snapshot.timestamp.isoformat(),
+        'depth': tree.depth(),
+        'omitted': serialize_omitted(snapshot),
+        'processes': tree.nested() if view == 'tree' else tree.flat()
+    }
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def host_rollups(request, host_id):
+    # Returns hourly (default) or daily aggregates kept after raw snapshots expire
+    host = get_object_or_404(Host, id=host_id)
+    resolution = request.query_params.get('resolution', HostRollup.RESOLUTION_HOUR)
+    if resolution not in dict(HostRollup.RESOLUTION_CHOICES):
+        return Response({'error': f"Unknown resolution '{resolution}'"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = _int_param(request, 'limit', HOST_ROLLUP_LIMIT, minimum=1, maximum=HOST_ROLLUP_MAX_LIMIT)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    rollups = host.rollups.filter(resolution=resolution).order_by('-bucket')[:limit]
+    return Response({
+        'id': host.id,
+        'hostname': host.hostname,
+        'resolution': resolution,
+        'rollups': [
+            {
+                'bucket': rollup.bucket.isoformat(),
+                'snapshot_count': rollup.snapshot_count,
+                'avg_process_count': rollup.avg_process_count,
+                'max_process_count': rollup.max_process_count,
+                'avg_cpu_percent': rollup.avg_cpu_percent,
+                'max_cpu_percent': rollup.max_cpu_percent,
+                'avg_memory_mb': rollup.avg_memory_mb,
+                'max_memory_mb': rollup.max_memory_mb,
+                'avg_ram_used_gb': rollup.avg_ram_used_gb,
+                'max_ram_used_gb': rollup.max_ram_used_gb,
+                'avg_storage_used_gb': rollup.avg_storage_used_gb,
+                'max_storage_used_gb': rollup.max_storage_used_gb
+            }
+            for rollup in rollups
+        ]
+    })
+
+def _series_response(header, points):
+    return StreamingHttpResponse(stream_json(header, points), content_type='application/json')
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def host_timeseries(request, host_id):
+    # Streams a bucketed (count/avg/min/max/p95) series of one system metric of a host
+    host = get_object_or_404(Host, id=host_id)
+    metric = request.query_params.get('metric', 'ram_used_gb')
+    if metric not in SYSTEM_METRICS:
+        return Response({'error': f"'metric' must be one of {', '.join(SYSTEM_METRICS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end, bucket = parse_range(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    header = {
+        'id': host.id,
+        'hostname': host.hostname,
+        'metric': metric,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket
+    }
+    return _series_response(header, host_metric_series(host, metric, start, end, bucket))
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def process_timeseries(request, host_id):
+    # Streams a bucketed series of one metric of the processes matching ?name= or ?pid= (&created_time=)
+    host = get_object_or_404(Host, id=host_id)
+    params = request.query_params
+    metric = params.get('metric', 'cpu_percent')
+    if metric not in PROCESS_METRICS:
+        return Response({'error': f"'metric' must be one of {', '.join(PROCESS_METRICS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not params.get('name') and not params.get('pid'):
+        return Response({'error': "Either 'name' or 'pid' is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end, bucket = parse_range(params)
+        pid = _int_param(request, 'pid', None)
+        created_time = parse_datetime_param(params, 'created_time', None)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    match = {'name': params.get('name') or None, 'pid': pid, 'created_time': created_time}
+    header = {
+        'id': host.id,
+        'hostname': host.hostname,
+        'metric': metric,
+        'match': {**match, 'created_time': created_time.isoformat() if created_time else None},
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket
     }
-    return Response(response_data)
+    return _series_response(header, process_metric_series(host, metric, start, end, bucket, **match))
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def host_export(request, host_id):
+    # Streams every process and system snapshot of a host in [start, end) as NDJSON
+    host = get_object_or_404(Host, id=host_id)
+    try:
+        end = parse_datetime_param(request.query_params, 'end', timezone.now())
+        start = parse_datetime_param(request.query_params, 'start', end - DEFAULT_RANGE)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if start >= end:
+        return Response({'error': "'start' must be before 'end'"}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(export_ndjson(host, start, end), content_type='application/x-ndjson')
+    filename = f"{host.hostname}-{start:%Y%m%dT%H%M%S}-{end:%Y%m%dT%H%M%S}.ndjson"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -168,67 +303,114 @@ def host_system_by_name(request, hostname):
     return host_system_info(request, host.id)
 
 @api_view(['POST'])
-@permission_classes([AllowAny])
+@authentication_classes([APIKeyAuthentication])
+@permission_classes([HasAPIKey])
 def submit_process_data(request):
     # Receives and saves process and system data from agent
-    data = request.data
-    with transaction.atomic():
-        host, _ = Host.objects.get_or_create(
-            hostname=data.get('hostname', 'Unknown')
-        )
-        host.last_seen = timezone.now()
-        host.save()
-        if 'system_info' in data:
-            system_info = data['system_info']
-            SystemSnapshot.objects.create(
-                host=host,
-                timestamp=data.get('timestamp', timezone.now()),
-                operating_system=system_info.get('operating_system', 'Unknown'),
-                processor=system_info.get('processor', 'Unknown'),
-                processor_cores=system_info.get('processor_cores', 0),
-                processor_threads=system_info.get('processor_threads', 0),
-                ram_total_gb=system_info.get('ram_total_gb', 0.0),
-                ram_used_gb=system_info.get('ram_used_gb', 0.0),
-                ram_available_gb=system_info.get('ram_available_gb', 0.0),
-                storage_total_gb=system_info.get('storage_total_gb', 0.0),
-                storage_used_gb=system_info.get('storage_used_gb', 0.0),
-                storage_free_gb=system_info.get('storage_free_gb', 0.0)
-            )
-        snapshot = ProcessSnapshot.objects.create(
-            host=host,
-            timestamp=data.get('timestamp', timezone.now())
-        )
-        processes_data = data.get('processes', [])
-        for proc_data in processes_data:
-            Process.objects.create(
-                info=snapshot,
-                pid=proc_data.get('pid', 0),
-                name=proc_data.get('name', 'Unknown'),
-                parent_pid=proc_data.get('parent_pid'),
-                cpu_percent=proc_data.get('cpu_percent', 0.0),
-                memory_percent=proc_data.get('memory_percent', 0.0),
-                memory_mb=proc_data.get('memory_mb', 0.0),
-                status=proc_data.get('status', 'running'),
-                username=proc_data.get('username'),
-                command_line=proc_data.get('command_line', ''),
-                created_time=proc_data.get('created_time')
-            )
-    return Response({
+    try:
+        result = ingest_payload(request.data)
+    except BaselineMismatch as e:
+        logger.warning(str(e))
+        return Response({
+            'error': 'Delta baseline mismatch',
+            'resend_baseline': True,
+            'last_sequence': e.host.last_sequence
+        }, status=status.HTTP_409_CONFLICT)
+    except ValueError as e:
+        logger.warning(f"Rejected submission: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    get_response_cache().invalidate_host(result['host'].id)
+    logger.info(
+        f"Ingested {result['processes_count']} processes for {result['host'].hostname} "
+        f"in {result['timings']['total_ms']} ms"
+    )
+    return Response(_submission_result(result))
+
+def _submission_result(result):
+    return {
         'message': 'Process data received successfully',
-        'hostname': host.hostname,
-        'processes_count': len(processes_data)
+        'hostname': result['host'].hostname,
+        'processes_count': result['processes_count'],
+        'sequence': result['sequence'],
+        'inventory_required': result['inventory_required'],
+        'timings': result['timings']
+    }
+
+@api_view(['POST'])
+@authentication_classes([APIKeyAuthentication])
+@permission_classes([HasAPIKey])
+def submit_batch_data(request):
+    # Receives several agent reports, from one or many hosts, and saves them in one transaction
+    reports = request.data.get('reports') if isinstance(request.data, dict) else None
+    if not isinstance(reports, list) or not reports:
+        return Response({'error': "'reports' must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    max_reports = getattr(settings, 'PROCESS_MONITOR_MAX_BATCH_REPORTS', 100)
+    if len(reports) > max_reports:
+        return Response({'error': f"At most {max_reports} reports per batch"}, status=status.HTTP_400_BAD_REQUEST)
+    results, timings = ingest_batch(reports)
+    cache = get_response_cache()
+    for host_id in {item['host_id'] for item in results if item['status'] == status.HTTP_200_OK}:
+        cache.invalidate_host(host_id)
+    results = [{'index': index, **item} for index, item in enumerate(results)]
+    accepted = sum(1 for item in results if item['status'] == status.HTTP_200_OK)
+    return Response({
+        'accepted': accepted,
+        'rejected': len(results) - accepted,
+        'results': results,
+        'timings': timings
     })
 
+async def submit_process_data_queued(request):
+    # Validates a full report, queues it for the writer threads and answers 202 without
+    # waiting for the database; 429 with Retry-After when the queue is full
+    if request.method != 'POST':
+        return JsonResponse({'error': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        # Cache misses and last_used flushes query the database
+        if await sync_to_async(authenticate_api_key)(request.headers.get(API_KEY_HEADER)) is None and api_key_required():
+            raise NotAuthenticated('API key required')
+        report = validate_report(parse_request(request))
+    except APIException as e:
+        response = JsonResponse({'error': str(e.detail)}, status=e.status_code)
+        if e.status_code == status.HTTP_401_UNAUTHORIZED:
+            response['WWW-Authenticate'] = API_KEY_HEADER
+        return response
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    ingest_queue = get_ingest_queue()
+    if not ingest_queue.submit(report):
+        retry_after = ingest_queue.retry_after()
+        response = JsonResponse(
+            {'error': 'Ingest queue is full', 'retry_after': retry_after},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        response['Retry-After'] = str(retry_after)
+        return response
+    return JsonResponse({
+        'message': 'Process data queued',
+        'hostname': report['hostname'],
+        'processes_count': len(report['processes']),
+        'queue_depth': ingest_queue.depth()
+    }, status=status.HTTP_202_ACCEPTED)
+
+# Django 4.2's csrf_exempt decorator would turn the coroutine into a sync view
+submit_process_data_queued.csrf_exempt = True
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def system_status(request):
-    # Returns overall system status and counts
-    total_hosts = Host.objects.count()
-    total_snapshots = ProcessSnapshot.objects.count()
-    total_processes = Process.objects.count()
+    # Returns overall system status from maintained counters (no COUNT(*) scans),
+    # plus ingest rates and host heartbeat lag
+    now = timezone.now()
+    totals = status_counters()
     return Response({
-        'total_hosts': total_hosts,
-        'total_snapshots': total_snapshots,
-        'total_processes': total_processes,
+        'total_hosts': totals['hosts'],
+        'total_snapshots': totals['process_snapshots'],
+        'total_processes': totals['processes'],
+        'total_system_snapshots': totals['system_snapshots'],
+        'counters_reconciled_at': totals['reconciled_at'].isoformat() if totals['reconciled_at'] else None,
+        'ingest': ingest_rates(now),
+        'heartbeat': heartbeat_stats(now),
+        'ingest_queue': ingest_queue_metrics(),
         'status': 'healthy'
-    })
\ No newline at end of file
+    })
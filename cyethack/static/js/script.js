@@ -6,7 +6,8 @@ let expandedProcesses = {};
 
 const API_ENDPOINTS = {
     hosts: '/api/hosts/',
-    processTree: '/api/hosts/{host_id}/processes/latest/', 
+    hostSummary: '/api/hosts/?summary=1&top=0',
+    processTree: '/api/hosts/{host_id}/processes/latest/?view=stream',
     systemInfo: '/api/hosts/{host_id}/system/latest/',    
     systemStatus: '/api/status/',                          
     submitData: '/api/submit/'                              
@@ -49,12 +50,24 @@ function setupEventListeners() {
     });
 }
 
+// Walks the keyset-paginated host summary
+async function fetchAllHosts() {
+    let hosts = [];
+    let after = null;
+    do {
+        const url = after === null ? API_ENDPOINTS.hostSummary : `${API_ENDPOINTS.hostSummary}&after=${after}`;
+        const response = await fetch(url);
+        if (!response.ok) throw new Error('Failed to fetch hosts');
+        const page = await response.json();
+        hosts = hosts.concat(page.results);
+        after = page.next_after;
+    } while (after !== null);
+    return hosts;
+}
+
 async function loadHosts() {
     try {
-        const response = await fetch(API_ENDPOINTS.hosts);
-        if (!response.ok) throw new Error('Failed to fetch hosts');
-        
-        const hosts = await response.json();
+        const hosts = await fetchAllHosts();
         const hostSelect = document.getElementById('hostSelect');
         const hostList = document.getElementById('hostList');
         hostSelect.innerHTML = '<option value="">Select a host...</option>';
@@ -429,10 +442,7 @@ function showError(message) {
 // helper
 async function getHostId(hostname) {
     try {
-        const response = await fetch(API_ENDPOINTS.hosts);
-        if (!response.ok) throw new Error('Failed to fetch hosts');
-        
-        const hosts = await response.json();
+        const hosts = await fetchAllHosts();
         const host = hosts.find(h => h.hostname === hostname);
         return host ? host.id : null;
     } catch (error) {